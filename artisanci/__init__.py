@@ -18,7 +18,11 @@ from .builders import (BaseBuilder,
                        VirtualBoxBuilder)
 from .workers import (Command,
                       Worker)
-from .yml import ArtisanYml
+from .yml import ArtisanYml, JobSpec
+from .farm import Farm
+from .policy import BasePolicy, Schedule, TimePolicy
+from .redis_queue import RedisJobQueue
+from .scheduler import RuntimeHistory, Scheduler
 
 __copyright__ = """
           Copyright (c) 2017 Seth Michael Larson
@@ -45,11 +49,19 @@ __all__ = [
     'ArtisanYml',
     'BaseBuilder',
     'BaseBuild',
+    'BasePolicy',
     'Command',
+    'Farm',
     'GitBuild',
+    'JobSpec',
     'LocalBuilder',
     'LocalBuild',
     'MercurialBuild',
+    'RedisJobQueue',
+    'RuntimeHistory',
+    'Schedule',
+    'Scheduler',
+    'TimePolicy',
     'VirtualBoxBuilder',
     'Worker'
 ]
@@ -14,33 +14,122 @@
 
 """ Module for the base Builder interface. """
 
+import itertools
 import multiprocessing
-from ..compat import Semaphore
+import os
+import pickle
+import threading
+import traceback
+from ..compat import Lock, Semaphore, monotonic
 from ..watchable import Watchable
 
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
 __all__ = [
     'BaseBuilder'
 ]
 
+# Number of seconds between checking that the build processes are alive.
+_LIVENESS_INTERVAL = 1.0
+
+
+class BuildHandle(object):
+    """ Handle that is completed once a build that was
+    given to :meth:`artisan.BaseBuilder.execute_build` finishes. """
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self._event = threading.Event()
+
+    @property
+    def done(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Waits for the build to finish.
+
+        :param float timeout: Number of seconds to wait for.
+        :returns: True if the build finished, False otherwise.
+        """
+        # Python 2.x returns None from Event.wait() instead of the flag.
+        self._event.wait(timeout)
+        return self._event.is_set()
+
+    def _complete(self, result, error):
+        self.result = result
+        self.error = error
+        self._event.set()
+
 
 class BaseBuilder(Watchable):
     """ Interface for Executors which setup and teardown the
-    environment that a worker executes a job inside of. """
-    def __init__(self, python, builders):
+    environment that a worker executes a job inside of.
+
+    Builds are executed by a pool of ``builders`` long-lived processes
+    that take builds from a queue. At most ``max_queued`` builds may be
+    waiting in the queue at once before :meth:`artisan.BaseBuilder.execute_build`
+    blocks until one of the running builds completes.
+
+    The processes are started by :meth:`artisan.BaseBuilder.start` or by the
+    first build and have already imported everything a build needs so builds
+    don't pay the cost of starting a process. A process is replaced by a fresh
+    one after it has executed ``max_builds_per_process`` builds or once its
+    memory usage has grown by more than ``max_memory_growth`` bytes.
+
+    :param str python: Path to the Python interpreter to use for builds.
+    :param int builders: Number of builds to execute at the same time.
+    :param int max_queued: Number of builds that can wait for a free builder.
+        Defaults to the same as ``builders``.
+    :param int max_builds_per_process:
+        Number of builds a process executes before it is replaced.
+        ``None`` never replaces processes because of the number of builds.
+    :param int max_memory_growth:
+        Number of bytes the memory usage of a process can grow by before it
+        is replaced. ``None`` never replaces processes because of memory usage.
+    """
+    def __init__(self, python, builders, max_queued=None,
+                 max_builds_per_process=None, max_memory_growth=None):
         super(BaseBuilder, self).__init__()
         if not isinstance(python, str):
             raise TypeError('`python` must be of type `str`.')
         if not isinstance(builders, int):
             raise TypeError('`builders` must be of type `int`.')
+        if max_queued is None:
+            max_queued = builders
+        if not isinstance(max_queued, int):
+            raise TypeError('`max_queued` must be of type `int`.')
+        if builders < 1:
+            raise ValueError('`builders` must be at least 1.')
+        if max_queued < 0:
+            raise ValueError('`max_queued` must not be negative.')
+        if max_builds_per_process is not None and max_builds_per_process < 1:
+            raise ValueError('`max_builds_per_process` must be at least 1.')
 
         self.python = python
         self.builders = builders
+        self.max_queued = max_queued
+        self.max_builds_per_process = max_builds_per_process
+        self.max_memory_growth = max_memory_growth
         self._semaphore = None
 
-    def acquire(self):
+        self._lock = Lock()
+        self._shutting_down = False
+        self._processes = []
+        self._jobs = None
+        self._results = None
+        self._collector = None
+        self._handles = {}
+        self._in_flight = {}
+        self._counter = itertools.count()
+
+    def acquire(self, blocking=False, timeout=None):
         if self._semaphore is None:
-            self._semaphore = Semaphore(self.builders)
-        success = self._semaphore.acquire(blocking=False)
+            self._semaphore = Semaphore(self.builders + self.max_queued)
+        success = self._semaphore.acquire(blocking=blocking, timeout=timeout)
         if success:
             self.notify_watchers('acquire', None)
         return success
@@ -59,22 +148,239 @@ class BaseBuilder(Watchable):
         # environment is **strongly** discouraged.
         return False
 
-    def execute_build(self, build):
-        self.acquire()
-        proc = multiprocessing.Process(target=self._build_target, args=(build,))
-        proc.start()
+    def execute_build(self, build, blocking=True, timeout=None):
+        """
+        Queues a build to be executed by one of the builder's processes.
+
+        :param artisan.BaseBuild build: Build to execute.
+        :param bool blocking:
+            If True will wait for space in the queue if it is full.
+        :param float timeout: Number of seconds to wait for space in the queue.
+        :returns: True if the build was queued, False if the queue is full.
+        """
+        if not self.acquire(blocking=blocking, timeout=timeout):
+            return False
+        try:
+            self.start()
+            # Pickle now rather than in the queue's feeder thread
+            # so that errors are raised to the caller.
+            data = pickle.dumps(build, pickle.HIGHEST_PROTOCOL)
+            handle = BuildHandle()
+            with self._lock:
+                token = next(self._counter)
+                self._handles[token] = (build, handle)
+            build._handle = handle
+            self._jobs.put((token, data))
+        except Exception:
+            self.release()
+            raise
         self.notify_watchers('execute_build', build)
-        build._proc = proc
-        self._build_target(build)
-        build._builder = self
+        return True
+
+    def start(self):
+        """ Starts the builder's processes ahead of the first build.
+        Does nothing if the processes are already running. """
+        with self._lock:
+            if self._jobs is not None:
+                return
+            self._shutting_down = False
+            self._jobs = multiprocessing.Queue()
+            self._results = multiprocessing.Queue()
+            for _ in range(self.builders):
+                self._start_process()
+            self._collector = threading.Thread(target=self._collect_results,
+                                               args=(self._results,))
+            self._collector.daemon = True
+            self._collector.start()
+
+    def shutdown(self, wait=True):
+        """
+        Stops all of the builder's processes once the queued builds are complete.
+
+        :param bool wait: If True will wait for the processes to exit.
+        """
+        with self._lock:
+            if self._jobs is None:
+                return
+            self._shutting_down = True
+            processes = list(self._processes)
+            for _ in processes:
+                self._jobs.put(None)
+        if wait:
+            for process in processes:
+                process.join()
+            self._results.put(None)
+            self._collector.join()
+        with self._lock:
+            self._processes = []
+            self._jobs = None
+
+    def _start_process(self):
+        process = multiprocessing.Process(target=_build_process,
+                                          args=(self, self._jobs, self._results))
+        process.daemon = True
+        process.start()
+        self._processes.append(process)
+
+    def _collect_results(self, results):
+        next_check = monotonic() + _LIVENESS_INTERVAL
+        while True:
+            try:
+                result = results.get(timeout=_LIVENESS_INTERVAL)
+            except Empty:
+                result = False
+            if result is None:
+                break
+            if result:
+                self._handle_result(result)
+            if monotonic() >= next_check:
+                next_check = monotonic() + _LIVENESS_INTERVAL
+                self._check_processes(results)
+
+    def _handle_result(self, result):
+        if result[0] == 'start':
+            _, token, pid = result
+            with self._lock:
+                self._in_flight[pid] = token
+        elif result[0] == 'recycle':
+            self._recycle_process(result[1])
+        else:
+            _, token, build_result, error, pid = result
+            with self._lock:
+                if self._in_flight.get(pid) == token:
+                    del self._in_flight[pid]
+            self._complete_build(token, build_result, error)
+
+    def _complete_build(self, token, build_result, error):
+        with self._lock:
+            build, handle = self._handles.pop(token, (None, None))
+        if handle is None:
+            return
+        build.result = build_result
+        handle._complete(build_result, error)
+        self.release()
+        self.notify_watchers('complete_build', build)
+
+    def _check_processes(self, results):
+        """ Fails the build of any process that died without reporting
+        a result, for example from a crash or being killed for using
+        too much memory, and starts a process to replace it. """
+        with self._lock:
+            if self._shutting_down:
+                return
+            dead = [process for process in self._processes if not process.is_alive()]
+        if not dead:
+            return
+
+        # Results sent just before the process exited are handled first.
+        while True:
+            try:
+                result = results.get_nowait()
+            except Empty:
+                break
+            if result is None:
+                results.put(None)
+                break
+            self._handle_result(result)
+
+        for process in dead:
+            with self._lock:
+                if process not in self._processes:
+                    continue
+                self._processes.remove(process)
+                token = self._in_flight.pop(process.pid, None)
+                if not self._shutting_down:
+                    self._start_process()
+            if token is not None:
+                self._complete_build(token, 'failure',
+                                     'The build process exited unexpectedly '
+                                     'with exit code `%s`.' % process.exitcode)
+
+    def _recycle_process(self, pid):
+        """ Replaces a process that exited after reaching its limits. """
+        with self._lock:
+            for process in self._processes:
+                if process.pid == pid:
+                    process.join()
+                    self._processes.remove(process)
+                    break
+            self._in_flight.pop(pid, None)
+            if not self._shutting_down:
+                self._start_process()
+
+    def _warm_up(self):
+        """ Called in each build process before it starts taking builds
+        to import or prepare anything that every build would need. """
+        pass
+
+    def _cool_down(self):
+        """ Called in each build process once it stops taking builds
+        to release anything that was prepared by ``_warm_up``. """
+        pass
 
     def _build_target(self, build):
         raise NotImplementedError()
 
     def __getstate__(self):
-        __dict__ = self.__dict__.copy()
-        __dict__['_semaphore'] = None
+        __dict__ = super(BaseBuilder, self).__getstate__()
+        for key in ['_semaphore', '_lock', '_processes', '_jobs',
+                    '_results', '_collector', '_handles', '_in_flight', '_counter']:
+            __dict__[key] = None
+        # Builder events are only sent from the process that
+        # owns the builder so the watchers are left behind.
+        __dict__['_watchers'] = []
         return __dict__
 
     def __setstate__(self, state):
         self.__dict__.update(state)
+        self._lock = Lock()
+
+
+def _build_process(builder, jobs, results):
+    """ Target of the long-lived processes that execute builds. """
+    builder._warm_up()
+    try:
+        _take_builds(builder, jobs, results)
+    finally:
+        builder._cool_down()
+
+
+def _take_builds(builder, jobs, results):
+    memory_usage = None
+    if builder.max_memory_growth is not None:
+        import psutil
+        memory_usage = psutil.Process().memory_info().rss
+    builds = 0
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        token, data = job
+        results.put(('start', token, os.getpid()))
+        result = None
+        error = None
+        build = None
+        try:
+            build = pickle.loads(data)
+            builder._build_target(build)
+            result = build.result
+        except BaseException:
+            # Builds that call sys.exit() are failures too.
+            result = 'failure'
+            error = traceback.format_exc()
+        if build is not None:
+            try:
+                build.notify_watchers('complete', result)
+            except Exception:
+                pass
+            build.close_watchers()
+        results.put(('result', token, result, error, os.getpid()))
+
+        builds += 1
+        if ((builder.max_builds_per_process is not None and
+                builds >= builder.max_builds_per_process) or
+                (memory_usage is not None and psutil.Process().memory_info().rss -
+                 memory_usage > builder.max_memory_growth)):
+            results.put(('recycle', os.getpid()))
+            break
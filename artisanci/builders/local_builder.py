@@ -30,13 +30,54 @@ class LocalBuilder(BaseBuilder):
 
      .. warning::
          This builder is not safe for Community jobs.
+
+    :param artisan.VirtualenvCache virtualenv_cache:
+        Optional cache of virtualenvs to share between
+        the builds that are run by this builder.
+    :param artisan.GitMirrorCache git_cache:
+        Optional cache of Git repositories to clone
+        :class:`artisan.GitBuild` projects from.
+    :param artisan.MercurialCache mercurial_cache:
+        Optional cache of Mercurial repositories to clone
+        :class:`artisan.MercurialBuild` projects from.
+    :param artisan.SnapshotCache snapshot_cache:
+        Optional cache of snapshots to link
+        :class:`artisan.LocalBuild` projects from.
+    :param int max_builds_per_process:
+        Number of builds a process executes before it is replaced.
+    :param int max_memory_growth:
+        Number of bytes the memory usage of a process can
+        grow by before it is replaced. Requires ``psutil``.
     """
-    def __init__(self, builders=1, python=sys.executable):
-        super(LocalBuilder, self).__init__(builders=builders, python=python)
+    def __init__(self, builders=1, python=sys.executable, virtualenv_cache=None,
+                 git_cache=None, mercurial_cache=None, snapshot_cache=None,
+                 max_builds_per_process=None, max_memory_growth=None):
+        super(LocalBuilder, self).__init__(builders=builders, python=python,
+                                           max_builds_per_process=max_builds_per_process,
+                                           max_memory_growth=max_memory_growth)
+        self.virtualenv_cache = virtualenv_cache
+        self.git_cache = git_cache
+        self.mercurial_cache = mercurial_cache
+        self.snapshot_cache = snapshot_cache
+
+    def _warm_up(self):
+        # Import everything that builds use up front so
+        # that the first build of a process doesn't wait on it.
+        import artisanci.builds  # noqa: F401
+        import artisanci.caches  # noqa: F401
+        import artisanci.yml  # noqa: F401
 
     def _build_target(self, build):
         worker = Worker()
         worker.build = build
+        if self.virtualenv_cache is not None:
+            build.virtualenv_cache = self.virtualenv_cache
+        if self.git_cache is not None and build.build_type == 'git':
+            build.git_cache = self.git_cache
+        if self.mercurial_cache is not None and build.build_type == 'mercurial':
+            build.mercurial_cache = self.mercurial_cache
+        if self.snapshot_cache is not None and build.build_type == 'local':
+            build.snapshot_cache = self.snapshot_cache
         build.fetch_project(worker)
         build.setup_project(worker)
         build.execute_project(worker)
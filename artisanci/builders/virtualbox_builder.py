@@ -14,23 +14,47 @@
 
 """ Module for the virtualized builder using VirtualBox API. """
 
+import collections
 from contextlib import contextmanager
+import logging
 import random
 import os
 import semver
 import shutil
 import string
+import threading
 import time
 import virtualbox
 from virtualbox import VirtualBox, Session
-from virtualbox.library import CleanupMode, ClipboardMode, DnDMode, DeviceType, LockType
+from virtualbox.library import (CleanupMode, ClipboardMode, DnDMode, DeviceType,
+                                LockType, MachineState, ProcessCreateFlag, ProcessPriority,
+                                ProcessStatus, ProcessWaitForFlag)
 from .base_builder import BaseBuilder
+from ..compat import Lock, monotonic
 from ..exceptions import ArtisanException, ArtisanSecurityException
 
 __all__ = [
     'VirtualBoxBuilder'
 ]
 _MINIMUM_VIRTUALBOX_VERSION = '5.1.14'
+_CLEAN_SNAPSHOT = 'artisanci-clean'
+
+# Default number of bytes of guest output to stream before cancelling a build.
+DEFAULT_MAX_OUTPUT = 64 * 1024 * 1024
+
+# Maximum number of bytes to read from the guest at once and
+# milliseconds to wait for the guest process to do something.
+_CHUNK_SIZE = 64 * 1024
+_POLL_MS = 200
+_RUNNING_STATUSES = [ProcessStatus.starting, ProcessStatus.started,
+                     ProcessStatus.paused, ProcessStatus.terminating]
+
+# Number of seconds to wait before filling the pool again after a clone
+# fails to be created, doubled for every failure in a row up to the maximum.
+_FILL_BACKOFF = 1.0
+_MAX_FILL_BACKOFF = 60.0
+
+_logger = logging.getLogger(__name__)
 
 
 class VirtualBoxBuilder(BaseBuilder):
@@ -63,8 +87,21 @@ class VirtualBoxBuilder(BaseBuilder):
 
         These steps are taken from the `VirtualBox Manual Chapter 13
         <https://www.virtualbox.org/manual/ch13.html>`_.
+
+    :param int pool_size:
+        Number of booted clones of the machine that each of the
+        builder's processes keeps ready for its next build.
+    :param bool recycle:
+        If True clones are restored to their clean snapshot and reused
+        after a build instead of being deleted.
+    :param int max_reuse: Number of builds a recycled clone is used for.
+    :param int max_output:
+        Number of bytes of output from the guest to send to the build's
+        watchers. The build is cancelled if the guest outputs more than this.
+        ``None`` allows any amount of output.
     """
-    def __init__(self, machine, username, password, python, builders=1):
+    def __init__(self, machine, username, password, python, builders=1, pool_size=0,
+                 recycle=False, max_reuse=10, max_output=DEFAULT_MAX_OUTPUT):
         super(VirtualBoxBuilder, self).__init__(python=python, builders=builders)
 
         # Check that the VirtualBox version being used is
@@ -85,64 +122,323 @@ class VirtualBoxBuilder(BaseBuilder):
         self.machine = machine
         self.username = username
         self.password = password
+        self.max_output = max_output
 
-        self._pool = MachinePool(self.machine)
+        self._pool = MachinePool(self.machine, size=pool_size,
+                                 recycle=recycle, max_reuse=max_reuse)
         self._session = None
 
     @property
     def is_secure(self):
         return self._pool.is_secure
 
+    def _warm_up(self):
+        self._pool.start()
+
+    def _cool_down(self):
+        self._pool.close()
+
     def _build_target(self, job):
         self._session = self._pool.acquire()
         console = self._session.console
         guest = console.guest
+        exit_code = None
         try:
             guest_session = guest.create_session(self.username,
                                                  self.password,
                                                  timeout_ms=5 * 60 * 1000)
-            guest_session.run(self.python, ['-m', 'artisanci'] + job.as_args())
-            guest_session.close()
-        except Exception:
-            pass
-        machine_dir = os.path.dirname(self._session.machine.snapshot_folder)
-        if self._pool is not None:
+            try:
+                arguments = [self.python, '-m', 'artisanci'] + job.as_args()
+                process = guest_session.process_create_ex(self.python, arguments, [],
+                                                          [ProcessCreateFlag.wait_for_std_out,
+                                                           ProcessCreateFlag.wait_for_std_err],
+                                                          0, ProcessPriority.default, [])
+                exit_code = _stream_guest_process(job, process, self.max_output)
+            finally:
+                guest_session.close()
+        finally:
             if self._session is not None:
                 self._pool.release(self._session)
                 self._session = None
-            self._pool = None
-        for _ in range(10):
-            try:
-                shutil.rmtree(machine_dir)
-                break
-            except OSError:
-                time.sleep(1.0)
+        job._set_status('success' if exit_code == 0 else 'failure')
 
 
 class MachinePool(object):
-    def __init__(self, machine):
+    """ Pool of pre-booted linked clones of a VirtualBox machine.
+
+    Clones are linked to a snapshot of the base machine so creating one
+    doesn't copy the base machine's disks. Up to ``size`` clones are created
+    and booted in the background ahead of time so that
+    :meth:`artisan.MachinePool.acquire` can hand one out immediately, and
+    the pool is topped back up in the background every time one is taken.
+    Clones are linked to the base machine's current snapshot. If the base
+    machine has changed since that snapshot a new one is taken so that
+    clones always start from the base machine as it is now. The base
+    machine is only locked while a snapshot is being taken.
+
+    With ``recycle`` each clone takes a clean snapshot of itself before it's
+    first booted. A released clone is then powered down, restored to that
+    snapshot and booted again in the background instead of being deleted, so
+    no disks are copied or deleted between builds. Clones that fail the health
+    check or have been used ``max_reuse`` times are deleted instead.
+
+    :param str machine: Name of the base machine to clone.
+    :param int size: Number of booted clones to keep ready.
+    :param str snapshot: Name of the snapshots that are taken of the base machine.
+    :param str frontend: Frontend to launch the clones with.
+    :param vbox: VirtualBox API object to use, defaults to ``virtualbox.VirtualBox()``.
+    :param session_factory: Callable that creates new sessions,
+        defaults to ``virtualbox.Session``.
+    :param bool recycle: If True released clones are restored and reused.
+    :param int max_reuse: Number of times a clone is used before it's deleted.
+    :param health_check: Callable that is given the session of a recycled
+        clone and returns False if it shouldn't be used again. Defaults to
+        checking that the clone is running.
+    """
+    def __init__(self, machine, size=0, snapshot='artisanci-base', frontend='gui',
+                 vbox=None, session_factory=None, recycle=False, max_reuse=10,
+                 health_check=None):
+        if not isinstance(size, int):
+            raise TypeError('`size` must be of type `int`.')
+        if size < 0:
+            raise ValueError('`size` must not be negative.')
+        if max_reuse < 1:
+            raise ValueError('`max_reuse` must be at least 1.')
         self.machine = machine
+        self.size = size
+        self.snapshot = snapshot
+        self.frontend = frontend
+        self.recycle = recycle
+        self.max_reuse = max_reuse
+        self.health_check = health_check or _is_running
         self._is_secure = False
 
-    def acquire(self, frontend='gui'):
+        self._vbox = vbox
+        self._session_factory = session_factory or Session
+        self._init_pool()
+
+    def _init_pool(self):
+        self._condition = threading.Condition()
+        self._idle = collections.deque()
+        self._pending = 0
+        self._leased = 0
+        self._closed = False
+        self._failures = 0
+        self._retry_at = None
+        self._retry = None
+        self._snapshot_lock = Lock()
+        self._uses = {}
+        self._machines = {}
+
+    def start(self):
+        """ Starts creating clones in the background
+        to fill the pool without waiting for them. """
+        with self._condition:
+            self._closed = False
+            self._replenish()
+
+    def acquire(self, timeout=None):
+        """
+        Takes a booted clone out of the pool, creating one if the pool is
+        empty and none are on the way. Once clones fail to be created in the
+        background the clone is always created here so the error is raised.
+
+        :param float timeout: Number of seconds to wait for a clone to boot.
+        :returns: Session of the clone.
+        """
         if self._is_secure is None:
             self.run_security_check()
-        with self._lock() as root_session:
-            machine = root_session.machine
-            token = ''.join(random.choice(string.ascii_letters) for _ in range(32))
-            clone = machine.clone(name='%s clone-%s' % (self.machine, token))
-            p = clone.launch_vm_process(type_p=frontend)
-            p.wait_for_completion(60000)
-            session = clone.create_session()
-            return session
+        session = None
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._condition:
+            while not self._idle and self._pending and not self._failures:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise ArtisanException('Timed out waiting for a clone of '
+                                           '`%s` to become ready.' % self.machine)
+                self._condition.wait(remaining)
+            if self._idle:
+                session = self._idle.popleft()
+            if self.recycle:
+                self._leased += 1
+            self._replenish()
+        if session is None:
+            session = self._create_clone()
+            with self._condition:
+                if self._failures:
+                    # Creating clones works again so the pool can be filled.
+                    self._failures = 0
+                    self._retry_at = None
+                    self._replenish()
+        return session
 
     def release(self, session):
-        with self._lock():
-            clone = self._power_down(session)
+        """
+        Powers down and deletes a clone that was taken out of the pool.
+        If the pool recycles clones it's instead restored and returned to
+        the pool in the background unless it has reached ``max_reuse``.
+
+        :param session: Session of the clone.
+        :returns: The clone.
+        """
+        clone = self._power_down(session)
+        with self._condition:
+            uses = self._uses.pop(clone.name, 0) + 1
+            if self.recycle and self._leased:
+                self._leased -= 1
+            if self.recycle and uses < self.max_reuse and not self._closed:
+                self._uses[clone.name] = uses
+                self._pending += 1
+                thread = threading.Thread(target=self._fill, args=(clone,))
+                thread.daemon = True
+                thread.start()
+                return clone
+            self._replenish()
+        self._destroy(clone)
+        return clone
+
+    def close(self):
+        """ Stops refilling the pool and deletes all clones in it. """
+        with self._condition:
+            self._closed = True
+            if self._retry is not None:
+                self._retry.cancel()
+                self._retry = None
+            while self._pending:
+                self._condition.wait()
+            sessions = list(self._idle)
+            self._idle.clear()
+        # Idle clones aren't leased so they're destroyed
+        # directly rather than released back to the pool.
+        for session in sessions:
+            self._forget(session.machine.name)
+            self._destroy(self._power_down(session))
+
+    def _replenish(self):
+        """ Starts creating enough clones to fill the
+        pool. Must be called while holding the condition.
+        Clones that will be recycled count towards the pool. After
+        a clone fails to be created this waits for the backoff. """
+        if self._retry_at is not None:
+            delay = self._retry_at - monotonic()
+            if delay > 0:
+                if self._retry is None and not self._closed:
+                    self._retry = threading.Timer(delay, self._retry_replenish)
+                    self._retry.daemon = True
+                    self._retry.start()
+                return
+        while (not self._closed and
+               len(self._idle) + self._pending + self._leased < self.size):
+            self._pending += 1
+            thread = threading.Thread(target=self._fill)
+            thread.daemon = True
+            thread.start()
+
+    def _retry_replenish(self):
+        with self._condition:
+            self._retry = None
+            self._replenish()
+
+    def _fill(self, clone=None):
+        session = None
+        failed = False
         try:
-            session.unlock_machine()
+            if clone is None:
+                session = self._create_clone()
+            else:
+                session = self._restore_clone(clone)
         except Exception:
-            pass
+            _logger.exception('Failed to prepare a clone of `%s`.', self.machine)
+            failed = True
+        with self._condition:
+            self._pending -= 1
+            if failed:
+                self._failures += 1
+                self._retry_at = monotonic() + min(_MAX_FILL_BACKOFF,
+                                                   _FILL_BACKOFF * 2 ** min(self._failures - 1, 6))
+            elif session is not None:
+                self._failures = 0
+                self._retry_at = None
+            keep = (session is not None and not self._closed and
+                    len(self._idle) < max(self.size, 1))
+            if keep:
+                self._idle.append(session)
+            else:
+                self._replenish()
+            self._condition.notify_all()
+        if session is not None and not keep:
+            self._forget(session.machine.name)
+            self._destroy(self._power_down(session))
+
+    def _create_clone(self):
+        """ Creates a linked clone of the snapshot and boots it. """
+        snapshot = self._find_snapshot()
+        token = ''.join(random.choice(string.ascii_letters) for _ in range(32))
+        clone = snapshot.machine.clone(snapshot_name_or_id=snapshot,
+                                       name='%s clone-%s' % (self.machine, token))
+        try:
+            if self.recycle:
+                with self._lock(clone.name) as session:
+                    p, _ = session.machine.take_snapshot(_CLEAN_SNAPSHOT,
+                                                         'Clean state of the clone.', False)
+                    p.wait_for_completion(-1)
+            return self._boot(clone)
+        except Exception:
+            self._destroy(clone)
+            raise
+
+    def _restore_clone(self, clone):
+        """ Restores a powered down clone to its clean
+        snapshot and boots it if it's still healthy. """
+        try:
+            with self._lock(clone.name) as session:
+                snapshot = session.machine.find_snapshot(_CLEAN_SNAPSHOT)
+                p = session.machine.restore_snapshot(snapshot)
+                p.wait_for_completion(-1)
+            session = self._boot(clone)
+        except Exception:
+            self._forget(clone.name)
+            self._destroy(clone)
+            raise
+        if not self.health_check(session):
+            self._forget(clone.name)
+            self._destroy(self._power_down(session))
+            return None
+        return session
+
+    def _forget(self, name):
+        """ Stops counting the uses of a clone that is being destroyed. """
+        with self._condition:
+            self._uses.pop(name, None)
+
+    def _boot(self, clone):
+        p = clone.launch_vm_process(type_p=self.frontend)
+        p.wait_for_completion(60000)
+        return clone.create_session()
+
+    def _find_snapshot(self):
+        """ Finds the snapshot that clones are linked to, taking a new one
+        if the base machine has no snapshot or has changed since its current one. """
+        with self._snapshot_lock:
+            # Reading the current snapshot doesn't need the machine to be locked.
+            snapshot = _unchanged_snapshot(self._find_machine(self.machine))
+            if snapshot is not None:
+                return snapshot
+            with self._lock() as root_session:
+                machine = root_session.machine
+                # Another process may have taken the snapshot while waiting for the lock.
+                snapshot = _unchanged_snapshot(machine)
+                if snapshot is None:
+                    p, _ = machine.take_snapshot(self.snapshot,
+                                                 'Base of Artisan CI clones.', False)
+                    p.wait_for_completion(-1)
+                    snapshot = machine.current_snapshot
+            return snapshot
+
+    def _destroy(self, clone):
+        self._machines.pop(clone.name, None)
+        _discard_machine_lock(clone.name)
+        machine_dir = os.path.dirname(clone.snapshot_folder)
         while True:
             try:
                 mediums = clone.unregister(CleanupMode.full)
@@ -151,7 +447,39 @@ class MachinePool(object):
                 break
             except Exception:
                 time.sleep(0.3)
-        return clone
+        for _ in range(10):
+            if not os.path.exists(machine_dir):
+                break
+            try:
+                shutil.rmtree(machine_dir)
+                break
+            except OSError:
+                time.sleep(1.0)
+
+    def _get_vbox(self):
+        if self._vbox is None:
+            self._vbox = VirtualBox()
+        return self._vbox
+
+    def _find_machine(self, name):
+        """ Finds a machine by name, caching the result. """
+        machine = self._machines.get(name)
+        if machine is None:
+            machine = self._get_vbox().find_machine(name)
+            self._machines[name] = machine
+        return machine
+
+    def __getstate__(self):
+        # The pool is rebuilt in each process the builder is sent to.
+        __dict__ = self.__dict__.copy()
+        for key in ['_condition', '_idle', '_vbox', '_retry',
+                    '_snapshot_lock', '_uses', '_machines']:
+            __dict__[key] = None
+        return __dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_pool()
 
     def run_security_check(self, allow_insecure=False):
         """ Runs a set of security checks to make sure the VirtualBox
@@ -176,8 +504,7 @@ class MachinePool(object):
             builder as not being secure and only usable by users
             that have your API key.
         """
-        vbox = VirtualBox()
-        machine = vbox.find_machine(self.machine)
+        machine = self._find_machine(self.machine)
         try:
             self._is_secure = False
 
@@ -229,29 +556,40 @@ class MachinePool(object):
         return bool(self._is_secure)
 
     @contextmanager
-    def _lock(self, timeout_ms=-1):
-        vbox = VirtualBox()
-        machine = vbox.find_machine(self.machine)
-        wait_time = 0
-        while True:
-            session = Session()
-            try:
-                machine.lock_machine(session, LockType.write)
-            except Exception as exc:
-                if timeout_ms != -1 and wait_time > timeout_ms:
-                    raise ValueError("Failed to acquire lock - %s" % exc)
-                time.sleep(1)
-                wait_time += 1000
-            else:
+    def _lock(self, name=None, timeout_ms=-1):
+        """ Holds the write lock of a machine, the base machine by default.
+        Threads of this process wait their turn in order on an in-process
+        lock so only the holder of that lock touches the VirtualBox session
+        lock, which then only has to be retried if another process has it. """
+        if name is None:
+            name = self.machine
+        deadline = None if timeout_ms == -1 else monotonic() + timeout_ms / 1000.0
+        machine_lock = _get_machine_lock(name)
+        if not machine_lock.acquire(timeout=None if deadline is None else deadline - monotonic()):
+            raise ValueError('Failed to acquire lock - timed out waiting for `%s`.' % name)
+        try:
+            machine = self._find_machine(name)
+            delay = 0.01
+            while True:
+                session = self._session_factory()
                 try:
-                    yield session
-                finally:
-                    session.unlock_machine()
-                break
+                    machine.lock_machine(session, LockType.write)
+                    break
+                except Exception as exc:
+                    if deadline is not None and monotonic() >= deadline:
+                        raise ValueError('Failed to acquire lock - %s' % exc)
+                    wait = delay if deadline is None else min(delay, deadline - monotonic())
+                    time.sleep(max(0.0, wait))
+                    delay = min(delay * 2, 1.0)
+            try:
+                yield session
+            finally:
+                session.unlock_machine()
+        finally:
+            machine_lock.release()
 
     def _power_down(self, session):
-        vbox = VirtualBox()
-        clone = vbox.find_machine(session.machine.name)
+        clone = self._find_machine(session.machine.name)
         try:
             p = session.console.power_down()
             p.wait_for_completion(60 * 1000)
@@ -262,3 +600,111 @@ class MachinePool(object):
                 session.unlock_machine()
             except Exception:
                 pass
+
+
+def _stream_guest_process(build, process, max_output=None):
+    """ Sends the output of a process running in a guest to the watchers of
+    the build as ``command_output`` and ``command_error`` events while it runs.
+
+    Output is read one chunk at a time on this thread and only after the
+    watchers have handled the previous chunk, so slow watchers slow down
+    reading rather than output piling up in memory. Once more than
+    ``max_output`` bytes have been sent, or if the build is cancelled,
+    the guest process is terminated.
+
+    :returns: Exit code of the process or None if it was terminated.
+    """
+    total = 0
+    wait_flags = [ProcessWaitForFlag.std_out,
+                  ProcessWaitForFlag.std_err,
+                  ProcessWaitForFlag.terminate]
+    while True:
+        process.wait_for_array(wait_flags, _POLL_MS)
+        done = process.status not in _RUNNING_STATUSES
+        for handle, event_type in [(1, 'command_output'), (2, 'command_error')]:
+            while not build.cancelled:
+                data = bytes(process.read(handle, _CHUNK_SIZE, 0))
+                if not data:
+                    break
+                exceeded = max_output is not None and total + len(data) > max_output
+                if exceeded:
+                    data = data[:max_output - total]
+                total += len(data)
+                if data:
+                    build.notify_watchers(event_type, data)
+                if exceeded:
+                    message = 'Build exceeded `%d` bytes of output and was cancelled.\n'
+                    build.notify_watchers('command_error', (message % max_output).encode('utf-8'))
+                    build.cancel()
+                    break
+                if len(data) < _CHUNK_SIZE:
+                    break
+        if done:
+            return process.exit_code
+        if build.cancelled:
+            process.terminate()
+            return None
+
+
+class _FifoLock(object):
+    """ Lock that is handed to waiting threads in the order that they
+    started waiting instead of whichever thread happens to wake first. """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._waiters = collections.deque()
+        self._locked = False
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._condition:
+            if not self._locked and not self._waiters:
+                self._locked = True
+                return True
+            waiter = object()
+            self._waiters.append(waiter)
+            try:
+                while self._locked or self._waiters[0] is not waiter:
+                    remaining = None if deadline is None else deadline - monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                self._locked = True
+                return True
+            finally:
+                self._waiters.remove(waiter)
+                self._condition.notify_all()
+
+    def release(self):
+        with self._condition:
+            self._locked = False
+            self._condition.notify_all()
+
+
+_machine_locks = {}
+_machine_locks_lock = Lock()
+
+
+def _get_machine_lock(name):
+    """ Returns the in-process lock for the machine with the given name. """
+    with _machine_locks_lock:
+        if name not in _machine_locks:
+            _machine_locks[name] = _FifoLock()
+        return _machine_locks[name]
+
+
+def _discard_machine_lock(name):
+    with _machine_locks_lock:
+        _machine_locks.pop(name, None)
+
+
+def _unchanged_snapshot(machine):
+    """ Returns the current snapshot of a machine or None
+    if the machine has changed since the snapshot was taken. """
+    if machine.current_state_modified:
+        return None
+    return machine.current_snapshot
+
+
+def _is_running(session):
+    """ Default health check for recycled clones. """
+    return session.machine.state == MachineState.running
@@ -19,7 +19,7 @@ import six
 import sys
 import uuid
 from ..exceptions import ArtisanException
-from ..yml import BuildYml
+from ..yml import BuildYml, JobSpec
 
 __all__ = [
     'BaseBuild'
@@ -32,35 +32,49 @@ class BaseBuild(BuildYml):
         self.build_type = build_type
         self.build_id = None
         self.working_dir = None
+        self.virtualenv = None
+        self.virtualenv_cache = None
 
-        self._process = None
-        self._builder = None
+        self._virtualenv_key = None
+
+        self.status = None
+        self.result = None
+        self.cancelled = False
+
+        self._handle = None
 
     @property
     def running(self):
-        return self._process is not None
+        return self._handle is not None and not self._handle.done
 
     def wait(self, timeout=None):
-        if self._process is not None:
-            success = self._process.join(timeout=timeout)
-            if success and self._builder:
-                self._builder.release()
-            return success
+        """
+        Waits for a build given to :meth:`artisan.BaseBuilder.execute_build` to complete.
+
+        :param float timeout: Number of seconds to wait for.
+        :returns: True if the build is complete, False otherwise.
+        """
+        handle = self._handle
+        if handle is not None:
+            return handle.wait(timeout)
         return True
 
     @classmethod
     def from_yml(cls, yml, **kwargs):
-        if not isinstance(yml, BuildYml):
-            raise TypeError('`yml` must be of type `BuildYml`.')
+        if not isinstance(yml, (BuildYml, JobSpec)):
+            raise TypeError('`yml` must be of type `BuildYml` or `JobSpec`.')
         if cls is BaseBuild:
             raise ValueError('Do not execute BaseBuild.from_yml().')
-        return cls(yml.script, yml.duration, **kwargs)
+        build = cls(yml.script, yml.duration, **kwargs)
+        build.requires = dict(yml.requires)
+        build.environment = dict(yml.environment)
+        return build
 
     def fetch_project(self, worker):
         for key, value in six.iteritems(self.environment):
             worker.environment[key] = value
 
-        self.notify_watchers('status_change', 'fetch')
+        self._set_status('fetch')
 
         if self.build_id is None:
             build_id = uuid.uuid4().hex
@@ -84,23 +98,27 @@ class BaseBuild(BuildYml):
 
         try:
             if hasattr(script, 'install'):
-                self.notify_watchers('status_change', 'install')
+                self._set_status('install')
                 script.install(worker)
 
+            # Only cache virtualenvs that were installed successfully.
+            if self._virtualenv_key is not None:
+                self.virtualenv_cache.store(worker, self._virtualenv_key, self.virtualenv)
+
             if hasattr(script, 'script'):
-                self.notify_watchers('status_change', 'script')
+                self._set_status('script')
                 script.script(worker)
 
             if hasattr(script, 'after_success'):
                 script.after_success(worker)
-            self.notify_watchers('status_change', 'success')
+            self._set_status('success')
         except Exception:
             if hasattr(script, 'after_failure'):
                 script.after_failure(worker)
-            self.notify_watchers('status_change', 'failure')
+            self._set_status('failure')
 
     def setup_project(self, worker):
-        self.notify_watchers('status_change', 'setup')
+        self._set_status('setup')
 
         no_filter = {'PATH', 'LD_LIBRARY_PATH', 'SYSTEMROOT'}
         for key in six.iterkeys(worker.environment.copy()):
@@ -115,10 +133,12 @@ class BaseBuild(BuildYml):
         self.setup_python_virtualenv(worker)
 
     def cleanup_project(self, worker):
-        self.notify_watchers('status_change', 'cleanup')
+        self._set_status('cleanup')
 
         if self.working_dir is not None:
             worker.remove(self.working_dir)
+        if self.virtualenv is not None:
+            worker.remove(self.virtualenv)
 
     def display_worker_environment(self, worker):
         self.notify_watchers('command', 'env')
@@ -145,7 +165,16 @@ class BaseBuild(BuildYml):
         venv = os.path.join(worker.tmp, uuid.uuid4().hex)
         while worker.isdir(venv):
             venv = os.path.join(worker.tmp, uuid.uuid4().hex)
-        worker.execute('virtualenv -p %s %s' % (sys.executable, venv))
+
+        self._virtualenv_key = None
+        cached = False
+        if self.virtualenv_cache is not None:
+            key = self.virtualenv_cache.key(worker, self.environment)
+            cached = self.virtualenv_cache.checkout(worker, key, venv)
+            if not cached:
+                self._virtualenv_key = key
+        if not cached:
+            worker.execute('virtualenv -p %s %s' % (sys.executable, venv))
         if worker.platform == 'Windows':
             worker.environment['PATH'] = (os.path.join(venv, 'Scripts') + ';' +
                                           worker.environment.get('PATH', ''))
@@ -153,6 +182,12 @@ class BaseBuild(BuildYml):
             worker.environment['PATH'] = (os.path.join(venv, 'bin') + ':' +
                                           worker.environment.get('PATH', ''))
         worker.environment['VIRTUAL_ENV'] = venv
+        self.virtualenv = venv
+
+    def cancel(self):
+        """ Asks the builder that is executing the build to stop it early.
+        Can be called by watchers of the build while it is being executed. """
+        self.cancelled = True
 
     def as_args(self):
         """
@@ -161,6 +196,20 @@ class BaseBuild(BuildYml):
         """
         raise NotImplementedError()
 
+    def _set_status(self, status):
+        self.status = status
+        if status in ('success', 'failure'):
+            self.result = status
+        self.notify_watchers('status_change', status)
+
+    def __getstate__(self):
+        __dict__ = super(BaseBuild, self).__getstate__()
+        __dict__['_handle'] = None
+        return __dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
     def __str__(self):
         return '<%s script=\'%s\' labels=%s>' % (type(self).__name__,
                                                  self.script,
@@ -30,21 +30,26 @@ class GitBuild(BaseBuild):
         self.repo = repo
         self.branch = branch
         self.commit = commit
+        self.git_cache = None
 
     def fetch_project(self, worker):
         super(GitBuild, self).fetch_project(worker)
         worker.execute('git --version')
 
         project = os.path.join(worker.cwd, 'git')
-        worker.execute('git clone --depth=50 --branch=%s %s %s' % (self.branch,
-                                                                   self.repo,
-                                                                   project))
+        if self.git_cache is not None:
+            self.git_cache.clone(worker, self.repo, self.branch, project,
+                                 commit=None if self.commit == 'HEAD' else self.commit)
+        else:
+            worker.execute('git clone --depth=50 --branch=%s %s %s' % (self.branch,
+                                                                       self.repo,
+                                                                       project))
         worker.chdir(project)
         worker.execute('git checkout -qf %s' % self.commit)
 
         if self.commit == 'HEAD':
             rev_parse = worker.execute('git rev-parse HEAD')
-            self.commit = rev_parse.stdout.decode('utf-8').strip()
+            self.commit = rev_parse.stdout.getvalue().decode('utf-8').strip()
 
         worker.environment['ARTISAN_BUILD_TYPE'] = 'git'
         worker.environment['ARTISAN_GIT_REPOSITORY'] = self.repo
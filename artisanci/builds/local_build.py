@@ -14,6 +14,7 @@
 
 import os
 from .base_build import BaseBuild
+from ..caches.snapshot_cache import is_ignored, read_ignore_file
 
 __all__ = [
     'LocalBuild'
@@ -21,6 +22,9 @@ __all__ = [
 
 _SKIP_FILE_NAMES = {'.git', '.tox', '.hg'}
 
+# File in the project root listing more files to leave out of the build.
+_IGNORE_FILE_NAME = '.artisanignore'
+
 
 class LocalBuild(BaseBuild):
     def __init__(self, script, duration, path=None):
@@ -29,12 +33,19 @@ class LocalBuild(BaseBuild):
         super(LocalBuild, self).__init__('local', script, duration)
 
         self.path = path
+        self.snapshot_cache = None
 
     def fetch_project(self, worker):
         super(LocalBuild, self).fetch_project(worker)
-        for fileobj in os.listdir(self.path):
-            if fileobj not in _SKIP_FILE_NAMES:
-                worker.copy(os.path.join(self.path, fileobj), self.working_dir)
+        # Only the project's own repository directories are skipped.
+        ignore = ['/' + name for name in sorted(_SKIP_FILE_NAMES)]
+        ignore.extend(read_ignore_file(os.path.join(self.path, _IGNORE_FILE_NAME)))
+        if self.snapshot_cache is not None:
+            self.snapshot_cache.checkout(worker, self.path, self.working_dir, ignore=ignore)
+        else:
+            for fileobj in os.listdir(self.path):
+                if not is_ignored(fileobj, ignore):
+                    worker.copy(os.path.join(self.path, fileobj), self.working_dir)
 
     def as_args(self):
         return ['--type', 'local',
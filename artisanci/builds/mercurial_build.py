@@ -27,24 +27,32 @@ class MercurialBuild(BaseBuild):
         self.repo = repo
         self.branch = branch
         self.revision = revision
+        self.mercurial_cache = None
 
     def fetch_project(self, worker):
         super(MercurialBuild, self).fetch_project(worker)
         worker.execute('hg --version')
 
         project = os.path.join(worker.cwd, 'hg')
-        command = 'hg clone %s -b %s %s' % (self.repo,
-                                            self.branch,
-                                            project)
-        if self.revision is not None:
-            command += ' -r %s' % self.revision
+        if self.mercurial_cache is not None:
+            node = self.mercurial_cache.clone(worker, self.repo, self.branch, project,
+                                              revision=self.revision)
+            worker.chdir(project)
+            if self.revision is None:
+                self.revision = node
+        else:
+            command = 'hg clone %s -b %s %s' % (self.repo,
+                                                self.branch,
+                                                project)
+            if self.revision is not None:
+                command += ' -r %s' % self.revision
 
-        worker.execute(command)
-        worker.chdir(project)
+            worker.execute(command)
+            worker.chdir(project)
 
-        if self.revision is None:
-            revision = worker.execute('hg log -l 1 -b . -T "{rev}\n"')
-            self.revision = revision.stdout.decode('utf-8').strip()
+            if self.revision is None:
+                revision = worker.execute('hg log -r . --template "{node}"')
+                self.revision = revision.stdout.getvalue().decode('utf-8').strip()
 
         worker.environment['ARTISAN_BUILD_TYPE'] = 'mercurial'
         worker.environment['ARTISAN_MERCURIAL_REPOSITORY'] = self.repo
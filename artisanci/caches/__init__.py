@@ -0,0 +1,34 @@
+#           Copyright (c) 2017 Seth Michael Larson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+""" Module containing caches that are shared between
+builds on the same host to make builds start faster. """
+
+from .base_cache import BaseCache
+from .file_lock import FileLock
+from .git_mirror_cache import GitMirrorCache
+from .mercurial_cache import MercurialCache
+from .snapshot_cache import SnapshotCache
+from .virtualenv_cache import VirtualenvCache
+from .yml_cache import ArtisanYmlCache
+
+__all__ = [
+    'ArtisanYmlCache',
+    'BaseCache',
+    'FileLock',
+    'GitMirrorCache',
+    'MercurialCache',
+    'SnapshotCache',
+    'VirtualenvCache'
+]
@@ -0,0 +1,135 @@
+#           Copyright (c) 2017 Seth Michael Larson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+""" Module for the base interface of caches that are shared between builds. """
+
+import os
+import shutil
+import tempfile
+import uuid
+from .file_lock import FileLock
+
+__all__ = [
+    'BaseCache'
+]
+
+
+class BaseCache(object):
+    """ Directory of cached entries that are shared between builds
+    on the same host. Each entry is a directory named after its key.
+    Entries are evicted least-recently-used first once the total size
+    of the cache is larger than ``max_size`` bytes.
+
+    :param str root: Directory to store the cache in.
+    :param int max_size: Maximum size of the cache in bytes. ``None`` is unlimited.
+    """
+    name = None
+
+    def __init__(self, root=None, max_size=None):
+        if root is None:
+            root = os.path.join(tempfile.gettempdir(), 'artisanci-cache', self.name)
+        if max_size is not None and not isinstance(max_size, int):
+            raise TypeError('`max_size` must be of type `int`.')
+        self.root = root
+        self.max_size = max_size
+
+    def entry_path(self, key):
+        """ Gets the directory where an entry is stored. """
+        return os.path.join(self.root, key)
+
+    def has_entry(self, key):
+        """ Checks to see if there is an entry in the cache for a key. """
+        return os.path.isdir(self.entry_path(key))
+
+    def clear(self):
+        """ Removes every entry from the cache. """
+        with self._lock():
+            for key in self._keys():
+                shutil.rmtree(self.entry_path(key), ignore_errors=True)
+
+    def _lock(self, name=None):
+        """ Lock over the entire cache or over a single named entry. """
+        if not os.path.isdir(self.root):
+            try:
+                os.makedirs(self.root)
+            except OSError:
+                pass
+        lock_name = '.lock' if name is None else '.%s.lock' % name
+        return FileLock(os.path.join(self.root, lock_name))
+
+    def _keys(self):
+        if not os.path.isdir(self.root):
+            return []
+        return [name for name in os.listdir(self.root)
+                if not name.startswith('.') and os.path.isdir(os.path.join(self.root, name))]
+
+    def _touch(self, key):
+        """ Marks an entry as recently used. """
+        try:
+            os.utime(self.entry_path(key), None)
+        except OSError:
+            pass
+
+    def _staging_path(self):
+        """ Gets a directory within the cache to build an entry in before
+        it's renamed into place so that incomplete entries are never used. """
+        if not os.path.isdir(self.root):
+            try:
+                os.makedirs(self.root)
+            except OSError:
+                pass
+        return os.path.join(self.root, '.tmp-%s' % uuid.uuid4().hex)
+
+    def _evict(self, keep=None):
+        """ Removes the least-recently-used entries until the cache fits
+        within ``max_size``. Must be called while holding the cache lock
+        and never while holding the lock of an entry.
+
+        :param str keep: Key of an entry that must not be evicted.
+        """
+        if self.max_size is None:
+            return []
+        entries = []
+        total_size = 0
+        for key in self._keys():
+            path = self.entry_path(key)
+            try:
+                last_used = os.stat(path).st_mtime
+            except OSError:
+                continue
+            size = _directory_size(path)
+            total_size += size
+            entries.append((last_used, key, size))
+        evicted = []
+        for _, key, size in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            with self._lock(key):
+                shutil.rmtree(self.entry_path(key), ignore_errors=True)
+            total_size -= size
+            evicted.append(key)
+        return evicted
+
+
+def _directory_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
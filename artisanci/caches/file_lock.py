@@ -0,0 +1,96 @@
+#           Copyright (c) 2017 Seth Michael Larson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+""" Lock that is shared between processes using a file. """
+
+import os
+import threading
+
+__all__ = [
+    'FileLock'
+]
+
+try:
+    import fcntl
+except ImportError:  # Skip coverage
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+class FileLock(object):
+    """ Exclusive lock held on a file so that caches can be shared
+    safely between builds running in different processes. Can be
+    used as a context manager:
+
+     .. code-block:: python
+
+        with FileLock('/tmp/cache/.lock'):
+            ...
+
+    :param str path: Path to the lock file, created if it doesn't exist.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._thread_lock = threading.Lock()
+
+    def acquire(self):
+        """ Blocks until the lock is acquired. """
+        self._thread_lock.acquire()
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                else:  # Skip coverage
+                    # LK_LOCK gives up after 10 seconds so keep trying.
+                    while True:
+                        try:
+                            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                            break
+                        except (IOError, OSError):
+                            pass
+            except Exception:
+                os.close(fd)
+                raise
+            self._fd = fd
+        except Exception:
+            self._thread_lock.release()
+            raise
+
+    def release(self):
+        """ Releases the lock. """
+        if self._fd is None:
+            raise ValueError('`%s` is not locked.' % self.path)
+        fd = self._fd
+        self._fd = None
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:  # Skip coverage
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *_):
+        self.release()
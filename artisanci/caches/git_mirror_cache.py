@@ -0,0 +1,91 @@
+#           Copyright (c) 2017 Seth Michael Larson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+""" Module for caching mirrors of Git repositories between builds. """
+
+import hashlib
+import os
+import shutil
+from .base_cache import BaseCache
+from ..exceptions import ArtisanException
+
+__all__ = [
+    'GitMirrorCache'
+]
+
+
+class GitMirrorCache(BaseCache):
+    """ Cache of bare mirrors of Git repositories keyed by the repository URL.
+    The mirror is created once with ``git clone --mirror`` and afterwards only
+    fetches what changed. If the commit being built is already in the mirror
+    then the network isn't used at all. Builds clone from the mirror on the
+    local filesystem which hardlinks the objects instead of copying them so the
+    clone stays valid even if the mirror is evicted while the build is running.
+
+    :param str root: Directory to store the cache in.
+    :param int max_size: Maximum size of the cache in bytes. ``None`` is unlimited.
+    """
+    name = 'git'
+
+    def key(self, repo):
+        """
+        Computes the key of the mirror for a repository.
+
+        :param str repo: URL of the repository.
+        :returns: Key as a hex string.
+        """
+        return hashlib.sha256(repo.encode('utf-8')).hexdigest()[:40]
+
+    def clone(self, worker, repo, branch, path, commit=None):
+        """
+        Clones a repository into a path from its mirror. The mirror is
+        created or fetched first unless it already contains ``commit``.
+
+        :param artisan.Worker worker: Worker to clone the repository with.
+        :param str repo: URL of the repository.
+        :param str branch: Branch to checkout after cloning.
+        :param str path: Path to clone the repository into.
+        :param str commit:
+            Commit that is going to be built. If None the
+            mirror is always fetched to find the latest commit.
+        """
+        key = self.key(repo)
+        mirror = self.entry_path(key)
+        with self._lock(key):
+            if not self.has_entry(key):
+                staging = self._staging_path()
+                try:
+                    worker.execute('git clone --mirror %s %s' % (repo, staging))
+                    os.rename(staging, mirror)
+                finally:
+                    if os.path.isdir(staging):
+                        shutil.rmtree(staging, ignore_errors=True)
+            elif commit is None or not self._has_commit(worker, mirror, commit):
+                worker.execute('git --git-dir=%s fetch --prune origin' % mirror)
+            self._touch(key)
+            worker.execute('git clone --branch=%s %s %s' % (branch, mirror, path))
+
+        with self._lock():
+            self._evict(keep=key)
+
+        # Point the clone at the original repository rather than the mirror.
+        worker.execute('git --git-dir=%s remote set-url origin %s' % (os.path.join(path, '.git'),
+                                                                      repo))
+
+    def _has_commit(self, worker, mirror, commit):
+        try:
+            worker.execute('git --git-dir=%s cat-file -e %s^{commit}' % (mirror, commit))
+            return True
+        except ArtisanException:
+            return False
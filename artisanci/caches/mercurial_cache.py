@@ -0,0 +1,105 @@
+#           Copyright (c) 2017 Seth Michael Larson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+""" Module for caching pooled stores of Mercurial repositories between builds. """
+
+import hashlib
+import os
+import shutil
+from .base_cache import BaseCache
+from ..exceptions import ArtisanException
+
+__all__ = [
+    'MercurialCache'
+]
+
+
+class MercurialCache(BaseCache):
+    """ Cache of pooled Mercurial stores keyed by the repository URL. The
+    pool is created once with ``hg clone -U`` and afterwards only pulls
+    what changed. If the revision being built is already in the pool then
+    the network isn't used at all. Builds clone from the pool on the local
+    filesystem which hardlinks the store, the same way ``hg share`` reuses
+    it, without the build breaking if the pool is evicted during the build.
+
+    :param str root: Directory to store the cache in.
+    :param int max_size: Maximum size of the cache in bytes. ``None`` is unlimited.
+    """
+    name = 'mercurial'
+
+    def key(self, repo):
+        """
+        Computes the key of the pool for a repository.
+
+        :param str repo: URL of the repository.
+        :returns: Key as a hex string.
+        """
+        return hashlib.sha256(repo.encode('utf-8')).hexdigest()[:40]
+
+    def clone(self, worker, repo, branch, path, revision=None):
+        """
+        Clones a repository into a path from its pool. The pool is
+        created or pulled first unless it already contains ``revision``.
+        The revision is resolved to its node in the pool before cloning
+        so the clone doesn't need another ``hg`` process to find it.
+
+        :param artisan.Worker worker: Worker to clone the repository with.
+        :param str repo: URL of the repository.
+        :param str branch: Branch to update to if ``revision`` is None.
+        :param str path: Path to clone the repository into.
+        :param str revision: Revision that is going to be built.
+        :returns: Node of the revision that was checked out as a hex string.
+        """
+        key = self.key(repo)
+        pool = self.entry_path(key)
+        target = branch if revision is None else revision
+        with self._lock(key):
+            created = not self.has_entry(key)
+            if created:
+                staging = self._staging_path()
+                try:
+                    worker.execute('hg clone -U %s %s' % (repo, staging))
+                    os.rename(staging, pool)
+                finally:
+                    if os.path.isdir(staging):
+                        shutil.rmtree(staging, ignore_errors=True)
+            node = None
+            # The head of a branch may have moved so it's always pulled.
+            if created or revision is not None:
+                node = self._find_node(worker, pool, target)
+            if node is None and not created:
+                worker.execute('hg pull -R %s %s' % (pool, repo))
+                node = self._find_node(worker, pool, target)
+            if node is None:
+                raise ArtisanException('Could not find the revision `%s` '
+                                       'in the repository `%s`.' % (target, repo))
+            self._touch(key)
+            worker.execute('hg clone -u %s %s %s' % (node, pool, path))
+
+        with self._lock():
+            self._evict(keep=key)
+
+        # Point the clone at the original repository rather than the pool.
+        with open(os.path.join(path, '.hg', 'hgrc'), 'w') as f:
+            f.write('[paths]\ndefault = %s\n' % repo)
+
+        return node
+
+    def _find_node(self, worker, pool, revision):
+        """ Resolves a revision to its node or returns None if the pool doesn't have it. """
+        try:
+            command = worker.execute('hg log -R %s -r %s -l 1 -T "{node}"' % (pool, revision))
+        except ArtisanException:
+            return None
+        return command.stdout.getvalue().decode('utf-8').strip() or None
@@ -0,0 +1,329 @@
+#           Copyright (c) 2017 Seth Michael Larson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+""" Module for caching snapshots of local projects between builds. """
+
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+from .base_cache import BaseCache
+
+__all__ = [
+    'SnapshotCache',
+    'is_ignored',
+    'read_ignore_file'
+]
+
+try:
+    import fcntl
+except ImportError:  # Skip coverage
+    fcntl = None
+
+_MANIFEST_FILE = 'manifest.json'
+
+# Linux ioctl for cloning a file with copy-on-write (Btrfs, XFS).
+_FICLONE = 0x40049409
+
+# Whether files can be reflinked between each pair of devices.
+_reflink_support = {}
+
+
+def read_ignore_file(path):
+    """
+    Reads the patterns from an ignore file. Each line is a glob pattern
+    that is matched against the relative path and the name of every file
+    and directory. Patterns starting with ``/`` only match relative paths
+    from the project root. Blank lines and lines starting with ``#`` are skipped.
+
+    :param str path: Path to the ignore file.
+    :returns: List of patterns, empty if the file doesn't exist.
+    """
+    if not os.path.isfile(path):
+        return []
+    patterns = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                patterns.append(line.rstrip('/'))
+    return patterns
+
+
+def is_ignored(relative_path, patterns):
+    """ Checks to see if a relative path matches any ignore patterns. """
+    relative_path = relative_path.replace(os.sep, '/')
+    name = relative_path.rsplit('/', 1)[-1]
+    for pattern in patterns:
+        if pattern.startswith('/'):
+            if fnmatch.fnmatch(relative_path, pattern[1:]):
+                return True
+        elif fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative_path, pattern):
+            return True
+    return False
+
+
+class SnapshotCache(BaseCache):
+    """ Cache of snapshots of local projects keyed by the project's path.
+    Each time a project is built its snapshot is updated by copying only
+    the files whose size or modification time changed since the last build.
+    The build's working directory is then populated from the snapshot with
+    reflinks so starting a build doesn't depend on the size of the project.
+
+    Reflinks need a filesystem that supports them, such as Btrfs or XFS, with
+    the cache and the build on the same one. Otherwise the snapshot would only
+    add work, so the project is copied straight into the build's working
+    directory and no snapshot is kept. Files are never hardlinked so that
+    builds can't modify the snapshot or each other's files.
+
+    :param str root: Directory to store the cache in.
+    :param int max_size: Maximum size of the cache in bytes. ``None`` is unlimited.
+    """
+    name = 'snapshot'
+
+    def key(self, path):
+        """
+        Computes the key of the snapshot for a project.
+
+        :param str path: Path to the project.
+        :returns: Key as a hex string.
+        """
+        path = os.path.normcase(os.path.abspath(path))
+        return hashlib.sha256(path.encode('utf-8')).hexdigest()[:40]
+
+    def checkout(self, worker, source, destination, ignore=None):
+        """
+        Updates the snapshot of a project and then reflinks it into a directory.
+        If reflinks aren't supported the project is copied into the directory.
+
+        :param artisan.Worker worker: Worker to checkout the project for.
+        :param str source: Path to the project.
+        :param str destination: Existing directory to link the project into.
+        :param list ignore: Patterns of files and directories to leave out.
+        :returns: Number of files that were copied into the snapshot,
+            or into the directory if reflinks aren't supported.
+        """
+        ignore = ignore or []
+        key = self.key(source)
+        entry = self.entry_path(key)
+        if not os.path.isdir(self.root):
+            try:
+                os.makedirs(self.root)
+            except OSError:
+                pass
+        if not _can_reflink(self.root, destination):
+            if worker.build is not None:
+                worker.build.notify_watchers('command', 'cp -a %s/ %s' % (source, destination))
+            return _copy_tree(source, destination, ignore)
+
+        with self._lock(key):
+            if worker.build is not None:
+                worker.build.notify_watchers('command', 'rsync -a %s/ %s' % (source,
+                                                                             entry))
+            copied = self._update(source, entry, ignore)
+            self._touch(key)
+            if worker.build is not None:
+                worker.build.notify_watchers('command', 'cp -a --reflink=always %s/ %s' %
+                                             (entry, destination))
+            _link_tree(os.path.join(entry, 'tree'), destination)
+
+        with self._lock():
+            self._evict(keep=key)
+        return copied
+
+    def _update(self, source, entry, ignore):
+        tree = os.path.join(entry, 'tree')
+        manifest_path = os.path.join(entry, _MANIFEST_FILE)
+        manifest = {}
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+        elif not os.path.isdir(tree):
+            os.makedirs(tree)
+
+        new_manifest = {}
+        kept_dirs = set()
+        copied = 0
+        for root, dirs, files in os.walk(source):
+            relative_root = os.path.relpath(root, source)
+            if relative_root == '.':
+                relative_root = ''
+            for name in list(dirs):
+                relative_path = os.path.join(relative_root, name)
+                if is_ignored(relative_path, ignore):
+                    dirs.remove(name)
+                elif os.path.islink(os.path.join(root, name)):
+                    dirs.remove(name)
+                    files.append(name)
+                else:
+                    kept_dirs.add(relative_path)
+                    snapshot_dir = os.path.join(tree, relative_path)
+                    if not os.path.isdir(snapshot_dir):
+                        if os.path.lexists(snapshot_dir):
+                            os.remove(snapshot_dir)
+                        os.makedirs(snapshot_dir)
+            for name in files:
+                relative_path = os.path.join(relative_root, name)
+                if is_ignored(relative_path, ignore):
+                    continue
+                source_path = os.path.join(root, name)
+                snapshot_path = os.path.join(tree, relative_path)
+                source_stat = _stat_key(os.lstat(source_path))
+                previous = manifest.get(relative_path)
+                if (previous is not None and previous[0] == source_stat and
+                        os.path.lexists(snapshot_path) and
+                        previous[1] == _stat_key(os.lstat(snapshot_path))):
+                    new_manifest[relative_path] = previous
+                    continue
+                _replace_file(source_path, snapshot_path)
+                new_manifest[relative_path] = [source_stat, _stat_key(os.lstat(snapshot_path))]
+                copied += 1
+
+        # Remove everything from the snapshot that's no longer in the project.
+        for root, dirs, files in os.walk(tree, topdown=False):
+            relative_root = os.path.relpath(root, tree)
+            if relative_root == '.':
+                relative_root = ''
+            for name in files + dirs:
+                relative_path = os.path.join(relative_root, name)
+                path = os.path.join(root, name)
+                if name in files or os.path.islink(path):
+                    if relative_path not in new_manifest:
+                        os.remove(path)
+                elif relative_path not in kept_dirs:
+                    shutil.rmtree(path)
+
+        staging = manifest_path + '.' + uuid.uuid4().hex
+        with open(staging, 'w') as f:
+            json.dump(new_manifest, f)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        os.rename(staging, manifest_path)
+        return copied
+
+
+def _stat_key(st):
+    return [st.st_size, getattr(st, 'st_mtime_ns', st.st_mtime), st.st_mode]
+
+
+def _replace_file(source_path, snapshot_path):
+    """ Copies a file into the snapshot under a temporary name and renames it
+    into place so that builds with links to the old file are unaffected. """
+    staging = snapshot_path + '.artisan-' + uuid.uuid4().hex
+    if os.path.islink(source_path):
+        os.symlink(os.readlink(source_path), staging)
+    else:
+        shutil.copy2(source_path, staging)
+    if os.path.isdir(snapshot_path) and not os.path.islink(snapshot_path):
+        shutil.rmtree(snapshot_path)
+    elif os.path.lexists(snapshot_path) and sys.platform == 'win32':  # Skip coverage
+        os.remove(snapshot_path)
+    os.rename(staging, snapshot_path)
+
+
+def _copy_tree(source, destination, ignore):
+    """ Copies a project into a directory, leaving out ignored files. """
+    copied = 0
+    for root, dirs, files in os.walk(source):
+        relative_root = os.path.relpath(root, source)
+        if relative_root == '.':
+            relative_root = ''
+        target_root = os.path.join(destination, relative_root)
+        for name in list(dirs):
+            relative_path = os.path.join(relative_root, name)
+            if is_ignored(relative_path, ignore):
+                dirs.remove(name)
+            elif os.path.islink(os.path.join(root, name)):
+                dirs.remove(name)
+                files.append(name)
+            else:
+                os.mkdir(os.path.join(target_root, name))
+        for name in files:
+            if is_ignored(os.path.join(relative_root, name), ignore):
+                continue
+            source_path = os.path.join(root, name)
+            target_path = os.path.join(target_root, name)
+            if os.path.islink(source_path):
+                os.symlink(os.readlink(source_path), target_path)
+            else:
+                shutil.copy2(source_path, target_path)
+            copied += 1
+    return copied
+
+
+def _can_reflink(source_dir, destination_dir):
+    """ Checks once for each pair of devices whether files
+    in one directory can be reflinked into the other. """
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False
+    key = (os.stat(source_dir).st_dev, os.stat(destination_dir).st_dev)
+    if key not in _reflink_support:
+        fd, source_path = tempfile.mkstemp(dir=source_dir, prefix='.artisan-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(b'artisan')
+            target_path = os.path.join(destination_dir, '.artisan-' + uuid.uuid4().hex)
+            supported = _reflink(source_path, target_path)
+            if supported:
+                os.remove(target_path)
+        finally:
+            os.remove(source_path)
+        _reflink_support[key] = supported
+    return _reflink_support[key]
+
+
+def _link_tree(source, destination):
+    """ Populates a directory from a snapshot with reflinks or copies. """
+    can_reflink = fcntl is not None and sys.platform.startswith('linux')
+    for root, dirs, files in os.walk(source):
+        relative_root = os.path.relpath(root, source)
+        target_root = os.path.normpath(os.path.join(destination, relative_root))
+        for name in dirs:
+            source_path = os.path.join(root, name)
+            if os.path.islink(source_path):
+                os.symlink(os.readlink(source_path), os.path.join(target_root, name))
+            else:
+                os.mkdir(os.path.join(target_root, name))
+        for name in files:
+            source_path = os.path.join(root, name)
+            target_path = os.path.join(target_root, name)
+            if os.path.islink(source_path):
+                os.symlink(os.readlink(source_path), target_path)
+                continue
+            if can_reflink:
+                if _reflink(source_path, target_path):
+                    continue
+                # Don't try again if the filesystem doesn't support it.
+                can_reflink = False
+            shutil.copy2(source_path, target_path)
+
+
+def _reflink(source_path, target_path):
+    with open(source_path, 'rb') as source:
+        with open(target_path, 'wb') as target:
+            try:
+                fcntl.ioctl(target.fileno(), _FICLONE, source.fileno())
+            except (IOError, OSError):
+                success = False
+            else:
+                success = True
+    if success:
+        shutil.copystat(source_path, target_path)
+    else:
+        os.remove(target_path)
+    return success
@@ -0,0 +1,193 @@
+#           Copyright (c) 2017 Seth Michael Larson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+""" Module for caching Python virtualenvs between builds. """
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sys
+import six
+from .base_cache import BaseCache
+
+__all__ = [
+    'VirtualenvCache'
+]
+
+_METADATA_FILE = 'artisan-cache.json'
+
+# Directories of a virtualenv that contain files with the virtualenv's path in them.
+_RELOCATE_DIRS = {'bin', 'Scripts'}
+_RELOCATE_FILES = {'pyvenv.cfg'}
+
+# Files that installers edit in place rather than replacing, so a build
+# writing to a hardlink of one of them would change the cached virtualenv.
+_MUTABLE_SUFFIXES = ('.pth', '.egg-link')
+
+
+class VirtualenvCache(BaseCache):
+    """ Cache of Python virtualenvs keyed by the interpreter that created
+    them, the contents of the project's requirements files and the build's
+    environment. A cached virtualenv is cloned into each build using hardlinks
+    (falling back to copying) so the dependencies installed by a previous build
+    with the same key are already present when the ``install`` step runs.
+
+    Files that contain the path of the virtualenv (scripts and ``pyvenv.cfg``)
+    are copied and rewritten and files that installers edit in place (``.pth`` and
+    ``.egg-link`` files) are copied, everything else is shared with the cache. Because
+    build virtualenvs are always named with a UUID in the same directory the path
+    is the same length so launchers on Windows can be rewritten in place too.
+
+    :param str root: Directory to store the cache in.
+    :param int max_size: Maximum size of the cache in bytes. ``None`` is unlimited.
+    """
+    name = 'virtualenv'
+
+    # Files in the project root that decide which packages get installed.
+    key_files = ['requirements*.txt',
+                 '*requirements.txt',
+                 'requirements/*.txt',
+                 'setup.py',
+                 'setup.cfg',
+                 'pyproject.toml',
+                 'Pipfile',
+                 'Pipfile.lock']
+
+    def key(self, worker, environment=None):
+        """
+        Computes the key of the virtualenv for the project in the worker's
+        current working directory.
+
+        :param artisan.Worker worker: Worker with the project checked out.
+        :param dict environment: Environment variables of the build.
+        :returns: Key as a hex string.
+        """
+        sha = hashlib.sha256()
+        sha.update(('%s\0%s\0' % (sys.executable, sys.version)).encode('utf-8'))
+        paths = set()
+        for pattern in self.key_files:
+            paths.update(glob.glob(os.path.join(worker.cwd, pattern)))
+        for path in sorted(paths):
+            if not os.path.isfile(path):
+                continue
+            sha.update(os.path.relpath(path, worker.cwd).replace(os.sep, '/').encode('utf-8'))
+            sha.update(b'\0')
+            with open(path, 'rb') as f:
+                sha.update(f.read())
+            sha.update(b'\0')
+        for name, value in sorted(six.iteritems(environment or {})):
+            sha.update(('%s=%s\0' % (name, value)).encode('utf-8'))
+        return sha.hexdigest()[:40]
+
+    def checkout(self, worker, key, path):
+        """
+        Clones a cached virtualenv into a path.
+
+        :param artisan.Worker worker: Worker to clone the virtualenv for.
+        :param str key: Key of the virtualenv from :meth:`artisan.VirtualenvCache.key`.
+        :param str path: Path to create the virtualenv at.
+        :returns: True if the virtualenv was cached, False otherwise.
+        """
+        # Holding the entry's lock stops it from being evicted while it's cloned.
+        with self._lock(key):
+            if not self.has_entry(key):
+                return False
+            self._touch(key)
+            entry = self.entry_path(key)
+            with open(os.path.join(entry, _METADATA_FILE), 'r') as f:
+                metadata = json.load(f)
+            if worker.build is not None:
+                worker.build.notify_watchers('command', 'cp -al %s %s' % (entry, path))
+            _clone_virtualenv(os.path.join(entry, 'venv'), path, metadata['prefix'])
+        return True
+
+    def store(self, worker, key, path):
+        """
+        Adds a virtualenv to the cache if there isn't one for the key already.
+
+        :param artisan.Worker worker: Worker that created the virtualenv.
+        :param str key: Key of the virtualenv from :meth:`artisan.VirtualenvCache.key`.
+        :param str path: Path of the virtualenv to store.
+        :returns: True if the virtualenv was added, False otherwise.
+        """
+        if self.has_entry(key):
+            return False
+        staging = self._staging_path()
+        try:
+            if worker.build is not None:
+                worker.build.notify_watchers('command', 'cp -r %s %s' % (path, staging))
+            shutil.copytree(path, os.path.join(staging, 'venv'), symlinks=True)
+            with open(os.path.join(staging, _METADATA_FILE), 'w') as f:
+                json.dump({'prefix': path}, f)
+            with self._lock():
+                if self.has_entry(key):
+                    return False
+                os.rename(staging, self.entry_path(key))
+                self._evict(keep=key)
+            return True
+        finally:
+            if os.path.isdir(staging):
+                shutil.rmtree(staging, ignore_errors=True)
+
+
+def _clone_virtualenv(source, destination, prefix):
+    """ Clones a virtualenv with hardlinks and rewrites
+    every file that refers to the old location. """
+    old_prefix = _to_bytes(prefix)
+    new_prefix = _to_bytes(destination)
+    os.makedirs(destination)
+    for root, dirs, files in os.walk(source):
+        relative_root = os.path.relpath(root, source)
+        target_root = os.path.normpath(os.path.join(destination, relative_root))
+        top_dir = relative_root.split(os.sep)[0]
+        for name in list(dirs) + files:
+            source_path = os.path.join(root, name)
+            target_path = os.path.join(target_root, name)
+            if os.path.islink(source_path):
+                link = os.readlink(source_path)
+                if link.startswith(prefix):
+                    link = destination + link[len(prefix):]
+                os.symlink(link, target_path)
+            elif name in dirs:
+                os.mkdir(target_path)
+            elif top_dir in _RELOCATE_DIRS or name in _RELOCATE_FILES:
+                _copy_relocated(source_path, target_path, old_prefix, new_prefix)
+            elif name.endswith(_MUTABLE_SUFFIXES):
+                shutil.copy2(source_path, target_path)
+            else:
+                try:
+                    os.link(source_path, target_path)
+                except OSError:
+                    shutil.copy2(source_path, target_path)
+
+
+def _copy_relocated(source_path, target_path, old_prefix, new_prefix):
+    with open(source_path, 'rb') as f:
+        data = f.read()
+    if old_prefix in data:
+        # Only binary files where the length doesn't change
+        # can be rewritten without corrupting them.
+        if b'\0' not in data or len(old_prefix) == len(new_prefix):
+            data = data.replace(old_prefix, new_prefix)
+    with open(target_path, 'wb') as f:
+        f.write(data)
+    shutil.copymode(source_path, target_path)
+
+
+def _to_bytes(path):
+    if isinstance(path, bytes):
+        return path
+    return path.encode(sys.getfilesystemencoding())
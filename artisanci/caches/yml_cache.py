@@ -0,0 +1,140 @@
+#           Copyright (c) 2017 Seth Michael Larson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+""" Module for a cache of parsed ``.artisan.yml`` files. """
+
+import collections
+import hashlib
+import os
+import pickle
+import shutil
+from .base_cache import BaseCache
+from ..compat import Lock
+
+__all__ = [
+    'ArtisanYmlCache'
+]
+
+# Changing how ``.artisan.yml`` files are parsed must
+# change this so that old entries are no longer used.
+_FORMAT_VERSION = 2
+_PICKLE_NAME = 'artisan-yml.pickle'
+
+
+class ArtisanYmlCache(BaseCache):
+    """ Cache of parsed :class:`artisan.ArtisanYml` instances keyed
+    by a hash of the file's contents so that an unchanged file
+    is never parsed twice.
+
+    The most recently used ``max_entries`` are kept pickled in memory
+    and every instance that is returned is a new copy. With ``on_disk``
+    entries are also stored in the cache directory to be shared between
+    processes and kept between runs.
+
+     .. warning::
+         Entries on disk are loaded with :mod:`pickle` so the cache
+         directory must only be writable by trusted users.
+
+    :param int max_entries: Number of entries to keep in memory.
+    :param bool on_disk: If True will also store entries on disk.
+    """
+    name = 'artisan-yml'
+
+    def __init__(self, root=None, max_size=None, max_entries=128, on_disk=False):
+        super(ArtisanYmlCache, self).__init__(root=root, max_size=max_size)
+        self.max_entries = max_entries
+        self.on_disk = on_disk
+        self._entries = collections.OrderedDict()
+        self._entries_lock = Lock()
+
+    def key(self, string):
+        """ Gets the key of the contents of a ``.artisan.yml`` file. """
+        if not isinstance(string, bytes):
+            string = string.encode('utf-8')
+        sha = hashlib.sha256()
+        sha.update(('%d\0' % _FORMAT_VERSION).encode('utf-8'))
+        sha.update(string)
+        return sha.hexdigest()
+
+    def get(self, key):
+        """
+        Gets a copy of a cached entry.
+
+        :param str key: Key of the entry.
+        :returns: :class:`artisan.ArtisanYml` or None if it's not cached.
+        """
+        with self._entries_lock:
+            data = self._entries.pop(key, None)
+            if data is not None:
+                self._entries[key] = data
+        if data is None and self.on_disk:
+            data = self._read(key)
+            if data is not None:
+                self._remember(key, data)
+        if data is None:
+            return None
+        try:
+            return pickle.loads(data)
+        except Exception:
+            return None
+
+    def put(self, key, artisan_yml):
+        """
+        Adds a parsed file to the cache.
+
+        :param str key: Key of the entry.
+        :param artisan.ArtisanYml artisan_yml: Parsed file.
+        """
+        data = pickle.dumps(artisan_yml, pickle.HIGHEST_PROTOCOL)
+        self._remember(key, data)
+        if self.on_disk and not self.has_entry(key):
+            self._write(key, data)
+
+    def clear(self):
+        with self._entries_lock:
+            self._entries.clear()
+        super(ArtisanYmlCache, self).clear()
+
+    def _remember(self, key, data):
+        with self._entries_lock:
+            self._entries.pop(key, None)
+            self._entries[key] = data
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _read(self, key):
+        try:
+            with open(os.path.join(self.entry_path(key), _PICKLE_NAME), 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        self._touch(key)
+        return data
+
+    def _write(self, key, data):
+        staging = self._staging_path()
+        try:
+            os.makedirs(staging)
+            with open(os.path.join(staging, _PICKLE_NAME), 'wb') as f:
+                f.write(data)
+            with self._lock():
+                if not self.has_entry(key):
+                    os.rename(staging, self.entry_path(key))
+                    staging = None
+                self._evict(keep=key)
+        except OSError:  # Skip coverage
+            pass
+        finally:
+            if staging is not None and os.path.isdir(staging):
+                shutil.rmtree(staging, ignore_errors=True)
@@ -11,3 +11,464 @@
 # "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
 # either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
+
+""" Module for a farm that runs queued builds on its builders. """
+
+import collections
+import pickle
+import six
+import sqlite3
+import threading
+import time
+import traceback
+from .builds import BaseBuild
+from .compat import Lock, monotonic
+from .scheduler import Scheduler
+
+__all__ = [
+    'Farm',
+    'JobQueue'
+]
+
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT UNIQUE,
+    state TEXT NOT NULL,
+    community INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    payload BLOB NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+)
+"""
+
+_CREATE_INDEX = 'CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)'
+
+# Start of the keys of jobs that were claimed from a remote queue.
+_REMOTE_PREFIX = 'remote:'
+
+# What the farm's policy is asked to admit instead of loading the whole build.
+_JobRequest = collections.namedtuple('_JobRequest', ['job_id', 'duration', 'community'])
+
+
+class JobQueue(object):
+    """ Queue of builds that is stored in a SQLite database so
+    that no builds are lost if the farm is stopped or crashes.
+
+    Each job is ``queued`` until it is given to a builder, ``running``
+    while the builder executes it and ``done`` once its result is stored.
+    Jobs that were ``running`` when the farm stopped are queued again
+    by :meth:`artisan.JobQueue.recover` as their builds never finished.
+
+    :param str path: Path to the database file.
+    """
+    def __init__(self, path):
+        self.path = path
+
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute(_CREATE_TABLE)
+            self._db.execute(_CREATE_INDEX)
+
+    def put(self, build, community=False, key=None):
+        """
+        Adds a build to the queue.
+
+        :param artisan.BaseBuild build: Build to add.
+        :param bool community: If True the build is only run on secure builders.
+        :param str key:
+            Unique key for the build. Adding a build with
+            the same key again returns the existing job.
+        :returns: ID of the job.
+        """
+        payload = sqlite3.Binary(pickle.dumps(build, pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            cursor = self._db.execute('INSERT OR IGNORE INTO jobs (key, state, community, '
+                                      'duration, payload, created) '
+                                      'VALUES (?, \'queued\', ?, ?, ?, ?)',
+                                      (key, int(community), build.duration,
+                                       payload, time.time()))
+            if cursor.rowcount == 0:
+                cursor = self._db.execute('SELECT id FROM jobs WHERE key = ?', (key,))
+                return cursor.fetchone()[0]
+            return cursor.lastrowid
+
+    def get(self, job_id):
+        """
+        Loads the build of a job.
+
+        :param int job_id: ID of the job.
+        :rtype: artisan.BaseBuild
+        """
+        with self._lock:
+            row = self._db.execute('SELECT payload FROM jobs WHERE id = ?',
+                                   (job_id,)).fetchone()
+        if row is None:
+            raise KeyError(job_id)
+        return pickle.loads(bytes(row[0]))
+
+    def queued(self, after=0, limit=1000):
+        """
+        Lists the jobs that are waiting to be run.
+
+        :param int after: Only list jobs with a greater ID than this.
+        :param int limit: Maximum number of jobs to list.
+        :returns: List of ``(job_id, duration, community)`` tuples in ID order.
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT id, duration, community FROM jobs '
+                                    'WHERE state = \'queued\' AND id > ? '
+                                    'ORDER BY id LIMIT ?', (after, limit)).fetchall()
+        return [(job_id, duration, bool(community)) for job_id, duration, community in rows]
+
+    def state(self, job_id):
+        """
+        Gets the state and result of a job.
+
+        :param int job_id: ID of the job.
+        :returns: Tuple of ``(state, result)``.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT state, result FROM jobs WHERE id = ?',
+                                   (job_id,)).fetchone()
+        if row is None:
+            raise KeyError(job_id)
+        return tuple(row)
+
+    def start(self, job_id):
+        """ Marks a job as running on a builder. """
+        with self._lock:
+            self._db.execute('UPDATE jobs SET state = \'running\', attempts = attempts + 1, '
+                             'started = ? WHERE id = ?', (time.time(), job_id))
+
+    def requeue(self, job_id):
+        """ Puts a job that was started but never given to a builder back
+        in the queue. The attempt doesn't count towards ``max_attempts``. """
+        with self._lock:
+            self._db.execute('UPDATE jobs SET state = \'queued\', attempts = attempts - 1 '
+                             'WHERE id = ? AND state = \'running\'', (job_id,))
+
+    def finish(self, job_id, result, error=None):
+        """
+        Stores the result of a job.
+
+        :param int job_id: ID of the job.
+        :param str result: Result of the build.
+        :param str error: Error that stopped the build.
+        """
+        with self._lock:
+            self._db.execute('UPDATE jobs SET state = \'done\', result = ?, error = ?, '
+                             'finished = ? WHERE id = ?', (result, error, time.time(), job_id))
+
+    def recover(self, max_attempts=None):
+        """
+        Queues the jobs that were running when the queue was last used
+        again. Jobs that have already been started ``max_attempts`` times
+        are failed instead so that a build that crashes the farm can't
+        keep doing so.
+
+        :param int max_attempts: Number of times a job may be started.
+        :returns: Number of jobs that were queued again.
+        """
+        with self._lock:
+            if max_attempts is not None:
+                self._db.execute('UPDATE jobs SET state = \'done\', result = \'failure\', '
+                                 'error = \'Exceeded the maximum number of attempts.\', '
+                                 'finished = ? WHERE state = \'running\' AND attempts >= ?',
+                                 (time.time(), max_attempts))
+            cursor = self._db.execute('UPDATE jobs SET state = \'queued\' '
+                                      'WHERE state = \'running\'')
+            return cursor.rowcount
+
+    def keys(self, prefix):
+        """
+        Finds the jobs that aren't done and have a key starting with a prefix.
+
+        :param str prefix: Start of the keys.
+        :returns: Dictionary of job IDs to keys.
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT id, key FROM jobs WHERE state != \'done\' '
+                                    'AND substr(key, 1, ?) = ?',
+                                    (len(prefix), prefix)).fetchall()
+        return dict(rows)
+
+    def counts(self):
+        """ Gets the number of jobs in each state. """
+        with self._lock:
+            rows = self._db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+        counts = {'queued': 0, 'running': 0, 'done': 0}
+        counts.update(rows)
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class Farm(object):
+    """ Runs the builds from a :class:`artisan.JobQueue` on a group of
+    builders. Builds are admitted by the farm's ``policy``, matched to
+    the builders that can run them by a :class:`artisan.Scheduler` and
+    executed by the builders concurrently.
+
+    The queue is stored at ``path`` so a farm that is stopped continues
+    where it left off when it is started again. Builds that were running
+    when it stopped are run again and completed builds never are. A build
+    is only run twice if the farm stops after it completes but before the
+    result is stored.
+
+    :param str path: Path to the queue's database file.
+    :param artisan.BasePolicy policy:
+        Policy that must allow a build before it is given to a builder.
+        Builds that aren't allowed wait until the policy allows them.
+    :param str order: Order of the farm's scheduler, see :class:`artisan.Scheduler`.
+    :param float poll_interval:
+        Number of seconds to wait between checking for builds
+        that were queued by other processes or are now allowed.
+    :param int max_attempts: Number of times a build is started before it is failed.
+    :param artisan.RedisJobQueue remote:
+        Queue shared with other farms to claim builds from. Builds are only
+        claimed while the farm's builders have free slots and are copied into
+        the farm's own queue. They are acknowledged once they're complete.
+    """
+    def __init__(self, path='artisan-farm.db', policy=None, order='fifo',
+                 poll_interval=5.0, max_attempts=3, remote=None):
+        self.queue = JobQueue(path)
+        self.policy = policy
+        self.scheduler = Scheduler(order=order)
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.remote = remote
+
+        self._lock = Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._admitted = {}
+        self._running = {}
+        self._waiting = []
+        self._last_job_id = None
+        self._remote_ids = None
+        self._next_extend = 0.0
+
+    @property
+    def builders(self):
+        return self.scheduler.builders
+
+    def add_builder(self, builder, labels=None):
+        """
+        Adds a builder to the farm.
+
+        :param artisan.BaseBuilder builder: Builder to add.
+        :param dict labels: Labels that the builder advertises.
+        """
+        self.scheduler.add_builder(builder, labels)
+        builder.add_watcher(self)
+        self._wakeup.set()
+
+    def submit(self, build, community=False, key=None):
+        """
+        Adds a build to the farm's queue.
+
+        :param artisan.BaseBuild build: Build to run.
+        :param bool community: If True the build is only run on secure builders.
+        :param str key: Unique key so the build is only queued once.
+        :returns: ID of the job.
+        """
+        if not isinstance(build, BaseBuild):
+            raise TypeError('`build` must be of type `BaseBuild`.')
+        self.scheduler.check(build)
+        job_id = self.queue.put(build, community=community, key=key)
+        self._wakeup.set()
+        return job_id
+
+    def step(self):
+        """
+        Admits the builds in the queue that the policy allows and gives
+        as many as possible to the builders with free slots.
+
+        :returns: Number of builds that were given to builders.
+        """
+        if self._last_job_id is None:
+            self.queue.recover(self.max_attempts)
+            self._last_job_id = 0
+        self._read_queue()
+        if self.remote is not None:
+            self._claim_remote()
+            self._read_queue()
+
+        waiting = []
+        for request in self._waiting:
+            if self.policy is None or self.policy.allow_build_request(request):
+                self._admit(request)
+            elif not self._release_remote(request):
+                waiting.append(request)
+        self._waiting = waiting
+
+        dispatched = 0
+        for build, builder in self.scheduler.schedule():
+            if self._dispatch(build, builder):
+                dispatched += 1
+        return dispatched
+
+    def _read_queue(self):
+        """ Adds the jobs that were queued since the last step to the waiting jobs. """
+        while True:
+            jobs = self.queue.queued(after=self._last_job_id)
+            if not jobs:
+                break
+            self._waiting.extend(_JobRequest(*job) for job in jobs)
+            self._last_job_id = jobs[-1][0]
+
+    def run_forever(self):
+        """ Runs builds until :meth:`artisan.Farm.stop` is called
+        or the process is interrupted. Running builds are completed
+        before returning. """
+        self._stopped.clear()
+        try:
+            while not self._stopped.is_set():
+                self._wakeup.clear()
+                self.step()
+                self._wakeup.wait(self._next_timeout())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for builder in self.builders:
+                builder.shutdown()
+
+    def stop(self):
+        """ Stops :meth:`artisan.Farm.run_forever`. """
+        self._stopped.set()
+        self._wakeup.set()
+
+    def close(self):
+        self.stop()
+        self.queue.close()
+
+    def on_complete_build(self, builder, build):
+        with self._lock:
+            running = self._running.pop(id(build), None)
+        if running is None:
+            return
+        job_id, started = running
+        error = None if build._handle is None else build._handle.error
+        self._finish(job_id, build.result, error)
+        self.scheduler.complete(builder, build, (monotonic() - started) / 60.0)
+        self._wakeup.set()
+
+    def _admit(self, request):
+        """ Loads an admitted build and hands it to the scheduler. """
+        # Jobs that can't be loaded or scheduled fail rather than
+        # staying in the queue and stopping the farm on every step.
+        try:
+            build = self.queue.get(request.job_id)
+            self.scheduler.submit(build, community=request.community)
+        except Exception:
+            self._finish(request.job_id, 'failure', traceback.format_exc())
+            return
+        self._admitted[id(build)] = request
+
+    def _dispatch(self, build, builder):
+        request = self._admitted.pop(id(build))
+        job_id = request.job_id
+
+        # Builds can wait in the scheduler for a free slot for a
+        # long time so the policy may no longer allow them.
+        if self.policy is not None and not self.policy.allow_build_request(request):
+            self._waiting.append(request)
+            self.scheduler.complete(builder)
+            return False
+
+        self.queue.start(job_id)
+        with self._lock:
+            self._running[id(build)] = (job_id, monotonic())
+        try:
+            if builder.execute_build(build, blocking=False):
+                return True
+            # The builder is being used by something other than the
+            # farm so the build goes back in the queue for a while.
+            self.queue.requeue(job_id)
+            self._waiting.append(request)
+        except Exception:
+            self._finish(job_id, 'failure', traceback.format_exc())
+        with self._lock:
+            self._running.pop(id(build), None)
+        self.scheduler.complete(builder)
+        return False
+
+    def _finish(self, job_id, result, error=None):
+        """ Stores the result of a job and acknowledges
+        it if it was claimed from the remote queue. """
+        self.queue.finish(job_id, result, error)
+        if self.remote is not None:
+            with self._lock:
+                remote_id = self._remote_ids.pop(job_id, None)
+            if remote_id is not None:
+                self.remote.ack(remote_id, result)
+
+    def _claim_remote(self):
+        """ Claims as many builds from the remote queue as the builders
+        have free slots for and stops builds that this farm claimed
+        earlier from being reclaimed by other farms. """
+        if self._remote_ids is None:
+            remote_ids = {}
+            for job_id, key in six.iteritems(self.queue.keys(_REMOTE_PREFIX)):
+                remote_ids[job_id] = key[len(_REMOTE_PREFIX):]
+            with self._lock:
+                self._remote_ids = remote_ids
+
+        # Builds aren't claimed unless the policy could allow
+        # them so that other farms can run them in the meantime.
+        claimable = self.scheduler.free_slots - self.scheduler.pending - len(self._waiting)
+        if claimable > 0 and (self.policy is None or self.policy.allow_build_request(None)):
+            for remote_id, build, community in self.remote.claim(claimable):
+                request = _JobRequest(None, build.duration, community)
+                if self.policy is not None and not self.policy.allow_build_request(request):
+                    self.remote.release(remote_id, build, community)
+                    continue
+                job_id = self.queue.put(build, community=community,
+                                        key=_REMOTE_PREFIX + remote_id)
+                state, result = self.queue.state(job_id)
+                if state == 'done':
+                    # Completed before the acknowledgement was sent.
+                    self.remote.ack(remote_id, result)
+                else:
+                    with self._lock:
+                        self._remote_ids[job_id] = remote_id
+
+        now = monotonic()
+        if now >= self._next_extend:
+            self._next_extend = now + self.remote.visibility_timeout / 3.0
+            with self._lock:
+                remote_ids = list(six.itervalues(self._remote_ids))
+            self.remote.extend(remote_ids)
+
+    def _release_remote(self, request):
+        """ Gives a build that the policy doesn't allow back
+        to the remote queue for other farms to claim. """
+        if self.remote is None:
+            return False
+        with self._lock:
+            remote_id = self._remote_ids.pop(request.job_id, None)
+        if remote_id is None:
+            return False
+        self.remote.release(remote_id, self.queue.get(request.job_id), request.community)
+        self.queue.finish(request.job_id, 'released')
+        return True
+
+    def _next_timeout(self):
+        """ Waits until the next poll or until the policy might allow more builds. """
+        timeout = self.poll_interval
+        if self._waiting and hasattr(self.policy, 'next_transition'):
+            transition = self.policy.next_transition()
+            if transition is not None:
+                timeout = max(0.0, min(timeout, transition - time.time()))
+        return timeout
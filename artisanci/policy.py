@@ -1,11 +1,41 @@
+#           Copyright (c) 2017 Seth Michael Larson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+""" Module for policies that decide which builds a farm accepts. """
+
+import bisect
+import calendar
+import collections
 import datetime
+import time
 import pendulum
+from .compat import Lock
 
 __all__ = [
     'BasePolicy',
+    'Schedule',
     'TimePolicy'
 ]
 
+# Number of seconds to leave between a build finishing and the end of a policy.
+_BUFFER = 3 * 60
+
+# Number of days of precomputed windows to keep.
+_MAX_DAYS = 8
+
+_SECONDS_PER_DAY = 24 * 60 * 60
+
 
 class BasePolicy(object):
     """ Object for describing how a farm should act """
@@ -14,6 +44,23 @@ class BasePolicy(object):
 
 
 class TimePolicy(BasePolicy):
+    """ Policy that allows builds during a time of each day.
+    A build is only allowed if it would finish, with a 3 minute
+    buffer, before the end of the time and if its duration isn't
+    longer than ``max_duration`` minutes.
+
+    The times of each day are converted to windows of UTC timestamps
+    once and kept so that checking a request is a binary search
+    rather than converting between timezones. The window that
+    the current time is in is also kept until the next time that
+    the policy starts or ends.
+
+    :param str timezone: Timezone that the times are in.
+    :param datetime.time start_time: Time of day that the policy starts.
+    :param datetime.time end_time: Time of day that the policy ends.
+    :param bool all_day: If True the policy allows builds at any time.
+    :param float max_duration: Number of minutes a build may take.
+    """
     def __init__(self, **kwargs):
         start_time = None
         end_time = None
@@ -52,7 +99,7 @@ class TimePolicy(BasePolicy):
             raise ValueError('`all_day` can\'t be be `True` if `start_time` and `end_time` are given.')
         if not all_day and start_time is None and end_time is None:
             raise ValueError('Must have either `all_day` or `start_time` and `end_time` given.')
-        if start_time > end_time:
+        if start_time is not None and start_time > end_time:
             raise ValueError('`start_time` must be before `end_time`.')
 
         self.timezone = pendulum.timezone(timezone)
@@ -61,12 +108,207 @@ class TimePolicy(BasePolicy):
         self.all_day = all_day
         self.max_duration = max_duration
 
-    def allow_build_request(self, request=None):
+        self._lock = Lock()
+        self._days = collections.OrderedDict()
+        self._current = None
+
+    def allow_build_request(self, request=None, now=None):
+        """
+        Checks whether a build may start now.
+
+        :param request: Build request with a ``duration`` in minutes.
+        :param float now: UTC timestamp to check instead of the current time.
+        :rtype: bool
+        """
+        duration = 0.0 if request is None else request.duration
+        if duration > self.max_duration:
+            return False
         if self.all_day:
             return True
+        if now is None:
+            now = time.time()
+        window_end = self._window_end(now)
+        return window_end is not None and now + duration * 60 + _BUFFER <= window_end
+
+    def next_transition(self, now=None):
+        """
+        Gets the time that the policy next starts or ends.
+
+        :param float now: UTC timestamp to start from instead of the current time.
+        :returns: UTC timestamp or None if the policy is all day.
+        """
+        if self.all_day:
+            return None
+        if now is None:
+            now = time.time()
+        self._window_end(now)
+        return self._current[1]
+
+    def windows(self, day):
+        """
+        Gets the windows of time that overlap a UTC day.
+
+        :param int day: Number of days since the epoch.
+        :returns: Sorted list of ``(start, end)`` UTC timestamps.
+        """
+        with self._lock:
+            windows = self._days.get(day)
+            if windows is not None:
+                return windows
+
+        # Offsets from UTC are less than a day so only the local
+        # days before and after can overlap with the UTC day.
+        windows = []
+        date = datetime.date(1970, 1, 1) + datetime.timedelta(days=day)
+        for offset in [-1, 0, 1]:
+            local_date = date + datetime.timedelta(days=offset)
+            start = self._timestamp(local_date, self.start_time)
+            end = self._timestamp(local_date, self.end_time)
+            if end > start:
+                windows.append((start, end))
+
+        with self._lock:
+            self._days[day] = windows
+            while len(self._days) > _MAX_DAYS:
+                self._days.popitem(last=False)
+        return windows
+
+    def _window_end(self, now):
+        """ Gets the end of the window that ``now`` is in or None
+        if it's not in a window. The answer is kept until the next
+        time the policy starts or ends. """
+        current = self._current
+        if current is not None and current[0] <= now < current[1]:
+            return current[2]
+
+        day = int(now // _SECONDS_PER_DAY)
+        windows = sorted(set(self.windows(day) + self.windows(day + 1)))
+        index = bisect.bisect_right(windows, (now, float('inf'))) - 1
+        if index >= 0 and now < windows[index][1]:
+            start, end = windows[index]
+            current = (start, end, end)
+        else:
+            start = windows[index][1] if index >= 0 else day * _SECONDS_PER_DAY
+            if index + 1 < len(windows):
+                end = windows[index + 1][0]
+            else:
+                end = (day + 2) * _SECONDS_PER_DAY
+            current = (start, end, None)
+        self._current = current
+        return current[2]
+
+    def _timestamp(self, date, local_time):
+        local = self.timezone.convert(datetime.datetime.combine(date, local_time))
+        return calendar.timegm(local.utctimetuple()) + local.microsecond / 1e6
+
+    def __getstate__(self):
+        __dict__ = self.__dict__.copy()
+        __dict__['_lock'] = None
+        __dict__['_days'] = None
+        __dict__['_current'] = None
+        return __dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+        self._days = collections.OrderedDict()
+
+
+class Schedule(BasePolicy):
+    """ Group of policies where a build is allowed if any of the
+    policies allow it. The windows of every :class:`artisan.TimePolicy`
+    are merged into one table for each day so that finding the
+    policies that allow a request is a single binary search no
+    matter how many policies there are.
+
+    :param list policies: Policies to start the schedule with.
+    """
+    def __init__(self, policies=None):
+        self.policies = []
+
+        self._lock = Lock()
+        self._days = collections.OrderedDict()
+        for policy in policies or []:
+            self.add_policy(policy)
+
+    def add_policy(self, policy):
+        """
+        Adds a policy to the schedule.
+
+        :param artisan.BasePolicy policy: Policy to add.
+        """
+        if not isinstance(policy, BasePolicy):
+            raise TypeError('`policy` must be of type `BasePolicy`.')
+        with self._lock:
+            self.policies.append(policy)
+            self._days.clear()
+
+    def allow_build_request(self, request=None, now=None):
+        """
+        Checks whether any policy allows a build to start now.
+
+        :param request: Build request with a ``duration`` in minutes.
+        :param float now: UTC timestamp to check instead of the current time.
+        :rtype: bool
+        """
+        return bool(self.allowed_policies(request, now))
+
+    def allowed_policies(self, request=None, now=None):
+        """
+        Finds all policies that allow a build to start now.
+
+        :param request: Build request with a ``duration`` in minutes.
+        :param float now: UTC timestamp to check instead of the current time.
+        :returns: List of policies in the order they were added.
+        """
+        if now is None:
+            now = time.time()
+        duration = 0.0 if request is None else request.duration
+        finish = now + duration * 60 + _BUFFER
+
+        allowed = []
+        bounds, segments, others = self._segments(int(now // _SECONDS_PER_DAY))
+        index = bisect.bisect_right(bounds, now) - 1
+        if 0 <= index < len(segments):
+            for position, policy, window_end in segments[index]:
+                if finish <= window_end and duration <= policy.max_duration:
+                    allowed.append((position, policy))
+        for position, policy in others:
+            if policy.allow_build_request(request):
+                allowed.append((position, policy))
+        allowed.sort(key=lambda item: item[0])
+        return [policy for _, policy in allowed]
+
+    def _segments(self, day):
+        """ Splits a UTC day into segments between the times that any
+        policy starts or ends along with the policies that are active
+        during each segment and when their windows end. """
+        with self._lock:
+            table = self._days.get(day)
+            if table is not None:
+                return table
+            policies = list(self.policies)
+
+        others = []
+        windows = []
+        for position, policy in enumerate(policies):
+            if isinstance(policy, TimePolicy) and not policy.all_day:
+                for start, end in policy.windows(day):
+                    windows.append((start, end, position, policy))
+            else:
+                others.append((position, policy))
 
-        now = self.timezone.fromutc(pendulum.utcnow())
+        bounds = sorted(set([start for start, _, _, _ in windows] +
+                            [end for _, end, _, _ in windows]))
+        segments = []
+        for segment_start in bounds[:-1]:
+            segments.append([(position, policy, end)
+                             for start, end, position, policy in windows
+                             if start <= segment_start < end])
+        table = (bounds, segments, others)
 
-        # Allow a 3 minute buffer at the end of policies.
-        delta = datetime.timedelta(seconds=60 * (3 + request.duration))
-        return now.time() < self.start_time or (now + delta).time() > self.end_time
+        with self._lock:
+            self._days[day] = table
+            while len(self._days) > _MAX_DAYS:
+                self._days.popitem(last=False)
+        return table
@@ -0,0 +1,268 @@
+#           Copyright (c) 2017 Seth Michael Larson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+""" Module for a job queue in Redis that is shared by many farms. """
+
+import os
+import pickle
+import socket
+import six
+from .compat import Lock, monotonic
+from .exceptions import ArtisanException
+
+__all__ = [
+    'RedisJobQueue'
+]
+
+# Number of pending jobs to look at a time for ones to reclaim.
+_PENDING_PAGE_SIZE = 100
+
+
+class RedisJobQueue(object):
+    """ Queue of builds kept in a Redis stream so that builds can be
+    queued by the server and run by farms on many machines. Requires
+    Redis 5.0 or later and ``redis`` 3.0 or later.
+
+    Every farm reads from the same consumer group so each build is
+    claimed by a single farm. A claimed build stays pending until the
+    farm acknowledges it with :meth:`artisan.RedisJobQueue.ack`. Builds
+    that have been pending for longer than ``visibility_timeout`` seconds
+    without the farm calling :meth:`artisan.RedisJobQueue.extend` are
+    assumed to be lost with the farm and are claimed by another one.
+    Builds are failed once they have been claimed ``max_attempts`` times.
+
+    Builds are pickled so the Redis server must only be
+    writable by the server and farms that are trusted.
+
+    :param client: ``redis.StrictRedis`` client to use.
+    :param str name: Name of the stream.
+    :param str group: Name of the consumer group that farms read from.
+    :param str consumer: Name of this farm within the group.
+    :param float visibility_timeout:
+        Number of seconds a build may be pending before it is reclaimed.
+    :param int max_attempts: Number of times a build is claimed before it is failed.
+    :param int result_ttl: Number of seconds that results are kept for.
+    """
+    def __init__(self, client, name='artisanci:jobs', group='farms', consumer=None,
+                 visibility_timeout=600.0, max_attempts=3, result_ttl=7 * 24 * 60 * 60):
+        if consumer is None:
+            consumer = '%s-%d' % (socket.gethostname(), os.getpid())
+        if visibility_timeout <= 0:
+            raise ValueError('`visibility_timeout` must be positive.')
+        if max_attempts < 1:
+            raise ValueError('`max_attempts` must be at least 1.')
+
+        self.client = client
+        self.name = name
+        self.group = group
+        self.consumer = consumer
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+
+        self._lock = Lock()
+        self._group_created = False
+        self._next_reclaim = None
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """
+        Creates a queue that connects to a Redis server.
+
+        :param str url: URL of the Redis server like ``redis://localhost:6379/0``.
+        :rtype: artisan.RedisJobQueue
+        """
+        try:
+            import redis
+        except ImportError:
+            raise ArtisanException('The `redis` module is required to '
+                                   'use a `RedisJobQueue`.')
+        return cls(redis.StrictRedis.from_url(url), **kwargs)
+
+    def put(self, build, community=False):
+        """
+        Adds a build to the queue.
+
+        :param artisan.BaseBuild build: Build to add.
+        :param bool community: If True the build is only run on secure builders.
+        :returns: ID of the job.
+        """
+        self._create_group()
+        job_id = self.client.xadd(self.name, {
+            'payload': pickle.dumps(build, pickle.HIGHEST_PROTOCOL),
+            'community': '1' if community else '0'
+        })
+        return _decode(job_id)
+
+    def claim(self, count=1, block=None):
+        """
+        Claims builds for this farm to run. Builds that other farms
+        have lost are claimed before builds that haven't been run.
+
+        :param int count: Maximum number of builds to claim.
+        :param float block: Number of seconds to wait for a build to be queued.
+        :returns: List of ``(job_id, build, community)`` tuples.
+        """
+        self._create_group()
+        claimed = self._reclaim(count)
+        if len(claimed) < count:
+            kwargs = {}
+            if block is not None:
+                kwargs['block'] = int(block * 1000)
+            streams = self.client.xreadgroup(self.group, self.consumer, {self.name: '>'},
+                                             count=count - len(claimed), **kwargs)
+            for _, entries in streams or []:
+                claimed.extend(self._load(entries))
+        return claimed
+
+    def ack(self, job_id, result):
+        """
+        Acknowledges that a build is complete and stores its result.
+
+        :param str job_id: ID of the job.
+        :param str result: Result of the build.
+        """
+        pipeline = self.client.pipeline()
+        pipeline.set(self._result_key(job_id), result, ex=self.result_ttl)
+        pipeline.xack(self.name, self.group, job_id)
+        pipeline.xdel(self.name, job_id)
+        pipeline.execute()
+
+    def release(self, job_id, build, community=False):
+        """
+        Gives a claimed build back so that any farm can claim it straight
+        away instead of after ``visibility_timeout``. The build is queued
+        again at the end of the queue with a new ID.
+
+        :param str job_id: ID of the job.
+        :param artisan.BaseBuild build: Build of the job.
+        :param bool community: If True the build is only run on secure builders.
+        :returns: New ID of the job.
+        """
+        pipeline = self.client.pipeline()
+        pipeline.xadd(self.name, {
+            'payload': pickle.dumps(build, pickle.HIGHEST_PROTOCOL),
+            'community': '1' if community else '0'
+        })
+        pipeline.xack(self.name, self.group, job_id)
+        pipeline.xdel(self.name, job_id)
+        return _decode(pipeline.execute()[0])
+
+    def extend(self, job_ids):
+        """
+        Tells other farms that builds claimed by this farm are still
+        being run so that they aren't reclaimed after ``visibility_timeout``.
+
+        :param list job_ids: IDs of the jobs.
+        """
+        if job_ids:
+            self.client.xclaim(self.name, self.group, self.consumer, 0,
+                               list(job_ids), justid=True)
+
+    def result(self, job_id):
+        """
+        Gets the result of a build.
+
+        :param str job_id: ID of the job.
+        :returns: Result or None if the build isn't complete.
+        """
+        result = self.client.get(self._result_key(job_id))
+        return None if result is None else _decode(result)
+
+    def pending(self):
+        """ Number of builds that have been claimed and not acknowledged. """
+        self._create_group()
+        pending = self.client.xpending(self.name, self.group)
+        return pending['pending']
+
+    def _reclaim(self, count):
+        """ Claims builds that have been pending for longer than the
+        visibility timeout. Only looks every so often as it means
+        going through every pending build. """
+        now = monotonic()
+        with self._lock:
+            if self._next_reclaim is not None and now < self._next_reclaim:
+                return []
+            self._next_reclaim = now + self.visibility_timeout / 4.0
+
+        min_idle = int(self.visibility_timeout * 1000)
+        stuck = []
+        failed = []
+        start = '-'
+        while len(stuck) < count:
+            page = self.client.xpending_range(self.name, self.group, start, '+',
+                                              _PENDING_PAGE_SIZE)
+            for entry in page:
+                if entry['time_since_delivered'] < min_idle:
+                    continue
+                job_id = _decode(entry['message_id'])
+                if entry['times_delivered'] >= self.max_attempts:
+                    failed.append(job_id)
+                elif len(stuck) < count:
+                    stuck.append(job_id)
+            if len(page) < _PENDING_PAGE_SIZE:
+                break
+            start = _next_id(_decode(page[-1]['message_id']))
+
+        for job_id in failed:
+            self.ack(job_id, 'failure')
+        if not stuck:
+            return []
+        # Only builds that are still idle are claimed in case
+        # another farm reclaimed them or extended them meanwhile.
+        entries = self.client.xclaim(self.name, self.group, self.consumer,
+                                     min_idle, stuck)
+        return self._load(entries)
+
+    def _load(self, entries):
+        claimed = []
+        for job_id, fields in entries:
+            job_id = _decode(job_id)
+            if not fields:
+                # The entry was deleted after it was claimed.
+                self.client.xack(self.name, self.group, job_id)
+                continue
+            fields = dict((_decode(key), value) for key, value in six.iteritems(fields))
+            try:
+                build = pickle.loads(fields['payload'])
+            except Exception:
+                self.ack(job_id, 'failure')
+                continue
+            claimed.append((job_id, build, _decode(fields['community']) == '1'))
+        return claimed
+
+    def _create_group(self):
+        if self._group_created:
+            return
+        try:
+            self.client.xgroup_create(self.name, self.group, id='0', mkstream=True)
+        except Exception as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._group_created = True
+
+    def _result_key(self, job_id):
+        return '%s:result:%s' % (self.name, job_id)
+
+
+def _next_id(job_id):
+    """ Gets the smallest stream ID after another one. """
+    milliseconds, sequence = job_id.split('-')
+    return '%s-%d' % (milliseconds, int(sequence) + 1)
+
+
+def _decode(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
@@ -2,6 +2,14 @@ import sys
 import colorama
 colorama.init()
 
+__all__ = [
+    'BaseReporter',
+    'BasicCommandLineReporter',
+    'LogFile',
+    'LogReporter',
+    'LogWriter'
+]
+
 
 class BaseReporter(object):
     def on_command(self, _, command):
@@ -29,3 +37,6 @@ class BasicCommandLineReporter(BaseReporter):
             print(colorama.Fore.LIGHTGREEN_EX + 'Build Status: SUCCESS' + colorama.Style.RESET_ALL)
         elif status == 'failure':
             print(colorama.Fore.LIGHTRED_EX + 'Build Status: FAILURE' + colorama.Style.RESET_ALL)
+
+
+from .log_reporter import LogFile, LogReporter, LogWriter  # noqa: E402
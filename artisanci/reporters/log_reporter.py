@@ -0,0 +1,331 @@
+#           Copyright (c) 2017 Seth Michael Larson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+""" Reporter that stores build output in compressed, seekable log files. """
+
+import bisect
+import os
+import struct
+import uuid
+import zlib
+from . import BaseReporter
+from ..compat import Lock, monotonic
+from ..exceptions import ArtisanException
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__all__ = [
+    'LogFile',
+    'LogReporter',
+    'LogWriter'
+]
+
+# Index files start with a magic string, a version and the compression.
+_INDEX_MAGIC = b'ARTIDX'
+_INDEX_VERSION = 1
+_INDEX_HEADER = struct.Struct('>6sBB')
+
+# Each block has a record of its offset in the output, its offset in
+# the log file, its compressed size and its size in the output.
+_INDEX_RECORD = struct.Struct('>QQII')
+
+_COMPRESSIONS = ['gzip', 'zstd']
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+
+def _compress(compression, data, level):
+    if compression == 'gzip':
+        # Each block is a complete gzip member so the
+        # log file is also a valid gzip file as a whole.
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def _decompress(compression, data):
+    if compression == 'gzip':
+        return zlib.decompress(data, 31)
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def _check_compression(compression):
+    if compression not in _COMPRESSIONS:
+        raise ValueError('`compression` must be one of `%s`.' % '`, `'.join(_COMPRESSIONS))
+    if compression == 'zstd' and zstandard is None:
+        raise ArtisanException('The `zstandard` module is required '
+                               'for `zstd` compressed logs.')
+
+
+class LogFile(object):
+    """ Reads ranges of output from a log written by :class:`artisan.LogWriter`
+    without decompressing any more blocks than needed. The log can be read
+    while it's still being written, new blocks are found on each read.
+
+    :param str path: Path to the log file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.compression = None
+
+        self._offsets = []
+        self._records = []
+        self._index_position = 0
+
+    @property
+    def size(self):
+        """ Number of bytes of output that are in the log. """
+        self.refresh()
+        return self._size()
+
+    def refresh(self):
+        """ Loads index records that were added since the last read. """
+        if not os.path.isfile(self.index_path):
+            return
+        with open(self.index_path, 'rb') as f:
+            if self._index_position == 0:
+                header = f.read(_INDEX_HEADER.size)
+                if len(header) < _INDEX_HEADER.size:
+                    return
+                magic, version, compression = _INDEX_HEADER.unpack(header)
+                if magic != _INDEX_MAGIC or version != _INDEX_VERSION:
+                    raise ArtisanException('`%s` is not a build log index.' % self.index_path)
+                self.compression = _COMPRESSIONS[compression]
+                self._index_position = _INDEX_HEADER.size
+            f.seek(self._index_position)
+            data = f.read()
+        # A record that is only partly written is picked up on a later read.
+        count = len(data) // _INDEX_RECORD.size
+        for i in range(count):
+            record = _INDEX_RECORD.unpack_from(data, i * _INDEX_RECORD.size)
+            self._offsets.append(record[0])
+            self._records.append(record)
+        self._index_position += count * _INDEX_RECORD.size
+
+    def read(self, offset=0, size=-1):
+        """
+        Reads a range of the output.
+
+        :param int offset: Offset in the output to start reading at.
+        :param int size: Number of bytes to read, or -1 to read to the end.
+        :rtype: bytes
+        """
+        self.refresh()
+        if offset < 0:
+            raise ValueError('`offset` must not be negative.')
+        end = self._size() if size < 0 else min(self._size(), offset + size)
+        if offset >= end:
+            return b''
+        chunks = []
+        first = max(0, bisect.bisect_right(self._offsets, offset) - 1)
+        with open(self.path, 'rb') as f:
+            for raw_offset, file_offset, compressed_size, raw_size in self._records[first:]:
+                if raw_offset >= end:
+                    break
+                f.seek(file_offset)
+                block = _decompress(self.compression, f.read(compressed_size))
+                chunks.append(block[max(0, offset - raw_offset):end - raw_offset])
+        return b''.join(chunks)
+
+    def tail(self, size):
+        """
+        Reads the last ``size`` bytes of the output.
+
+        :param int size: Number of bytes to read.
+        :rtype: bytes
+        """
+        self.refresh()
+        return self.read(max(0, self._size() - size))
+
+    def _size(self):
+        if not self._records:
+            return 0
+        return self._records[-1][0] + self._records[-1][3]
+
+
+class LogWriter(object):
+    """ Appends output to a log file in independently compressed blocks
+    and records where each block is in an index file next to it.
+
+    Opening an existing log continues it, discarding anything
+    after the last block that made it into the index.
+
+    :param str path: Path to the log file.
+    :param str compression: Either ``gzip`` or ``zstd``.
+    :param int block_size: Number of bytes of output to compress into each block.
+    :param int level: Compression level.
+    """
+    def __init__(self, path, compression='gzip', block_size=DEFAULT_BLOCK_SIZE, level=6):
+        _check_compression(compression)
+        self.path = path
+        self.compression = compression
+        self.block_size = block_size
+        self.level = level
+
+        self._lock = Lock()
+        self._buffer = []
+        self._buffered = 0
+
+        log = LogFile(path)
+        log.refresh()
+        if log.compression is not None and log.compression != compression:
+            raise ArtisanException('The log `%s` is compressed with `%s` '
+                                   'not `%s`.' % (path, log.compression, compression))
+        self._raw_offset = log._size()
+        self._file_offset = 0
+        if log._records:
+            self._file_offset = log._records[-1][1] + log._records[-1][2]
+
+        self._log = open(path, 'ab')
+        self._log.truncate(self._file_offset)
+        self._index = open(log.index_path, 'ab')
+        self._index.truncate(log._index_position)
+        if log._index_position == 0:
+            self._index.write(_INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION,
+                                                 _COMPRESSIONS.index(compression)))
+            self._index.flush()
+
+    def write(self, data):
+        """ Adds output to the log, compressing full blocks. """
+        with self._lock:
+            self._buffer.append(data)
+            self._buffered += len(data)
+            if self._buffered >= self.block_size:
+                self._write_blocks(False)
+
+    def flush(self):
+        """ Compresses and writes any buffered output as a block. """
+        with self._lock:
+            self._write_blocks(True)
+
+    def close(self):
+        with self._lock:
+            if self._log is None:
+                return
+            self._write_blocks(True)
+            self._log.close()
+            self._index.close()
+            self._log = None
+            self._index = None
+
+    def _write_blocks(self, partial):
+        data = b''.join(self._buffer)
+        start = 0
+        while len(data) - start >= self.block_size or (partial and start < len(data)):
+            block = data[start:start + self.block_size]
+            compressed = _compress(self.compression, block, self.level)
+            self._log.write(compressed)
+            # The block must be in the log before the index points to it.
+            self._log.flush()
+            self._index.write(_INDEX_RECORD.pack(self._raw_offset, self._file_offset,
+                                                 len(compressed), len(block)))
+            self._index.flush()
+            self._raw_offset += len(block)
+            self._file_offset += len(compressed)
+            start += len(block)
+        self._buffer = [data[start:]] if start < len(data) else []
+        self._buffered = len(data) - start
+
+
+class LogReporter(BaseReporter):
+    """ Reporter that writes the commands and raw output of each
+    build to its own :class:`artisan.LogWriter` log file so that
+    logs are cheap to store and ranges of them cheap to read.
+
+    Logs are named after the ``build_id`` of the build or
+    a random name if the build doesn't have one.
+
+    :param str directory: Directory to write logs to.
+    :param str compression: Either ``gzip`` or ``zstd``.
+    :param int block_size: Number of bytes of output to compress into each block.
+    :param float flush_interval:
+        Number of seconds that output can be buffered before it's
+        written as a block so that running builds can be followed.
+    """
+    def __init__(self, directory, compression='gzip', block_size=DEFAULT_BLOCK_SIZE,
+                 flush_interval=1.0):
+        _check_compression(compression)
+        self.directory = directory
+        self.compression = compression
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+
+        self._lock = Lock()
+        self._writers = {}
+        self._names = {}
+
+    def path_for(self, build):
+        """ Returns the path of the log file for a build. """
+        with self._lock:
+            name = self._names.get(id(build))
+            if name is None:
+                name = build.build_id
+                if name is None:
+                    name = uuid.uuid4().hex
+                self._names[id(build)] = name
+        return os.path.join(self.directory, '%s.log' % name)
+
+    def on_command(self, build, command):
+        self._write(build, ('$ %s\n' % command).encode('utf-8'))
+
+    def on_command_output(self, build, output):
+        self._write(build, output)
+
+    def on_command_error(self, build, output):
+        self._write(build, output)
+
+    def on_status_change(self, build, status):
+        writer = self._writers.get(id(build))
+        if writer is not None:
+            writer[0].flush()
+            writer[1] = monotonic()
+
+    def on_complete(self, build, result):
+        with self._lock:
+            writer = self._writers.pop(id(build), None)
+            self._names.pop(id(build), None)
+        if writer is not None:
+            writer[0].close()
+
+    def _write(self, build, data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        writer = self._writers.get(id(build))
+        if writer is None:
+            path = self.path_for(build)
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with self._lock:
+                writer = self._writers.get(id(build))
+                if writer is None:
+                    writer = [LogWriter(path, self.compression, self.block_size), monotonic()]
+                    self._writers[id(build)] = writer
+        writer[0].write(data)
+        if monotonic() - writer[1] >= self.flush_interval:
+            writer[0].flush()
+            writer[1] = monotonic()
+
+    def __getstate__(self):
+        __dict__ = self.__dict__.copy()
+        __dict__['_lock'] = None
+        __dict__['_writers'] = {}
+        __dict__['_names'] = {}
+        return __dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
@@ -0,0 +1,514 @@
+#           Copyright (c) 2017 Seth Michael Larson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+""" Module for matching jobs to the builders that are able to run them. """
+
+import bisect
+import collections
+import heapq
+import itertools
+import re
+import six
+from .compat import Lock
+from .exceptions import ArtisanException
+
+__all__ = [
+    'RuntimeHistory',
+    'Scheduler'
+]
+
+# A label value is a name followed by an optional version
+# constraint such as `cpython==3.6`, `ubuntu>=12.04` or `linux`.
+_LABEL_REGEX = re.compile(r'^\s*([^=!<>\s]*)\s*(==|!=|>=|<=|>|<)?\s*([^=!<>\s]*)\s*$')
+
+# Operators that a builder may use to advertise a label value.
+_ADVERTISE_OPERATORS = set([None, '=='])
+
+# Number of distinct requires to remember the matching builders of.
+_MAX_MATCHES = 4096
+
+# Orders that queued jobs can be given to builders in.
+_ORDERS = set(['fifo', 'shortest', 'longest'])
+
+# Number of parsed label values to keep.
+_MAX_PARSED_LABELS = 4096
+
+_parsed_labels = {}
+
+
+class Scheduler(object):
+    """ Matches jobs to the builders that can run them and packs
+    them onto the builders' free slots. Each builder has as many
+    slots as its ``builders`` capacity.
+
+    Builders are indexed by the labels they advertise so that the
+    builders able to run a job are found by looking up each of the
+    job's ``requires`` in the index rather than by checking every
+    builder. Jobs with the same ``requires`` are queued together and
+    only matched once until builders are added or removed.
+
+    Label values are a name with an optional version, like
+    ``cpython==3.6``, ``ubuntu==16.04``, ``linux`` or ``5.1.22``.
+    A builder may advertise a list of values for a label, for example
+    every Python interpreter that it has installed. A job's requires
+    may compare versions with ``==``, ``!=``, ``>=``, ``<=``, ``>`` and
+    ``<`` or give only a name to match any version of it.
+
+    Jobs submitted with ``community=True`` are only given to builders
+    that were secure when they were added to the scheduler.
+
+    By default jobs are given out in the order they were submitted.
+    With ``order='shortest'`` the jobs that are expected to finish
+    soonest go first (shortest job first) which gets the most jobs
+    done for a busy farm. With ``order='longest'`` the longest jobs go
+    first and each is put on the least loaded of its builders (longest
+    processing time) so that a large matrix of jobs all finishes as
+    early as possible. How long a job takes is estimated from its
+    declared ``duration`` blended with the runtimes recorded in
+    ``history`` for the same script and ``requires``.
+
+    :param str order: Either ``fifo``, ``shortest`` or ``longest``.
+    :param artisan.RuntimeHistory history:
+        Runtimes of previous jobs. A new history is used if not given.
+    """
+    def __init__(self, order='fifo', history=None):
+        if order not in _ORDERS:
+            raise ValueError('`order` must be one of `fifo`, `shortest` or `longest`.')
+        if history is None:
+            history = RuntimeHistory()
+        if not isinstance(history, RuntimeHistory):
+            raise TypeError('`history` must be of type `RuntimeHistory`.')
+        self.order = order
+        self.history = history
+
+        self._lock = Lock()
+        self._builders = {}
+        self._slots = {}
+        self._secure = set()
+        self._index = {}
+        self._matches = {}
+        self._pending = {}
+        self._counter = itertools.count()
+        self._free_slots = 0
+
+    @property
+    def builders(self):
+        """ List of the builders that jobs are scheduled on. """
+        with self._lock:
+            return list(self._builders)
+
+    @property
+    def free_slots(self):
+        """ Number of slots on all builders that don't have a job. """
+        with self._lock:
+            return self._free_slots
+
+    @property
+    def pending(self):
+        """ Number of jobs that are waiting for a builder. """
+        with self._lock:
+            return sum(len(jobs) for jobs in six.itervalues(self._pending))
+
+    def add_builder(self, builder, labels=None):
+        """
+        Adds a builder for jobs to be scheduled on.
+
+        :param artisan.BaseBuilder builder: Builder to add.
+        :param dict labels:
+            Labels that the builder advertises. Values may be
+            a string or a list of strings.
+        """
+        if labels is None:
+            labels = {}
+        if not isinstance(labels, dict):
+            raise TypeError('`labels` must be of type `dict`.')
+        parsed = []
+        for label, values in six.iteritems(labels):
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            for value in values:
+                name, operator, version = _parse_label(_label_string(value))
+                if operator not in _ADVERTISE_OPERATORS:
+                    raise ValueError('Builders must advertise exact label values, '
+                                     'not `%s: %s`.' % (label, value))
+                parsed.append((label, name, version))
+
+        with self._lock:
+            if builder in self._builders:
+                raise ValueError('Builder is already added to the scheduler.')
+            self._builders[builder] = parsed
+            self._slots[builder] = builder.builders
+            self._free_slots += builder.builders
+            if builder.is_secure:
+                self._secure.add(builder)
+            for label, name, version in parsed:
+                index = self._index.get((label, name))
+                if index is None:
+                    index = self._index[(label, name)] = _VersionIndex()
+                index.add(version, builder)
+            self._matches.clear()
+
+    def remove_builder(self, builder):
+        """
+        Removes a builder so that no more jobs are scheduled on it.
+
+        :param artisan.BaseBuilder builder: Builder to remove.
+        """
+        with self._lock:
+            parsed = self._builders.pop(builder)
+            self._free_slots -= max(0, self._slots.pop(builder))
+            self._secure.discard(builder)
+            for label, name, version in parsed:
+                index = self._index[(label, name)]
+                index.remove(version, builder)
+                if not index.builders:
+                    del self._index[(label, name)]
+            self._matches.clear()
+
+    def match(self, requires, community=False):
+        """
+        Finds all builders that are able to run a job
+        regardless of whether they have a free slot.
+
+        :param dict requires: Labels that the job requires.
+        :param bool community: If True only matches secure builders.
+        :returns: List of builders.
+        """
+        with self._lock:
+            return list(self._match(_requires_key(requires), community))
+
+    def submit(self, job, community=False):
+        """
+        Queues a job to be given to a builder by :meth:`artisan.Scheduler.schedule`.
+        The estimated duration of jobs is taken when they are submitted.
+
+        :param job: Build or :class:`artisan.JobSpec` to schedule.
+        :param bool community: If True the job is only given to secure builders.
+        """
+        requires_key = _requires_key(job.requires)
+        if self.order == 'fifo':
+            priority = 0.0
+        else:
+            priority = self.history.estimate(job, requires_key)
+            if self.order == 'longest':
+                priority = -priority
+        key = (requires_key, community)
+        with self._lock:
+            jobs = self._pending.get(key)
+            if jobs is None:
+                jobs = self._pending[key] = []
+            heapq.heappush(jobs, (priority, next(self._counter), job))
+
+    def check(self, job):
+        """
+        Checks that a job's requires can be scheduled without queueing it.
+
+        :param job: Build or :class:`artisan.JobSpec` to check.
+        :raises: :class:`artisan.ArtisanException` if a label value can't be parsed.
+        """
+        _requires_key(job.requires)
+
+    def schedule(self):
+        """
+        Assigns as many of the queued jobs as possible to the free slots
+        of the builders that can run them. Jobs are assigned in the scheduler's
+        ``order`` unless none of the builders able to run a job have a free
+        slot. Unless the order is ``longest`` each job takes the matching
+        builder with the fewest free slots so that builders with many free
+        slots stay available for jobs that fewer builders are able to run.
+
+        Each assigned job holds its slot until
+        :meth:`artisan.Scheduler.complete` is called.
+
+        :returns: List of ``(job, builder)`` tuples.
+        """
+        assignments = []
+        with self._lock:
+            if self._free_slots <= 0:
+                return assignments
+            heap = [(jobs[0][:2], key) for key, jobs in six.iteritems(self._pending)]
+            heapq.heapify(heap)
+            while heap and self._free_slots > 0:
+                _, key = heapq.heappop(heap)
+                builder = self._pick(self._match(*key))
+                if builder is None:
+                    continue
+                jobs = self._pending[key]
+                _, _, job = heapq.heappop(jobs)
+                self._slots[builder] -= 1
+                self._free_slots -= 1
+                assignments.append((job, builder))
+                if jobs:
+                    heapq.heappush(heap, (jobs[0][:2], key))
+                else:
+                    del self._pending[key]
+        return assignments
+
+    def complete(self, builder, job=None, duration=None):
+        """
+        Frees the slot of a job on a builder once it is complete.
+
+        :param artisan.BaseBuilder builder: Builder that ran the job.
+        :param job: Job that was completed.
+        :param float duration:
+            Number of minutes that the job ran for. If given along
+            with ``job`` the runtime is recorded in the ``history``.
+        """
+        if job is not None and duration is not None:
+            self.history.record(job, duration)
+        with self._lock:
+            if builder not in self._slots:
+                return
+            if self._slots[builder] >= builder.builders:
+                raise ValueError('Builder doesn\'t have any jobs scheduled.')
+            self._slots[builder] += 1
+            self._free_slots += 1
+
+    def _match(self, requires_key, community):
+        """ Gets the builders that satisfy the frozen requires of a job. """
+        matches = self._matches.get((requires_key, community))
+        if matches is not None:
+            return matches
+
+        candidates = []
+        for label, value in requires_key:
+            name, operator, version = _parse_label(value)
+            index = self._index.get((label, name))
+            if index is None:
+                candidates = None
+                break
+            candidates.append(index.find(operator, version))
+
+        if candidates is None:
+            matches = ()
+        else:
+            if community:
+                candidates.append(self._secure)
+            if candidates:
+                # Intersect the smallest sets first so
+                # that there is less to check each time.
+                candidates.sort(key=len)
+                builders = set(candidates[0])
+                for other in candidates[1:]:
+                    builders.intersection_update(other)
+                    if not builders:
+                        break
+            else:
+                builders = self._builders
+            matches = tuple(builders)
+        if len(self._matches) >= _MAX_MATCHES:
+            self._matches.clear()
+        self._matches[(requires_key, community)] = matches
+        return matches
+
+    def _pick(self, builders):
+        """ Picks the builder with the fewest free slots that isn't full
+        or the least loaded builder if the longest jobs are going first. """
+        best = None
+        best_load = None
+        longest = self.order == 'longest'
+        for builder in builders:
+            slots = self._slots[builder]
+            if slots <= 0:
+                continue
+            if longest:
+                load = 1.0 - float(slots) / builder.builders
+            else:
+                load = slots
+            if best_load is None or load < best_load:
+                best = builder
+                best_load = load
+        return best
+
+
+class RuntimeHistory(object):
+    """ Records how long jobs take to run so that the duration
+    of a job can be estimated for :class:`artisan.Scheduler`.
+
+    Runtimes are kept for each script and ``requires`` as a moving
+    average over roughly the last ``window`` runs. The estimate for
+    a job starts at its declared ``duration`` and moves towards the
+    average as runtimes are recorded, with the declared duration
+    counting as ``weight`` runs.
+
+    :param int window: Number of runs that the average is taken over.
+    :param float weight: Number of runs the declared duration is worth.
+    :param int max_entries: Number of jobs to keep runtimes for.
+    """
+    def __init__(self, window=10, weight=2.0, max_entries=4096):
+        if window < 1:
+            raise ValueError('`window` must be at least 1.')
+        if weight < 0:
+            raise ValueError('`weight` must not be negative.')
+        self.window = window
+        self.weight = weight
+        self.max_entries = max_entries
+
+        self._lock = Lock()
+        self._runtimes = collections.OrderedDict()
+
+    def record(self, job, duration):
+        """
+        Records the runtime of a job.
+
+        :param job: Build or :class:`artisan.JobSpec` that was run.
+        :param float duration: Number of minutes that the job ran for.
+        """
+        if duration < 0:
+            raise ValueError('`duration` must not be negative.')
+        key = (job.script, _requires_key(job.requires))
+        with self._lock:
+            count, average = self._runtimes.pop(key, (0, 0.0))
+            count = min(count + 1, self.window)
+            average += (duration - average) / count
+            self._runtimes[key] = (count, average)
+            while len(self._runtimes) > self.max_entries:
+                self._runtimes.popitem(last=False)
+
+    def estimate(self, job, requires_key=None):
+        """
+        Estimates the number of minutes that a job will run for.
+
+        :param job: Build or :class:`artisan.JobSpec` to estimate.
+        :rtype: float
+        """
+        if requires_key is None:
+            requires_key = _requires_key(job.requires)
+        with self._lock:
+            count, average = self._runtimes.get((job.script, requires_key), (0, 0.0))
+        if count == 0:
+            return float(job.duration)
+        return (self.weight * job.duration + count * average) / (self.weight + count)
+
+    def __getstate__(self):
+        __dict__ = self.__dict__.copy()
+        __dict__['_lock'] = None
+        return __dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+
+class _VersionIndex(object):
+    """ Builders that advertise a name for one label,
+    indexed by the versions that they advertise. """
+    def __init__(self):
+        self.builders = {}
+        self.versions = {}
+        self.keys = []
+
+    def add(self, version, builder):
+        self.builders[builder] = self.builders.get(builder, 0) + 1
+        if version is None:
+            return
+        key = _version_key(version)
+        builders = self.versions.get(key)
+        if builders is None:
+            builders = self.versions[key] = set()
+            bisect.insort(self.keys, key)
+        builders.add(builder)
+
+    def remove(self, version, builder):
+        count = self.builders.pop(builder)
+        if count > 1:
+            self.builders[builder] = count - 1
+        if version is None:
+            return
+        key = _version_key(version)
+        builders = self.versions[key]
+        builders.discard(builder)
+        if not builders:
+            del self.versions[key]
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def find(self, operator, version):
+        """ Finds the builders with a version that satisfies the constraint. """
+        if operator is None and version is None:
+            return self.builders
+        key = _version_key(version)
+        if operator is None or operator == '==':
+            return self.versions.get(key, ())
+
+        if operator == '!=':
+            keys = [other for other in self.keys if other != key]
+        elif operator == '>=':
+            keys = self.keys[bisect.bisect_left(self.keys, key):]
+        elif operator == '>':
+            keys = self.keys[bisect.bisect_right(self.keys, key):]
+        elif operator == '<=':
+            keys = self.keys[:bisect.bisect_right(self.keys, key)]
+        else:
+            keys = self.keys[:bisect.bisect_left(self.keys, key)]
+        if len(keys) == 1:
+            return self.versions[keys[0]]
+        builders = set()
+        for other in keys:
+            builders.update(self.versions[other])
+        return builders
+
+
+def _parse_label(value):
+    """ Splits a label value into its name, operator and version. """
+    parsed = _parsed_labels.get(value)
+    if parsed is not None:
+        return parsed
+    match = _LABEL_REGEX.match(value)
+    if match is None:
+        raise ArtisanException('Could not parse the label value `%s`.' % value)
+    name, operator, version = match.groups()
+    if operator is None:
+        # A value without an operator is either a name or a version.
+        if name[:1].isdigit():
+            name, version = '', name
+        else:
+            version = ''
+    elif not version:
+        raise ArtisanException('Label value `%s` is missing a version.' % value)
+    parsed = (name, operator, version or None)
+    if len(_parsed_labels) >= _MAX_PARSED_LABELS:
+        _parsed_labels.clear()
+    _parsed_labels[value] = parsed
+    return parsed
+
+
+def _label_string(value):
+    """ Converts numbers from YAML like `python: 3.6` into strings. """
+    if isinstance(value, six.string_types):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ArtisanException('Label value `%s` must be a string.' % (value,))
+
+
+def _version_key(version):
+    """ Makes a version sortable so that `3.10` comes after `3.9`. """
+    key = []
+    for part in re.split(r'[.\-_]', version):
+        if part.isdigit():
+            key.append((0, int(part)))
+        else:
+            key.append((1, part))
+    return tuple(key)
+
+
+def _requires_key(requires):
+    """ Freezes the requires of a job, raising an error for
+    values that can't be parsed before the job is queued. """
+    key = []
+    for label, value in six.iteritems(requires):
+        value = _label_string(value)
+        _parse_label(value)
+        key.append((label, value))
+    return frozenset(key)
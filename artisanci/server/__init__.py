@@ -45,6 +45,12 @@ def init_app():
 
     app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
 
+    # Token that builders send when adding output to builds.
+    if 'BUILDER_TOKEN' in os.environ:
+        app.config['BUILDER_TOKEN'] = os.environ['BUILDER_TOKEN']
+    else:
+        app.logger.warning('Builders can\'t add output without a `BUILDER_TOKEN`.')
+
     # Disable `SQLALCHEMY_TRACK_MODIFICATIONS` because it's very slow.
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
@@ -1,5 +1,11 @@
-from flask import Blueprint, abort
+import hmac
+from flask import Blueprint, Response, abort, current_app, request
+from artisanci.server.mod_login.models import Auth
+from artisanci.server.mod_project.models import Batch, Build, Project
 
+# Largest range of output and longest wait for new output of one request.
+_MAX_READ_SIZE = 1024 * 1024
+_MAX_WAIT = 30.0
 
 mod_project = Blueprint('project', __name__, url_prefix='/projects')
 
@@ -26,4 +32,93 @@ def show_project_batch(type, owner, name, batch):
 
 @mod_project.route('/<type>/<owner>/<name>/<batch>/<build>', methods=['GET'])
 def show_project_build(type, owner, name, batch, build):
-    return abort(501)
+    """ Returns a range of the output of a build.
+
+    The range is given either as a ``Range: bytes=...`` header or as
+    ``offset`` and ``size`` query parameters, where a negative ``offset``
+    reads the tail of the output. If the range starts at the end of the output
+    of a running build the request waits up to ``wait`` seconds for more output
+    so viewers can follow a build by asking for the next offset each time. """
+    build = _find_build(type, owner, name, batch, build)
+    is_range = request.range is not None
+    if is_range:
+        if request.range.units != 'bytes' or len(request.range.ranges) != 1:
+            return abort(416)
+        start, stop = request.range.ranges[0]
+        offset = start
+        size = _MAX_READ_SIZE if stop is None else stop - start
+    else:
+        offset = request.args.get('offset', 0, type=int)
+        size = request.args.get('size', _MAX_READ_SIZE, type=int)
+    if offset < 0:
+        offset = max(0, build.output_size + offset)
+    size = max(0, min(size, _MAX_READ_SIZE))
+
+    wait = max(0.0, min(request.args.get('wait', 0.0, type=float), _MAX_WAIT))
+    if wait and offset >= build.output_size and not build.finished:
+        build.wait_for_output(offset, wait)
+
+    data = build.read_output(offset, size)
+    if not is_range:
+        status = 200
+    elif data:
+        status = 206
+    else:
+        # There's no range to describe until the build has more output.
+        status = 204
+    response = Response(data, status=status, mimetype='application/octet-stream')
+    if status == 206:
+        response.headers['Content-Range'] = 'bytes %d-%d/%d' % (offset, offset + len(data) - 1,
+                                                                build.output_size)
+    response.headers['X-Output-Offset'] = str(offset)
+    response.headers['X-Output-Next-Offset'] = str(offset + len(data))
+    response.headers['X-Output-Size'] = str(build.output_size)
+    response.headers['X-Build-Finished'] = 'true' if build.finished else 'false'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@mod_project.route('/<type>/<owner>/<name>/<batch>/<build>/output', methods=['POST'])
+def append_project_build_output(type, owner, name, batch, build):
+    """ Adds the body of the request to the end of the output of a build
+    and marks the build as finished if ``finished`` is ``true``. Builders
+    authenticate with an ``Authorization: Token <BUILDER_TOKEN>`` header. """
+    _check_builder_token()
+    build = _find_build(type, owner, name, batch, build)
+    if build.finished:
+        return abort(409)
+    build.append_output(request.get_data())
+    if request.args.get('finished') == 'true':
+        build.finish()
+    response = Response(status=204)
+    response.headers['X-Output-Size'] = str(build.output_size)
+    return response
+
+
+def _check_builder_token():
+    expected = current_app.config.get('BUILDER_TOKEN')
+    if not expected:
+        return abort(403)
+    token = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(token.encode('utf-8'),
+                               ('Token %s' % expected).encode('utf-8')):
+        return abort(403)
+
+
+def _find_build(type, owner, name, batch, build):
+    try:
+        batch = int(batch)
+        build = int(build)
+    except ValueError:
+        return abort(404)
+    result = (Build.query
+              .join(Batch, Build.batch_id == Batch.id)
+              .join(Project, Batch.project_id == Project.id)
+              .join(Auth, Project.owner_id == Auth.id)
+              .filter(Build.id == build, Batch.id == batch,
+                      Project.type == type, Project.name == name,
+                      Auth.name == owner)
+              .first())
+    if result is None:
+        return abort(404)
+    return result
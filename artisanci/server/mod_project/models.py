@@ -1,13 +1,31 @@
+import threading
+from artisanci.compat import monotonic
 from artisanci.server import db
 from artisanci.server.base_model import BaseModel
 
+# Longest time to wait without checking the database, for
+# output that is written by another process of the server.
+_MAX_NOTIFY_WAIT = 5.0
+
+# Notified whenever a build gets new output or finishes so that
+# requests following the output don't have to poll the database.
+_output_changed = threading.Condition()
+_output_version = 0
+
+
+def _notify_output():
+    global _output_version
+    with _output_changed:
+        _output_version += 1
+        _output_changed.notify_all()
+
 
 class Project(BaseModel):
     __tablename__ = 'project'
 
-    type = db.String(length=2, nullable=False)
-    url = db.Text(nullable=False)
-    name = db.String(length=256, nullable=False)
+    type = db.Column(db.String(length=2), nullable=False)
+    url = db.Column(db.Text, nullable=False)
+    name = db.Column(db.String(length=256), nullable=False)
 
     owner_id = db.Column(db.Integer, db.ForeignKey('auth.id'))
     owner = db.relationship('Auth', back_populates='projects')
@@ -31,7 +49,72 @@ class Build(BaseModel):
     batch_id = db.Column(db.Integer, db.ForeignKey('batch.id'))
     batch = db.relationship('Batch', back_populates='builds')
 
-    script = db.String(length=256)
-    requires = db.Text()
-    environment = db.Text()
-    output = db.Text()
+    script = db.Column(db.String(length=256))
+    requires = db.Column(db.Text)
+    environment = db.Column(db.Text)
+
+    # Output is stored as append-only chunks so that reading
+    # the end of the output doesn't load all of it.
+    output_size = db.Column(db.BigInteger, nullable=False, default=0)
+    finished = db.Column(db.Boolean, nullable=False, default=False)
+    output_chunks = db.relationship('BuildOutputChunk', back_populates='build',
+                                    lazy='dynamic', order_by='BuildOutputChunk.offset')
+
+    def append_output(self, data):
+        """ Adds a chunk of output to the end of the build's output. """
+        if not data:
+            return
+        # Increment the size in the database so concurrent appends get separate ranges.
+        db.session.query(Build).filter_by(id=self.id).update(
+            {Build.output_size: Build.output_size + len(data)},
+            synchronize_session=False)
+        db.session.refresh(self, ['output_size'])
+        offset = self.output_size - len(data)
+        db.session.add(BuildOutputChunk(build_id=self.id, offset=offset,
+                                        end=offset + len(data), data=data))
+        db.session.commit()
+        _notify_output()
+
+    def finish(self):
+        """ Marks the build as finished so readers stop waiting for more output. """
+        self.finished = True
+        db.session.commit()
+        _notify_output()
+
+    def wait_for_output(self, offset, timeout):
+        """ Waits up to `timeout` seconds for output past `offset` or for the build to finish. """
+        deadline = monotonic() + timeout
+        while True:
+            with _output_changed:
+                version = _output_version
+            db.session.refresh(self)
+            remaining = deadline - monotonic()
+            if offset < self.output_size or self.finished or remaining <= 0:
+                return
+            with _output_changed:
+                if version == _output_version:
+                    _output_changed.wait(min(remaining, _MAX_NOTIFY_WAIT))
+
+    def read_output(self, offset, size):
+        """ Reads up to `size` bytes of output starting at `offset`. """
+        stop = min(self.output_size, offset + size)
+        if offset >= stop:
+            return b''
+        chunks = (self.output_chunks
+                  .filter(BuildOutputChunk.end > offset)
+                  .filter(BuildOutputChunk.offset < stop)
+                  .all())
+        return b''.join(chunk.data[max(0, offset - chunk.offset):stop - chunk.offset]
+                        for chunk in chunks)
+
+
+class BuildOutputChunk(BaseModel):
+    __tablename__ = 'build_output_chunk'
+    __table_args__ = (db.Index('ix_build_output_chunk_range', 'build_id', 'end'),)
+
+    build_id = db.Column(db.Integer, db.ForeignKey('build.id'), nullable=False)
+    build = db.relationship('Build', back_populates='output_chunks')
+
+    offset = db.Column(db.BigInteger, nullable=False)
+    end = db.Column(db.BigInteger, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
@@ -12,15 +12,83 @@
 # either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
+""" Module for objects that send events to watchers. """
+
+import logging
+import threading
+import types
+import weakref
+from .compat import Lock, monotonic
+
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:
+    from queue import Queue, Empty, Full
+
 __all__ = [
     'Watchable'
 ]
 
+# Events that are joined into a single event when several are waiting to
+# be delivered at once and that may be dropped if watchers fall behind.
+_COALESCED_EVENTS = frozenset(['command_output', 'command_error'])
+
+# Maximum size of an event created by joining waiting events.
+_MAX_BATCH_SIZE = 64 * 1024
+
+# Cache of the handler function of each watcher type for each event type.
+_handlers = {}
+_dispatcher_lock = Lock()
+
+# Put in the queue of a dispatcher to stop its thread.
+_STOP = object()
+
+# Number of seconds between an idle dispatcher checking if its watchable was collected.
+_COLLECTED_CHECK_INTERVAL = 1.0
+
+# Cached for watcher types whose handlers have to be looked up on each watcher.
+_LOOKUP_ON_INSTANCE = object()
+
+_logger = logging.getLogger(__name__)
+
+
+def _get_handler(watcher_type, name):
+    """ Finds the function that handles an event for every watcher of a
+    type. Returns ``_LOOKUP_ON_INSTANCE`` if the handler can't be known from
+    the type alone, such as for proxies that define ``__getattr__``. """
+    key = (watcher_type, name)
+    try:
+        return _handlers[key]
+    except KeyError:
+        pass
+    handler = None
+    for klass in watcher_type.__mro__:
+        if name in klass.__dict__:
+            handler = klass.__dict__[name]
+            break
+    if handler is None:
+        if (hasattr(watcher_type, '__getattr__') or
+                watcher_type.__getattribute__ is not object.__getattribute__):
+            handler = _LOOKUP_ON_INSTANCE
+    elif not isinstance(handler, types.FunctionType):
+        # Static methods, class methods and other descriptors are bound by getattr().
+        handler = _LOOKUP_ON_INSTANCE
+    _handlers[key] = handler
+    return handler
+
 
 class Watchable(object):
-    """ Base class for an object that can be watched for events. """
+    """ Base class for an object that can be watched for events.
+
+    Watchers are called with ``watcher.on_<event_type>(watchable, data)``
+    for each event that they have a method for. Handler methods are looked
+    up once per watcher type and event type rather than for every event,
+    unless the watcher has its own ``on_<event_type>`` attribute.
+    """
     def __init__(self):
         self._watchers = []
+        self._dispatch_options = None
+        self._dispatcher = None
 
     @property
     def watchers(self):
@@ -36,8 +104,201 @@ class Watchable(object):
             raise ValueError('`%s` is not watching `%s`.' % (watcher, self))
         self._watchers.remove(watcher)
 
+    def dispatch_async(self, max_queued=1024, policy='block'):
+        """
+        Delivers events to watchers from a background thread so that slow
+        watchers don't hold up whatever is sending events. Events wait in a
+        queue and consecutive ``command_output`` or ``command_error`` events
+        that are waiting are joined into one event before being delivered.
+
+        This setting is kept when the object is pickled and the thread is
+        started again by the first event sent in the new process. The thread
+        is stopped by :meth:`artisan.Watchable.close_watchers` or once the
+        object is garbage collected.
+
+        :param int max_queued: Number of events that can wait to be delivered.
+        :param str policy:
+            What to do with ``command_output`` and ``command_error`` events
+            when the queue is full. ``'block'`` waits for space in the queue
+            and ``'drop'`` discards the event. Other events always wait.
+        """
+        if policy not in ('block', 'drop'):
+            raise ValueError('`policy` must be either `block` or `drop`.')
+        if max_queued < 1:
+            raise ValueError('`max_queued` must be at least 1.')
+        self.flush_watchers()
+        self._dispatch_options = (max_queued, policy)
+
+    @property
+    def dropped_events(self):
+        """ Number of events that were dropped because the queue was full. """
+        if self._dispatcher is None:
+            return 0
+        return self._dispatcher.dropped
+
+    def flush_watchers(self, timeout=None):
+        """
+        Waits for all events sent so far to be delivered to watchers.
+
+        :param float timeout: Number of seconds to wait for.
+        :returns: True if all events were delivered, False otherwise.
+        """
+        if self._dispatcher is None:
+            return True
+        return self._dispatcher.flush(timeout)
+
+    def close_watchers(self, timeout=None):
+        """
+        Waits for all events sent so far to be delivered to watchers and
+        then stops the thread delivering them. The thread is started again
+        if more events are sent afterwards.
+
+        :param float timeout: Number of seconds to wait for.
+        :returns: True if all events were delivered, False otherwise.
+        """
+        dispatcher = self._dispatcher
+        if dispatcher is None:
+            return True
+        flushed = dispatcher.flush(timeout)
+        dispatcher.stop()
+        self._dispatcher = None
+        return flushed
+
     def notify_watchers(self, event_type, data):
-        event_handler = 'on_' + event_type
+        if self._dispatch_options is None:
+            self._deliver(event_type, data)
+        else:
+            self._get_dispatcher().put(event_type, data)
+
+    def _deliver(self, event_type, data):
+        name = 'on_' + event_type
         for watcher in self._watchers:
-            if hasattr(watcher, event_handler):
-                getattr(watcher, event_handler)(self, data)
+            handler = _get_handler(type(watcher), name)
+            if handler is _LOOKUP_ON_INSTANCE or name in getattr(watcher, '__dict__', ()):
+                handler = getattr(watcher, name, None)
+                if handler is not None:
+                    handler(self, data)
+            elif handler is not None:
+                handler(watcher, self, data)
+
+    def _get_dispatcher(self):
+        if self._dispatcher is None:
+            with _dispatcher_lock:
+                if self._dispatcher is None:
+                    self._dispatcher = _Dispatcher(self, *self._dispatch_options)
+        return self._dispatcher
+
+    def __getstate__(self):
+        __dict__ = self.__dict__.copy()
+        __dict__['_dispatcher'] = None
+        return __dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+
+class _Dispatcher(object):
+    """ Delivers the events of a :class:`artisan.Watchable` from a thread.
+    Only a weak reference to the watchable is kept so that the thread doesn't
+    keep it alive and the thread is stopped once the watchable is collected. """
+    def __init__(self, watchable, max_queued, policy):
+        self.watchable = weakref.ref(watchable, self._collected)
+        self.policy = policy
+        self.dropped = 0
+        self._stopped = False
+
+        self._queue = Queue(max_queued)
+        self._condition = threading.Condition()
+        self._unfinished = 0
+
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def put(self, event_type, data):
+        with self._condition:
+            self._unfinished += 1
+        if self.policy == 'drop' and event_type in _COALESCED_EVENTS:
+            try:
+                self._queue.put_nowait((event_type, data))
+            except Full:
+                self.dropped += 1
+                self._done(1)
+        else:
+            self._queue.put((event_type, data))
+
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._condition:
+            while self._unfinished:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def _done(self, count):
+        with self._condition:
+            self._unfinished -= count
+            if not self._unfinished:
+                self._condition.notify_all()
+
+    def stop(self):
+        """ Stops the thread once it has delivered the current event. """
+        self._stopped = True
+        try:
+            self._queue.put_nowait(_STOP)
+        except Full:
+            # The thread checks for being stopped after every event.
+            pass
+
+    def _collected(self, _):
+        # Called by the garbage collector which may interrupt any code
+        # including the queue's own methods, so only the flag is set.
+        self._stopped = True
+
+    def _run(self):
+        pending = None
+        while not self._stopped:
+            item = pending
+            pending = None
+            if item is None:
+                try:
+                    item = self._queue.get(timeout=_COLLECTED_CHECK_INTERVAL)
+                except Empty:
+                    continue
+            if item is _STOP:
+                break
+            event_type, data = item
+            count = 1
+            if event_type in _COALESCED_EVENTS:
+                batch = [data]
+                size = len(data)
+                while size < _MAX_BATCH_SIZE:
+                    try:
+                        pending = self._queue.get_nowait()
+                    except Empty:
+                        break
+                    if (pending is _STOP or pending[0] != event_type or
+                            type(pending[1]) is not type(data)):
+                        break
+                    batch.append(pending[1])
+                    size += len(pending[1])
+                    count += 1
+                    pending = None
+                if len(batch) > 1:
+                    data = data[:0].join(batch)
+            watchable = self.watchable()
+            if watchable is None:
+                break
+            try:
+                watchable._deliver(event_type, data)
+            except Exception:
+                _logger.exception('A watcher of `%s` failed to handle a `%s` event.',
+                                  watchable, event_type)
+            # Don't keep the watchable alive while waiting for the next event.
+            del watchable
+            self._done(count)
+        with self._condition:
+            self._unfinished = 0
+            self._condition.notify_all()
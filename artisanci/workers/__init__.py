@@ -17,8 +17,15 @@ implementations of the workers used by Artisan. """
 
 from .worker import Worker
 from .command import Command
+from .output_buffer import OutputBuffer
+from ..compat import PY35
 
 __all__ = [
     'Worker',
-    'Command'
+    'Command',
+    'OutputBuffer'
 ]
+
+if PY35:
+    from .async_command import AsyncCommand  # noqa: F401
+    __all__.append('AsyncCommand')
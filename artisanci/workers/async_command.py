@@ -0,0 +1,124 @@
+#           Copyright (c) 2017 Seth Michael Larson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+""" Defines the interface for a command resulting from Worker.execute_async().
+This module requires Python 3.5 or later and is only imported if available. """
+
+import asyncio
+from .command import BaseCommand, _CHUNK_SIZE
+from ..compat import monotonic
+
+__all__ = [
+    'AsyncCommand'
+]
+
+# asyncio.get_running_loop() was added in Python 3.7. Before that
+# asyncio.get_event_loop() returns the running loop inside of a coroutine.
+_get_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+class AsyncCommand(BaseCommand):
+    """ Interface for commands executed by :meth:`artisan.Worker.execute_async`.
+    The process is run with :mod:`asyncio` so that many commands can be
+    waited on concurrently from a single thread.
+
+     .. note::
+
+        On Windows the event loop must be a :class:`asyncio.ProactorEventLoop`
+        in order to run subprocesses.
+    """
+    def __init__(self, *args, **kwargs):
+        super(AsyncCommand, self).__init__(*args, **kwargs)
+        self._proc = None
+        self._pumps = None
+
+    async def _execute(self, stdin=b'', timeout=None):
+        """ Starts the command and waits for it to complete. """
+        await self._start(stdin)
+        await self._wait(timeout=timeout,
+                         error_on_timeout=True,
+                         error_on_exit=True)
+        return self
+
+    async def _start(self, stdin=b''):
+        """ Starts the process and the coroutines reading its output. """
+        kwargs = {'cwd': self.worker.cwd,
+                  'env': self.environment,
+                  'stdin': asyncio.subprocess.PIPE,
+                  'stdout': asyncio.subprocess.PIPE,
+                  'stderr': asyncio.subprocess.PIPE}
+        self._start_time = monotonic()
+        if self._is_shell:
+            self._proc = await asyncio.create_subprocess_shell(self.command, **kwargs)
+        else:
+            self._proc = await asyncio.create_subprocess_exec(*self.command, **kwargs)
+        try:
+            if stdin:
+                self._proc.stdin.write(stdin)
+                await self._proc.stdin.drain()
+            self._proc.stdin.close()
+        except (IOError, OSError):  # Skip coverage
+            pass
+        self._pumps = asyncio.gather(self._read_all(self._proc.stdout, False),
+                                     self._read_all(self._proc.stderr, True))
+
+    async def _wait(self, timeout=None, error_on_exit=False, error_on_timeout=False):
+        """
+        Wait for the command to complete.
+
+        :param float timeout: Number of seconds to wait before timing out.
+        :param bool error_on_exit:
+            If True will raise a :class:`artisan.ArtisanException` if
+            the command exits with a non-zero exit status.
+        :param bool error_on_timeout:
+            If True will raise a :class:`artisan.ArtisanException` if
+            the command times out while waiting for it to complete.
+        :returns: True if the command exits, False otherwise.
+        """
+        if not self._is_not_complete():
+            return True
+        loop = _get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        try:
+            # Shield the output readers so that a timeout doesn't
+            # cancel them and the command can be waited on again.
+            await asyncio.wait_for(asyncio.shield(self._pumps), timeout)
+            remaining = None if deadline is None else max(0.0, deadline - loop.time())
+            self._set_exit_status(await asyncio.wait_for(self._proc.wait(), remaining))
+        except asyncio.TimeoutError:
+            if error_on_timeout:
+                await self._kill()
+        return self._check_result(timeout, error_on_exit, error_on_timeout)
+
+    async def _kill(self):
+        """ Kills the process and waits for it to exit so that neither the
+        process nor the coroutines reading its output outlive the command. """
+        try:
+            self._proc.kill()
+        except ProcessLookupError:  # Skip coverage
+            pass
+        await self._proc.wait()
+        # Processes started by a shell may still hold the pipes open.
+        self._pumps.cancel()
+        try:
+            await self._pumps
+        except asyncio.CancelledError:
+            pass
+
+    async def _read_all(self, stream, is_stderr):
+        while True:
+            data = await stream.read(_CHUNK_SIZE)
+            if not data:
+                break
+            self._handle_output(is_stderr, data)
@@ -14,13 +14,17 @@
 
 """ Defines the interface for a command resulting from BaseWorker.execute() """
 
+import os
+import platform
 import subprocess
 import threading
 import time
-from ..compat import monotonic
+from .output_buffer import DEFAULT_MAX_MEMORY, OutputBuffer
+from ..compat import PY33, monotonic
 from ..exceptions import ArtisanException
 
 __all__ = [
+    'BaseCommand',
     'Command'
 ]
 
@@ -29,56 +33,126 @@ try:
 except ImportError:
     from queue import Queue, Empty
 
+try:
+    import selectors
+except ImportError:
+    selectors = None
+
+# Maximum number of bytes to read from a pipe at once.
+_CHUNK_SIZE = 64 * 1024
+
+
+class _SelectorPump(object):
+    """ Waits on the stdout and stderr pipes of a process
+    with a selector and reads raw chunks as they become ready. """
+    def __init__(self, stdout, stderr):
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(stdout, selectors.EVENT_READ, False)
+        self._selector.register(stderr, selectors.EVENT_READ, True)
+        self._open = 2
+
+    @property
+    def done(self):
+        return self._open == 0
+
+    def read(self, timeout=None):
+        """ Blocks until at least one pipe is readable or closed or until
+        the timeout expires. Returns a list of ``(is_stderr, data)`` tuples. """
+        chunks = []
+        if self._open == 0:
+            return chunks
+        for key, _ in self._selector.select(timeout):
+            data = os.read(key.fd, _CHUNK_SIZE)
+            if data:
+                chunks.append((key.data, data))
+            else:
+                self._selector.unregister(key.fileobj)
+                key.fileobj.close()
+                self._open -= 1
+        if self._open == 0:
+            self._selector.close()
+        return chunks
+
+
+class _ThreadedPump(object):
+    """ Fallback for platforms that can't select on pipes. One
+    thread per pipe pushes raw chunks onto a shared queue which
+    the waiting thread blocks on rather than polling. """
+    def __init__(self, stdout, stderr):
+        self._queue = Queue()
+        self._open = 2
+        for stream, is_stderr in [(stdout, False), (stderr, True)]:
+            thread = threading.Thread(target=self._run, args=(stream, is_stderr))
+            thread.daemon = True
+            thread.start()
+
+    @property
+    def done(self):
+        return self._open == 0
 
-class _QueueThread(threading.Thread):
-    """ Helper thread that turns a stream
-    into chunks for a waitable queue. """
-    def __init__(self, stream):
-        super(_QueueThread, self).__init__()
-        self._stream = stream
-        self.queue = Queue()
-        self.stop = False
+    def read(self, timeout=None):
+        """ Blocks until at least one pipe is readable or closed or until
+        the timeout expires. Returns a list of ``(is_stderr, data)`` tuples. """
+        chunks = []
+        if self._open == 0:
+            return chunks
+        try:
+            item = self._queue.get(timeout=timeout)
+            while True:
+                if item[1] is None:
+                    self._open -= 1
+                else:
+                    chunks.append(item)
+                item = self._queue.get_nowait()
+        except Empty:
+            pass
+        return chunks
 
-    def run(self):
+    def _run(self, stream, is_stderr):
         try:
-            for line in iter(self._stream.readline, b''):
-                if self.stop:  # Skip coverage
+            while True:
+                data = os.read(stream.fileno(), _CHUNK_SIZE)
+                if not data:
                     break
-                self.queue.put(line)
-            self._stream.close()
+                self._queue.put((is_stderr, data))
         except Exception:  # Skip coverage
             pass
-        self.stop = True
+        finally:
+            stream.close()
+            self._queue.put((is_stderr, None))
 
 
-class Command(object):
-    """ Interface for commands executed by :class:`artisan.BaseWorker`.
-    An instance of this must be returned from :meth:`artisan.BaseWorker.execute`"""
-    def __init__(self, worker, command, environment=None, stdin=b'', merge_stderr=False):
+class BaseCommand(object):
+    """ Shared state and output handling for commands
+    executed by :class:`artisan.Worker`. """
+    def __init__(self, worker, command, environment=None, merge_stderr=False,
+                 max_output_memory=DEFAULT_MAX_MEMORY):
         """
         Create an BaseCommand instance.
 
         :param str command: Command to execute on the worker.
+        :param int max_output_memory:
+            Number of bytes of stdout and stderr each to hold in
+            memory before spilling the output to a temporary file.
         """
         self.worker = worker
         self.command = command
         self.environment = self._apply_minimum_environment(environment)
 
-        self._is_shell = False
-        self._proc = self._create_subprocess(stdin)
-
+        self._is_shell = not isinstance(command, list)
         self._exit_status = None
-        self._stdout = b''
-        self._stderr = b''
+        self._stdout = OutputBuffer(max_output_memory)
+        self._stderr = OutputBuffer(max_output_memory)
         self._merge_stderr = merge_stderr
 
-        # Create the two monitoring threads.
-        self._queue_threads = [_QueueThread(self._proc.stdout),
-                               _QueueThread(self._proc.stderr)]
-        self._queue_stdout = self._queue_threads[0].queue
-        self._queue_stderr = self._queue_threads[1].queue
-        for thread in self._queue_threads:
-            thread.start()
+        self._start_time = None
+        self._end_time = None
+
+        # Used by Worker.execute_many() to tell apart the
+        # output of commands that are running concurrently.
+        self._output_prefix = None
+        self._notify_lock = None
+        self._partial_lines = {False: b'', True: b''}
 
     @property
     def is_shell(self):
@@ -97,6 +171,9 @@ class Command(object):
     def stderr(self):
         """
         File-like object used for streaming a commands stderr.
+        Use ``getvalue()`` to get the entire output as bytes.
+
+        :rtype: artisan.OutputBuffer
         """
         return self._stderr
 
@@ -104,6 +181,9 @@ class Command(object):
     def stdout(self):
         """
         File-like object used for streaming a commands stdout.
+        Use ``getvalue()`` to get the entire output as bytes.
+
+        :rtype: artisan.OutputBuffer
         """
         return self._stdout
 
@@ -116,41 +196,16 @@ class Command(object):
         """
         return self._exit_status
 
-    def _wait(self, timeout=None, error_on_exit=False, error_on_timeout=False):
+    @property
+    def duration(self):
         """
-        Wait for the command to complete.
-        Commands should always have this method called
-        before trying to use any other property.
+        Number of seconds that the command ran for.
 
-        :param float timeout: Number of seconds to wait before timing out.
-        :param bool error_on_exit:
-            If True will raise a :class:`artisan.CommandExitStatusException` if
-            the command exits with a non-zero exit status.
-        :param bool error_on_timeout:
-            If True will raise a :class:`artisan.CommandTimeoutException` if
-            the command times out while waiting for it to complete.
-        :returns: True if the command exits, False otherwise.
+        :returns: Duration of the command as a `float` or None if not complete.
         """
-        start_time = monotonic()
-        current_time = start_time
-        not_complete = self._is_not_complete()
-        if not not_complete:
-            return True
-        timed_out = False
-        while self._is_not_complete():
-            self._read_all(0.5 if timeout is None else min(0.5, current_time - start_time))
-            if timeout is not None:
-                current_time = monotonic()
-                if current_time - start_time > timeout:
-                    timed_out = True
-                    break
-        if self._is_not_complete() and timed_out and error_on_timeout:
-            raise ArtisanException('The command `%s` failed to complete in '
-                                   '`%.2f` seconds.' % (self.command, timeout))
-        if not_complete and error_on_exit and self._exit_status not in [None, 0]:
-            raise ArtisanException('The command `%s` exited with a status '
-                                   'code of `%d`.' % (self.command, self._exit_status))
-        return not self._is_not_complete()
+        if self._start_time is None or self._end_time is None:
+            return None
+        return self._end_time - self._start_time
 
     def _apply_minimum_environment(self, environment):
         """ Modifies the environment that will be passed
@@ -170,52 +225,155 @@ class Command(object):
 
         return environment
 
-    def _read_all(self, timeout=0.001):
-        if self._proc is None:
+    def _handle_output(self, is_stderr, data):
+        """ Stores a chunk of output and notifies the watchers of the build. """
+        event_type = 'output'
+        if not is_stderr or self._merge_stderr:
+            self._stdout.write(data)
+        else:
+            self._stderr.write(data)
+            event_type = 'error'
+        if self._output_prefix is not None:
+            data = self._prefix_lines(is_stderr, data)
+            if not data:
+                return
+        self._notify('command_' + event_type, data)
+
+    def _notify(self, event_type, data):
+        if self.worker.build is None:
             return
-        start_time = monotonic()
-        while self._is_not_complete():
-            if self._exit_status is None:
-                self._exit_status = self._proc.poll()
+        if self._notify_lock is not None:
+            with self._notify_lock:
+                self.worker.build.notify_watchers(event_type, data)
+        else:
+            self.worker.build.notify_watchers(event_type, data)
+
+    def _prefix_lines(self, is_stderr, data):
+        """ Adds the output prefix to the start of every complete line.
+        Incomplete lines are held back until the rest of the line arrives
+        so that output from concurrent commands isn't mixed mid-line. """
+        lines = (self._partial_lines[is_stderr] + data).splitlines(True)
+        if lines and not lines[-1].endswith(b'\n'):
+            self._partial_lines[is_stderr] = lines.pop()
+        else:
+            self._partial_lines[is_stderr] = b''
+        return b''.join(self._output_prefix + line for line in lines)
+
+    def _flush_output(self):
+        """ Sends any incomplete lines held back by the output prefix. """
+        for is_stderr in [False, True]:
+            data = self._partial_lines[is_stderr]
+            if data:
+                self._partial_lines[is_stderr] = b''
+                event_type = 'error' if is_stderr and not self._merge_stderr else 'output'
+                self._notify('command_' + event_type, self._output_prefix + data)
+
+    def _set_exit_status(self, exit_status):
+        self._exit_status = exit_status
+        if exit_status is not None:
+            self._end_time = monotonic()
+
+    def _check_result(self, timeout=None, error_on_exit=False, error_on_timeout=False):
+        """ Raises the errors requested from waiting on the command. """
+        if self._is_not_complete() and error_on_timeout:
+            raise ArtisanException('The command `%s` failed to complete in '
+                                   '`%.2f` seconds.' % (self.command, timeout))
+        if error_on_exit and self._exit_status not in [None, 0]:
+            raise ArtisanException('The command `%s` exited with a status '
+                                   'code of `%d`.' % (self.command, self._exit_status))
+        return not self._is_not_complete()
+
+    def _is_not_complete(self):
+        return self._exit_status is None
+
+
+class Command(BaseCommand):
+    """ Interface for commands executed by :class:`artisan.BaseWorker`.
+    An instance of this must be returned from :meth:`artisan.BaseWorker.execute`"""
+    def __init__(self, worker, command, environment=None, stdin=b'', merge_stderr=False,
+                 max_output_memory=DEFAULT_MAX_MEMORY):
+        """
+        Create a Command instance.
+
+        :param str command: Command to execute on the worker.
+        :param int max_output_memory:
+            Number of bytes of stdout and stderr each to hold in
+            memory before spilling the output to a temporary file.
+        """
+        super(Command, self).__init__(worker, command, environment,
+                                      merge_stderr=merge_stderr,
+                                      max_output_memory=max_output_memory)
+        self._start_time = monotonic()
+        self._proc = self._create_subprocess(stdin)
+
+        # Pipes on Windows can't be used with selectors.
+        if selectors is not None and platform.system() != 'Windows':
+            self._pump = _SelectorPump(self._proc.stdout, self._proc.stderr)
+        else:
+            self._pump = _ThreadedPump(self._proc.stdout, self._proc.stderr)
+
+    def _wait(self, timeout=None, error_on_exit=False, error_on_timeout=False):
+        """
+        Wait for the command to complete.
+        Commands should always have this method called
+        before trying to use any other property.
+
+        :param float timeout: Number of seconds to wait before timing out.
+        :param bool error_on_exit:
+            If True will raise a :class:`artisan.CommandExitStatusException` if
+            the command exits with a non-zero exit status.
+        :param bool error_on_timeout:
+            If True will raise a :class:`artisan.CommandTimeoutException` if
+            the command times out while waiting for it to complete.
+        :returns: True if the command exits, False otherwise.
+        """
+        if not self._is_not_complete():
+            return True
+        deadline = None if timeout is None else monotonic() + timeout
+        while not self._pump.done:
+            self._read_all(None if deadline is None else max(0.0, deadline - monotonic()))
+            if deadline is not None and monotonic() >= deadline:
+                break
+        if self._pump.done:
+            self._wait_for_exit(deadline)
+        return self._check_result(timeout, error_on_exit, error_on_timeout)
+
+    def _read_all(self, timeout=None):
+        """ Reads and dispatches whatever output is available, blocking
+        for at most `timeout` seconds if nothing is ready yet. """
+        for is_stderr, data in self._pump.read(timeout):
+            self._handle_output(is_stderr, data)
+
+    def _wait_for_exit(self, deadline=None):
+        """ Reaps the process after both of its pipes have closed. """
+        if deadline is None:
+            self._set_exit_status(self._proc.wait())
+        elif PY33:
             try:
-                while True:
-                    data = self._queue_stdout.get_nowait()
-                    self._stdout += data
-                    if self.worker.build is not None:
-                        self.worker.build.notify_watchers('command_output', data)
-            except Empty:
+                self._set_exit_status(self._proc.wait(timeout=max(0.0, deadline - monotonic())))
+            except subprocess.TimeoutExpired:
                 pass
+        else:
+            # Python 2.x doesn't support a timeout for Popen.wait().
+            while True:
+                self._set_exit_status(self._proc.poll())
+                if self._exit_status is not None or monotonic() >= deadline:
+                    break
+                time.sleep(0.01)
+
+    def _kill(self):
+        """ Kills the process if it's still running. """
+        if self._is_not_complete():
             try:
-                while True:
-                    data = self._queue_stderr.get_nowait()
-                    event_type = 'output'
-                    if self._merge_stderr:
-                        self._stdout += data
-                    else:
-                        self._stderr += data
-                        event_type = 'error'
-                    if self.worker.build is not None:
-                        self.worker.build.notify_watchers('command_' + event_type, data)
-            except Empty:
+                self._proc.kill()
+            except OSError:  # Skip coverage
                 pass
-            if timeout is not None and monotonic() - start_time > timeout:
-                break
-            # Suggest that the thread to give up its CPU.
-            time.sleep(0.0)
-
-    def _is_not_complete(self):
-        return (self._exit_status is None or
-                self._queue_stdout.qsize() > 0 or
-                self._queue_stderr.qsize() > 0 or
-                not self._queue_threads[0].stop or
-                not self._queue_threads[1].stop)
 
     def _check_exit(self):
         if self._is_not_complete():
-            self._read_all(0.0)
+            self._wait(timeout=0.0)
 
     def _create_subprocess(self, stdin):
-        self._is_shell = True if not isinstance(self.command, list) else False
         popen = subprocess.Popen(self.command,
                                  shell=self._is_shell,
                                  cwd=self.worker.cwd,
@@ -223,6 +381,10 @@ class Command(object):
                                  stdout=subprocess.PIPE,
                                  stderr=subprocess.PIPE,
                                  env=self.environment)
-        if stdin:
-            popen.stdin.write(stdin)
+        try:
+            if stdin:
+                popen.stdin.write(stdin)
+            popen.stdin.close()
+        except (IOError, OSError):  # Skip coverage
+            pass
         return popen
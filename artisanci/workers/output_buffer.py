@@ -0,0 +1,141 @@
+#           Copyright (c) 2017 Seth Michael Larson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+""" Defines the buffer that holds the output of a :class:`artisan.Command`. """
+
+import os
+import tempfile
+
+__all__ = [
+    'OutputBuffer'
+]
+
+# Default number of bytes held in memory before spilling to a file.
+DEFAULT_MAX_MEMORY = 8 * 1024 * 1024
+
+
+class OutputBuffer(object):
+    """ Append-only buffer of bytes that is read like a file.
+    Output is kept as a list of chunks in memory until it grows
+    beyond ``max_memory`` bytes after which everything is moved
+    into a temporary file and all further output is appended there. """
+    def __init__(self, max_memory=DEFAULT_MAX_MEMORY):
+        """
+        Create an OutputBuffer instance.
+
+        :param int max_memory:
+            Number of bytes to hold in memory before spilling the
+            buffer to a temporary file. ``None`` never spills.
+        """
+        self.max_memory = max_memory
+
+        self._chunks = []
+        self._size = 0
+        self._position = 0
+        self._file = None
+
+    @property
+    def spilled(self):
+        """ True if the buffer has been moved into a temporary file. """
+        return self._file is not None
+
+    def write(self, data):
+        """
+        Appends bytes to the end of the buffer.
+
+        :param bytes data: Bytes to append.
+        """
+        if not data:
+            return
+        if (self._file is None and self.max_memory is not None and
+                self._size + len(data) > self.max_memory):
+            self._spill()
+        if self._file is not None:
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(data)
+        else:
+            self._chunks.append(data)
+        self._size += len(data)
+
+    def read(self, size=-1):
+        """
+        Reads bytes from the current position of the buffer.
+
+        :param int size: Maximum number of bytes to read, all if negative.
+        :returns: Bytes that were read.
+        """
+        if size is None or size < 0:
+            size = self._size - self._position
+        size = min(size, self._size - self._position)
+        if size <= 0:
+            return b''
+        if self._file is not None:
+            self._file.seek(self._position)
+            data = self._file.read(size)
+        else:
+            data = self._join()[self._position:self._position + size]
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """ Moves the read position of the buffer. """
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError('Can\'t seek to a negative position.')
+        self._position = offset
+        return self._position
+
+    def tell(self):
+        """ Gets the read position of the buffer. """
+        return self._position
+
+    def getvalue(self):
+        """ Gets the entire contents of the buffer as bytes. """
+        if self._file is not None:
+            self._file.seek(0)
+            return self._file.read()
+        return self._join()
+
+    def close(self):
+        """ Releases all memory and the temporary file held by the buffer. """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._chunks = []
+        self._size = 0
+        self._position = 0
+
+    def __len__(self):
+        return self._size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _join(self):
+        # Collapse into a single chunk so repeated reads don't join again.
+        if len(self._chunks) > 1:
+            self._chunks = [b''.join(self._chunks)]
+        return self._chunks[0] if self._chunks else b''
+
+    def _spill(self):
+        self._file = tempfile.TemporaryFile()
+        for chunk in self._chunks:
+            self._file.write(chunk)
+        self._chunks = []
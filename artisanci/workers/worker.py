@@ -20,10 +20,13 @@ import stat
 import socket
 import tempfile
 import platform
+import threading
 import requests
 from .command import Command
+from .output_buffer import DEFAULT_MAX_MEMORY
 from .expandvars import expandvars
-from ..compat import PY2, PY33, follows_symlinks
+from ..compat import PY2, PY33, PY35, follows_symlinks
+from ..exceptions import ArtisanException
 
 __all__ = [
     'Worker'
@@ -35,6 +38,9 @@ class Worker(object):
         self.environment = os.environ.copy()
         self.build = None
 
+        # Number of bytes of output each command holds in memory.
+        self.max_output_memory = DEFAULT_MAX_MEMORY
+
         self._closed = False
         self._cwd = os.getcwd()
 
@@ -66,12 +72,177 @@ class Worker(object):
             self.build.notify_watchers('command', command)
         if environment is None:
             environment = self.environment
-        command = Command(self, command, environment, merge_stderr=merge_stderr)
+        command = Command(self, command, environment,
+                          merge_stderr=merge_stderr,
+                          max_output_memory=self.max_output_memory)
         command._wait(timeout=timeout,
                       error_on_timeout=True,
                       error_on_exit=True)
         return command
 
+    def execute_many(self, commands, max_parallel=None, environment=None,
+                     timeout=None, merge_stderr=False, fail_fast=False):
+        """
+        Executes multiple independent commands on the worker concurrently
+        and waits for all of them to complete. Output from each command is
+        prefixed with its position in ``commands`` (``[1] ``, ``[2] ``, ...)
+        before being sent to the watchers of the build.
+
+        :param list commands:
+            List of commands to execute. Each command is either a list
+            of strings or a string in the same way as :meth:`artisan.Worker.execute`.
+        :param int max_parallel:
+            Maximum number of commands to run at once. Default is to run
+            every command at once.
+        :param dict environment:
+            Optional dictionary of key-value pairs for environment
+            variables to override the default worker environment.
+        :param float timeout:
+            Number of seconds to wait for each command before it is
+            killed and counted as a failure.
+        :param bool merge_stderr:
+            If True will merge the stderr stream into stdout.
+        :param bool fail_fast:
+            If True then the first command to fail will kill all
+            other running commands, no more commands will be started
+            and an :class:`artisan.ArtisanException` is raised with the
+            list of results as its ``results`` attribute.
+        :rtype: list
+        :returns:
+            List of results in the same order as ``commands``. Each result
+            is either a :class:`artisan.Command` instance or the exception
+            that stopped the command from starting. Use
+            :py:attr:`artisan.Command.exit_status` to see whether each command
+            succeeded and :py:attr:`artisan.Command.duration` to see how long
+            it took. Commands that weren't started because of ``fail_fast``
+            are None.
+        """
+        for command in commands:
+            if not isinstance(command, (list, str)):
+                raise TypeError('Command must be of type list or string.')
+        if not commands:
+            return []
+        if max_parallel is None:
+            max_parallel = len(commands)
+        if not isinstance(max_parallel, int) or max_parallel < 1:
+            raise ValueError('`max_parallel` must be a positive integer.')
+        if environment is None:
+            environment = self.environment
+
+        results = [None] * len(commands)
+        pending = list(range(len(commands)))
+        running = []
+        failed = []
+        state_lock = threading.Lock()
+        notify_lock = threading.Lock()
+
+        def run_commands():
+            while True:
+                with state_lock:
+                    if not pending or (fail_fast and failed):
+                        return
+                    index = pending.pop(0)
+
+                prefix = '[%d] ' % (index + 1)
+                if self.build is not None:
+                    with notify_lock:
+                        self.build.notify_watchers('command', prefix + str(commands[index]))
+                try:
+                    command = Command(self, commands[index], environment.copy(),
+                                      merge_stderr=merge_stderr,
+                                      max_output_memory=self.max_output_memory)
+                except Exception as e:
+                    with state_lock:
+                        results[index] = e
+                        failed.append(index)
+                        if fail_fast:
+                            for other in running:
+                                other._kill()
+                    continue
+                command._output_prefix = prefix.encode('utf-8')
+                command._notify_lock = notify_lock
+
+                with state_lock:
+                    results[index] = command
+                    running.append(command)
+                    # Another command may have failed while this one was starting.
+                    if fail_fast and failed:
+                        command._kill()
+
+                if not command._wait(timeout=timeout):
+                    command._kill()
+                    command._wait()
+                command._flush_output()
+
+                with state_lock:
+                    running.remove(command)
+                    if command.exit_status != 0:
+                        failed.append(index)
+                        if fail_fast:
+                            for other in running:
+                                other._kill()
+
+        threads = [threading.Thread(target=run_commands)
+                   for _ in range(min(max_parallel, len(commands)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if failed and fail_fast:
+            error = ArtisanException('`%d` out of `%d` commands failed to complete: %s' %
+                                     (len(failed), len(commands),
+                                      ', '.join('`%s`' % (commands[index],)
+                                                for index in sorted(failed))))
+            error.results = results
+            raise error
+        return results
+
+    # Coroutines need Python 3.5 or later so the method
+    # isn't defined at all on older versions of Python.
+    if PY35:
+        def execute_async(self, command, environment=None, timeout=None, merge_stderr=False):
+            """
+            Executes a command on the worker without blocking the event loop.
+            Returns a coroutine that results in an instance of
+            :class:`artisan.AsyncCommand` once the command completes.
+            Commands can be run concurrently with :func:`asyncio.gather`:
+
+             .. code-block:: python
+
+                await asyncio.gather(worker.execute_async('pip install -r requirements.txt'),
+                                     worker.execute_async('curl -O https://example.com/data.zip'))
+
+             .. note::
+
+                Requires Python 3.5 or later.
+
+            :param str command:
+                Either a list of strings or a string. If using a string
+                the command will be executed as a shell session.
+            :param dict environment:
+                Optional dictionary of key-value pairs for environment
+                variables to override the default worker environment.
+            :param float timeout:
+                Number of seconds to wait before the command errors
+                with a timeout exception.
+            :param bool merge_stderr:
+                If True will merge the stderr stream into stdout.
+            :returns: Coroutine resulting in :class:`artisan.AsyncCommand` instance.
+            """
+            if not isinstance(command, (list, str)):
+                raise TypeError('Command must be of type list or string.')
+            from .async_command import AsyncCommand
+
+            if self.build is not None:
+                self.build.notify_watchers('command', command)
+            if environment is None:
+                environment = self.environment
+            command = AsyncCommand(self, command, environment,
+                                   merge_stderr=merge_stderr,
+                                   max_output_memory=self.max_output_memory)
+            return command._execute(timeout=timeout)
+
     @property
     def cwd(self):
         """ The current working directory for the worker. """
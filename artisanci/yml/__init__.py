@@ -17,27 +17,38 @@ import six
 import yaml
 from .env_parser import parse_env
 from .build_yml import BuildYml
+from .job_spec import JobSpec, freeze_mapping
 from .requires_parser import parse_requires
+from ..caches.yml_cache import ArtisanYmlCache
 from ..exceptions import ArtisanException
 
 __all__ = [
     'ArtisanYml',
-    'BuildYml'
+    'BuildYml',
+    'JobSpec'
 ]
 
+# Use the LibYAML based loader if it's available.
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Cache that is used when no other cache is given.
+_default_cache = ArtisanYmlCache()
+
 
 class ArtisanYml(object):
-    """ Instance describing a project's ``.artisan.yml`` file. """
+    """ Instance describing a project's ``.artisan.yml`` file.
+    Each of its ``jobs`` is a :class:`artisan.JobSpec`. """
     def __init__(self):
         self.jobs = []
 
     @staticmethod
-    def from_path(path):
+    def from_path(path, cache=True):
         """ Loads a :class:`artisan.ArtisanYml` instance
         from a path. Can be either a directory (where it will
         search for a proper file) or an actual file.
 
         :param str path: Directory or file to read ``.artisan.yml`` from.
+        :param cache: See :meth:`artisan.ArtisanYml.from_string`.
         :rtype: artisan.ArtisanYml
         :return: :class:`artisan.ArtisanYml` instance.
         """
@@ -53,18 +64,35 @@ class ArtisanYml(object):
         if yml is None:
             raise ArtisanException('Could not find an `.artisan.yml` file in the project root.')
         with open(yml, 'r') as f:
-            return ArtisanYml.from_string(f.read())
+            return ArtisanYml.from_string(f.read(), cache=cache)
 
     @staticmethod
-    def from_string(string):
+    def from_string(string, cache=True):
         """ Loads a :class:`artisan.ArtisanYml` instance
         from a string.
 
         :param str string: String of a ``.artisan.yml`` file.
+        :param cache:
+            :class:`artisan.caches.ArtisanYmlCache` to look for the
+            parsed file in before parsing it. True uses a cache that
+            is shared by the whole process and False doesn't cache.
         :rtype: artisan.ArtisanYml
         :return: :class:`artisan.ArtisanYml` instance.
         """
-        artisan_yml = yaml.load(string)
+        if cache is True:
+            cache = _default_cache
+        if not cache:
+            return ArtisanYml._parse(string)
+        key = cache.key(string)
+        project = cache.get(key)
+        if project is None:
+            project = ArtisanYml._parse(string)
+            cache.put(key, project)
+        return project
+
+    @staticmethod
+    def _parse(string):
+        artisan_yml = yaml.load(string, Loader=_YamlLoader)
         if not isinstance(artisan_yml, dict):
             raise ArtisanException('Could not parse project configuration. '
                                    'See documentation for more details.')
@@ -95,19 +123,18 @@ class ArtisanYml(object):
             env = {}
             if 'env' in build_yml:
                 env = parse_env(build_yml['env'])
+            # Every job of a build shares the same environment.
+            env = freeze_mapping(env)
 
             if 'requires' in build_yml:
                 for label_json in parse_requires(build_yml['requires']):
-                    build = BuildYml(script=build_yml['script'],
-                                     duration=build_yml['duration'])
-                    for key, value in six.iteritems(label_json):
-                        build.requires[key] = value
-                    build.environment = env
-                    project.jobs.append(build)
+                    project.jobs.append(JobSpec(script=build_yml['script'],
+                                                duration=build_yml['duration'],
+                                                requires=label_json,
+                                                environment=env))
             else:
-                build = BuildYml(script=build_yml['script'],
-                                 duration=build_yml['duration'])
-                build.environment = env
-                project.jobs.append(build)
+                project.jobs.append(JobSpec(script=build_yml['script'],
+                                            duration=build_yml['duration'],
+                                            environment=env))
 
         return project
@@ -0,0 +1,153 @@
+#           Copyright (c) 2017 Seth Michael Larson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+""" Module for the compact description of a job from `.artisan.yml`. """
+
+import weakref
+import six
+from six.moves import intern
+from ..exceptions import ArtisanException
+
+__all__ = [
+    'JobSpec'
+]
+
+
+def _intern(value):
+    if type(value) is str:
+        return intern(value)
+    return value
+
+
+class FrozenDict(dict):
+    """ Dictionary that can't be modified after it's created
+    so that one instance can be shared between many jobs. """
+    __slots__ = ['_hash', '__weakref__']
+
+    def __init__(self, *args, **kwargs):
+        super(FrozenDict, self).__init__(*args, **kwargs)
+        self._hash = None
+
+    def _immutable(self, *_, **__):
+        raise TypeError('`%s` object does not support modification.' % type(self).__name__)
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(frozenset(six.iteritems(self)))
+        return self._hash
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+class JobSpec(object):
+    """ Immutable description of a single job expanded from
+    a project's ``.artisan.yml`` file. Label keys and values are
+    interned and identical ``requires`` and ``environment`` mappings
+    are shared between jobs, so large matrices stay small in memory.
+    A full :class:`artisan.BaseBuild` is only created from the job by
+    :meth:`artisan.JobSpec.create_build` once it is actually scheduled.
+
+    :param str script: Script that the job runs.
+    :param duration: Number of minutes the job is expected to take.
+    :param dict requires: Labels that a builder must have to run the job.
+    :param dict environment: Environment variables of the job.
+    """
+    __slots__ = ['script', 'duration', 'requires', 'environment']
+
+    def __init__(self, script, duration, requires=None, environment=None):
+        if len(script) > 256:
+            raise ArtisanException('`script` cannot be longer than 256 characters.')
+        if duration > 60:
+            raise ArtisanException('`duration` cannot be longer than an hour (60 minutes).')
+        object.__setattr__(self, 'script', _intern(script))
+        object.__setattr__(self, 'duration', duration)
+        object.__setattr__(self, 'requires', freeze_mapping(requires))
+        object.__setattr__(self, 'environment', freeze_mapping(environment))
+
+    def create_build(self, build_class, **kwargs):
+        """
+        Creates the build that executes this job.
+
+        :param type build_class: Subclass of :class:`artisan.BaseBuild` to create.
+        :rtype: artisan.BaseBuild
+        """
+        return build_class.from_yml(self, **kwargs)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('`JobSpec` objects are immutable.')
+
+    def __delattr__(self, name):
+        raise AttributeError('`JobSpec` objects are immutable.')
+
+    def __getstate__(self):
+        return (self.script, self.duration, dict(self.requires), dict(self.environment))
+
+    def __setstate__(self, state):
+        script, duration, requires, environment = state
+        object.__setattr__(self, 'script', _intern(script))
+        object.__setattr__(self, 'duration', duration)
+        object.__setattr__(self, 'requires', freeze_mapping(requires))
+        object.__setattr__(self, 'environment', freeze_mapping(environment))
+
+    def __eq__(self, other):
+        if not isinstance(other, JobSpec):
+            return NotImplemented
+        return (self.script == other.script and self.duration == other.duration and
+                self.requires == other.requires and self.environment == other.environment)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return hash((self.script, self.duration, self.requires, self.environment))
+
+    def __repr__(self):
+        return '<JobSpec script=\'%s\' labels=%s>' % (self.script, dict(self.requires))
+
+
+# Identical mappings of labels or environment variables
+# are only stored once no matter how many jobs use them.
+_EMPTY = FrozenDict()
+_frozen = weakref.WeakValueDictionary()
+
+
+def _freeze_value(value):
+    """ Makes nested lists and mappings immutable and hashable. """
+    if isinstance(value, dict):
+        return freeze_mapping(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze_value(item) for item in value)
+    return _intern(value)
+
+
+def freeze_mapping(mapping):
+    """ Gets the shared :class:`FrozenDict` that is equal to a mapping. """
+    if not mapping:
+        return _EMPTY
+    items = [(_intern(key), _freeze_value(value)) for key, value in six.iteritems(mapping)]
+    try:
+        # Types are part of the key so that `1` and `True` aren't shared.
+        key = frozenset((key, type(value), value) for key, value in items)
+    except TypeError:
+        # Values that can't be hashed can't be shared.
+        return FrozenDict(items)
+    frozen = _frozen.get(key)
+    if frozen is None:
+        frozen = FrozenDict(items)
+        _frozen[key] = frozen
+    return frozen
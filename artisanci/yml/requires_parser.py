@@ -15,9 +15,9 @@
 """ Module for parsing the require expression
 from the projects ``.artisan.yml`` file. """
 
-import itertools
+import collections
 import six
-from ..compat import xrange
+from ..compat import Lock
 from ..exceptions import ArtisanException
 
 __all__ = [
@@ -28,111 +28,222 @@ __all__ = [
 # are definitely not requires themselves. Each has a special meaning.
 _LABEL_KEYWORDS = set(['matrix', 'include', 'omit'])
 
+# Number of expanded require expressions to keep.
+_CACHE_SIZE = 128
+_cache = collections.OrderedDict()
+_cache_lock = Lock()
+
 
 def parse_requires(requires):
     """ Parses a ``requires`` entry in a require expression.
-    Also the starting point for the global requires option. """
+    Also the starting point for the global requires option.
+
+    Identical groups are only returned once and the result is
+    cached by the structure of ``requires`` so that the same
+    expression is only ever expanded once. """
+    if not isinstance(requires, dict):
+        raise ArtisanException('Project configuration `artisan.yml` is not '
+                               'structured properly at `jobs.*.requires`. '
+                               'See the documentation for more details.')
+    key = _freeze(requires)
+    with _cache_lock:
+        groups = _cache.get(key)
+        if groups is not None:
+            del _cache[key]
+            _cache[key] = groups
+    if groups is None:
+        groups = []
+        seen = set()
+        for group in _iter_requires(requires):
+            frozen = _freeze(group)
+            if frozen not in seen:
+                seen.add(frozen)
+                groups.append(group)
+        with _cache_lock:
+            _cache[key] = groups
+            while len(_cache) > _CACHE_SIZE:
+                _cache.popitem(last=False)
+    # Callers are free to modify the groups they're given.
+    return [dict(group) for group in groups]
+
+
+def _iter_requires(requires):
+    """ Lazily expands a ``requires`` entry into its groups. """
     if not isinstance(requires, dict):
         raise ArtisanException('Project configuration `artisan.yml` is not '
                                'structured properly at `jobs.*.requires`. '
                                'See the documentation for more details.')
 
-    groups = []
     global_requires = {}
-
     for require, desc in six.iteritems(requires):
-        if require in _LABEL_KEYWORDS:
-            if require == 'matrix':
-                groups.extend(expand_matrix(desc))
-            if require == 'include':
-                groups.extend(expand_include(desc))
-        else:
+        if require not in _LABEL_KEYWORDS:
             global_requires[require] = desc
+    omit = _OmitIndex(requires.get('omit', []))
 
-    # Now apply global level requires to each grouping.
-    for group in groups:
-        for require, desc in six.iteritems(global_requires):
+    found = False
+    for require, desc in six.iteritems(requires):
+        if require == 'matrix':
+            groups = _iter_matrix(desc)
+        elif require == 'include':
+            groups = _iter_include(desc)
+        else:
+            continue
+        for group in groups:
+            found = True
+            # Now apply global level requires to each grouping.
             # Don't overwrite lower-level requires with globals.
-            if require not in group:
-                group[require] = desc
+            for key, value in six.iteritems(global_requires):
+                if key not in group:
+                    group[key] = value
+            if not omit.matches(group):
+                yield group
 
     # If no groups were found then we only have a single entry of globals.
-    if len(groups) == 0:
-        groups = [global_requires]
-
-    expand_omit(groups, requires.get('omit', []))
-    return groups
+    if not found and not omit.matches(global_requires):
+        yield global_requires
 
 
 def expand_include(include):
     """ Expands an ``include`` entry in a require expression. """
+    return list(_iter_include(include))
+
+
+def _iter_include(include):
     if not isinstance(include, list):
         raise ArtisanException('Project configuration `artisan.yml` is not '
                                'structured properly. See the documentation '
                                'for more details.')
-
-    groups = []
     for entry in include:
-        groups.extend(parse_requires(entry))
-    return groups
+        for group in _iter_requires(entry):
+            yield group
 
 
 def expand_matrix(matrix):
     """ Expands a ``matrix`` entry in a require expression. """
+    return list(_iter_matrix(matrix))
+
+
+def _iter_matrix(matrix):
     if not isinstance(matrix, dict):
         raise ArtisanException('Project configuration `artisan.yml` is not '
                                'structured properly. See the documentation '
                                'for more details.')
 
-    omit = matrix.get('omit', [])
+    omit = _OmitIndex(matrix.get('omit', []))
     names = [key for key in matrix.keys() if key not in _LABEL_KEYWORDS]
-    groups = []
     if len(names):
-        for entry in itertools.product(*[matrix[key] for key in names]):
-            omitted = False
-
-            if len(omit) > 0:
-                entry_dict = {}
-                for i, value in enumerate(entry):
-                    entry_dict[names[i]] = value
-                for omit_dict in omit:
-                    for omit_key, omit_value in six.iteritems(omit_dict):
-                        if omit_key not in entry_dict:
-                            break
-                        if entry_dict[omit_key] != omit_value:
-                            break
-                    else:
-                        omitted = True
-                        break
-
-            if not omitted:
-                groups.append({})
-                for i, value in enumerate(entry):
-                    groups[-1][names[i]] = value
+        for group in _iter_product(names, [matrix[key] for key in names], omit):
+            yield group
 
+    # Groups that don't come from the product are checked against every omit.
     if 'include' in matrix:
-        groups.extend(expand_include(matrix['include']))
+        for group in _iter_include(matrix['include']):
+            if not omit.matches(group):
+                yield group
     if 'matrix' in matrix:
-        groups.extend(expand_matrix(matrix['matrix']))
-
-    expand_omit(groups, omit)
-    return groups
+        for group in _iter_matrix(matrix['matrix']):
+            if not omit.matches(group):
+                yield group
+
+
+def _iter_product(names, values, omit):
+    """ Generates the product of the values of a matrix one group at a time.
+    Values are chosen one name at a time and as soon as the values chosen
+    so far match an omit entry the rest of those groups are skipped. """
+    # Omit entries with a key that isn't in the matrix never match.
+    positions = dict((name, i) for i, name in enumerate(names))
+    checks = [collections.defaultdict(list) for _ in names]
+    for entry in omit.entries:
+        if entry and all(key in positions for key in entry):
+            last = max(positions[key] for key in entry)
+            others = [(key, value) for key, value in six.iteritems(entry)
+                      if key != names[last]]
+            checks[last][_omit_key(entry[names[last]])].append(others)
+    if any(not entry for entry in omit.entries):
+        return
+
+    values = [list(value) for value in values]
+    group = {}
+    stack = [0]
+    while stack:
+        depth = len(stack) - 1
+        index = stack[-1]
+        if index == len(values[depth]):
+            stack.pop()
+            if stack:
+                stack[-1] += 1
+            continue
+        name = names[depth]
+        group[name] = values[depth][index]
+        omitted = False
+        for others in checks[depth].get(_omit_key(group[name]), ()):
+            if all(group[key] == value for key, value in others):
+                omitted = True
+                break
+        if omitted:
+            stack[-1] += 1
+        elif depth + 1 == len(names):
+            yield dict(group)
+            stack[-1] += 1
+        else:
+            stack.append(0)
 
 
 def expand_omit(groups, omit):
     """ Applies an ``omit`` entry in a require expression. """
-    if len(omit) > 0:
-        for i in xrange(len(groups) - 1, -1, -1):
-            group = groups[i]
-            omitted = False
-            for omit_dict in omit:
-                for omit_key, omit_value in six.iteritems(omit_dict):
-                    if omit_key not in group:
-                        break
-                    if group[omit_key] != omit_value:
+    index = _OmitIndex(omit)
+    groups[:] = [group for group in groups if not index.matches(group)]
+
+
+class _OmitIndex(object):
+    """ Index of ``omit`` entries by one of their key and value pairs
+    so that checking a group only looks at entries that could match. """
+    def __init__(self, omit):
+        self.entries = omit
+        self._empty = False
+        self._index = collections.defaultdict(lambda: collections.defaultdict(list))
+        for entry in omit:
+            if not entry:
+                # An empty omit entry matches every group.
+                self._empty = True
+                continue
+            key = sorted(entry.keys(), key=str)[0]
+            self._index[key][_omit_key(entry[key])].append(entry)
+
+    def matches(self, group):
+        if self._empty:
+            return True
+        for key, values in six.iteritems(self._index):
+            if key not in group:
+                continue
+            for entry in values.get(_omit_key(group[key]), ()):
+                for omit_key, omit_value in six.iteritems(entry):
+                    if omit_key not in group or group[omit_key] != omit_value:
                         break
                 else:
-                    omitted = True
-                    break
-            if omitted:
-                del groups[i]
+                    return True
+        return False
+
+
+def _freeze(value):
+    """ Converts a structure from YAML into something hashable.
+    Values keep their type so that `1`, `1.0` and `True` aren't
+    treated as the same value even though they're equal. """
+    if isinstance(value, dict):
+        return ('dict', frozenset((_freeze(key), _freeze(item))
+                                  for key, item in six.iteritems(value)))
+    if isinstance(value, list):
+        return ('list', tuple(_freeze(item) for item in value))
+    return (type(value), value)
+
+
+def _omit_key(value):
+    """ Converts a structure from YAML into something hashable that is
+    equal for values that compare equal, so that omit entries match groups
+    with ``==`` the same way as when every entry was compared in turn. """
+    if isinstance(value, dict):
+        return ('dict', frozenset((_omit_key(key), _omit_key(item))
+                                  for key, item in six.iteritems(value)))
+    if isinstance(value, list):
+        return ('list', tuple(_omit_key(item) for item in value))
+    return value
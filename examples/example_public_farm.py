@@ -1,23 +1,17 @@
-""" Here is an simple example server configuration that allows anyone to
-execute builds on the server between the hours of 11:00pm and 5:30pm
-and only allows myself (@SethMichaelLarson) to execute tests between
-the hours of 5:30pm and 11:00pm. This allows me to donate the cycles
-that would otherwise be lost from me being at work to the Open Source
-community and earn me Karma so I may used community builders as well.
+""" Here is an simple example farm configuration that executes builds
+between the hours of 8:00am and 5:30pm. This allows me to donate the
+cycles that would otherwise be lost from me being at work to the Open
+Source community and earn me Karma so I may used community builders as well.
 
 Of course you can add a lot more builders to this Farm, the more the
 merrier as long as you're not over-working your computer. :) """
 import datetime
 import artisanci
 
-# Put your own secret API key from https://artisan.ci here.
-ARTISAN_API_KEY = 'your-secret-api-key'
-
-
 if __name__ == '__main__':
-    farm = artisanci.Farm(url='https://farms.artisan.ci',
-                          user='gh:SethMichaelLarson',
-                          api_key=ARTISAN_API_KEY)
+    # Builds that are queued are stored in `farm.db` so that
+    # none are lost if the farm is stopped and started again.
+    farm = artisanci.Farm(path='farm.db')
 
     # Create the builder and allow it to automatically detect labels to use.
     # This builder in particular uses VirtualBox to run a Windows OS as a VM.
@@ -32,39 +26,20 @@ if __name__ == '__main__':
     # This is a local builder that can only be used by myself.
     local_builder = artisanci.LocalBuilder(builders=5)
 
-    # Creating the schedule to use the US/Central timezone that I live in.
-    schedule = artisanci.Schedule(timezone='US/Central')
-
-    # This is the policy that allows others to use this builder while I'm at work or asleep.
-    schedule.add_policy(artisanci.CommunityPolicy(start=datetime.time(hour=23),
-                                                  end=datetime.time(hour=17, minute=30),
-                                                  max_duration=30))
-
-    # By setting `karma` equal to `True`, my farm will accrue
-    # Karma when it is used by others which then allows me
-    # additional access to the public farm.
-
-    # Here's my policy that allows only me to use this builder when I come home from work.
-    # The policy restricts the builder to only people who have my secret API key.
-    schedule.add_policy(artisanci.KeyAuthPolicy(start=datetime.time(hour=17, minute=30),
-                                                end=datetime.time(hour=23),
-                                                api_key=ARTISAN_API_KEY))
-
-    # Update the schedule to match
-    windows_builder.set_schedule(schedule)
-
-    # Now to create a schedule for my LocalBuilder.
-    # Which will allow builds all day from only myself.
-    schedule = artisanci.Schedule(timezone='US/Central')
-    schedule.add_policy(artisanci.KeyAuthPolicy(all_day=True,
-                                                api_key=ARTISAN_API_KEY))
-    local_builder.set_schedule(schedule)
-
-    # Add the builders to the farm.
-    farm.add_builder(windows_builder)
-    farm.add_builder(local_builder)
+    # This is the policy that allows others to use this builder while I'm at work.
+    schedule = artisanci.Schedule()
+    schedule.add_policy(artisanci.TimePolicy(timezone='US/Central',
+                                             start_time=datetime.time(hour=8),
+                                             end_time=datetime.time(hour=17, minute=30),
+                                             max_duration=30))
+    farm.policy = schedule
+
+    # Add the builders to the farm along with the labels that
+    # they advertise so that jobs are matched to their `requires`.
+    farm.add_builder(windows_builder, {'platform': 'windows==10',
+                                       'python': 'cpython==3.6'})
+    farm.add_builder(local_builder, {'platform': 'linux',
+                                     'python': ['cpython==2.7', 'cpython==3.6']})
 
     # Start the farm and run it until we exit out of it.
-    # This will also show the status of the farm in the
-    # command line that is executing it.
     farm.run_forever()
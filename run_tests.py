@@ -18,3 +18,4 @@ if __name__ == '__main__':
         builds.append(b)
     for b in builds:
         b.wait()
+    l.shutdown()
@@ -0,0 +1,151 @@
+import os
+import sys
+import time
+import pytest
+from artisanci import BaseBuilder, LocalBuild
+
+
+class SleepBuilder(BaseBuilder):
+    def __init__(self, builders=1, max_queued=None, **kwargs):
+        super(SleepBuilder, self).__init__(python='python', builders=builders,
+                                           max_queued=max_queued, **kwargs)
+
+    def _build_target(self, build):
+        time.sleep(build.duration)
+        if build.script == 'error':
+            raise ValueError('Build failed.')
+        if build.script == 'exit':
+            sys.exit(1)
+        if build.script == 'crash':
+            os._exit(1)
+        build._set_status('success')
+        with open(build.path, 'w') as f:
+            f.write(str(os.getpid()))
+
+
+class CoolDownBuilder(SleepBuilder):
+    def __init__(self, path, **kwargs):
+        super(CoolDownBuilder, self).__init__(**kwargs)
+        self.path = path
+
+    def _cool_down(self):
+        with open(self.path, 'a') as f:
+            f.write(str(os.getpid()) + '\n')
+
+
+def sleep_build(tmpdir, name, duration=0.5):
+    return LocalBuild(name, duration, path=str(tmpdir.join(name)))
+
+
+def test_builds_run_concurrently(tmpdir):
+    builder = SleepBuilder(builders=3)
+    builds = [sleep_build(tmpdir, str(i)) for i in range(3)]
+    start_time = time.time()
+    for build in builds:
+        assert builder.execute_build(build)
+    for build in builds:
+        assert build.wait(timeout=10.0)
+        assert not build.running
+        assert build.result == 'success'
+    assert time.time() - start_time < 1.4
+    assert len(set(tmpdir.join(str(i)).read() for i in range(3))) == 3
+    builder.shutdown()
+
+
+def test_execute_build_back_pressure(tmpdir):
+    builder = SleepBuilder(builders=1, max_queued=0)
+    first = sleep_build(tmpdir, 'first')
+    assert builder.execute_build(first)
+    assert not builder.execute_build(sleep_build(tmpdir, 'second'), blocking=False)
+    assert builder.execute_build(sleep_build(tmpdir, 'third'), timeout=10.0)
+    assert first.wait(timeout=0.0)
+    builder.shutdown()
+
+
+def test_build_error_completes_handle(tmpdir):
+    builder = SleepBuilder()
+    build = sleep_build(tmpdir, 'error', duration=0.0)
+    builder.execute_build(build)
+    assert build.wait(timeout=10.0)
+    assert build.result == 'failure'
+    assert 'Build failed.' in build._handle.error
+    builder.shutdown()
+
+
+def test_build_exit_completes_handle(tmpdir):
+    builder = SleepBuilder()
+    build = sleep_build(tmpdir, 'exit', duration=0.0)
+    builder.execute_build(build)
+    assert build.wait(timeout=10.0)
+    assert build.result == 'failure'
+    assert 'SystemExit' in build._handle.error
+    builder.shutdown()
+
+
+def test_crashed_process_is_replaced(tmpdir):
+    builder = SleepBuilder(builders=1, max_queued=0)
+    crash = sleep_build(tmpdir, 'crash', duration=0.0)
+    builder.execute_build(crash)
+    assert crash.wait(timeout=10.0)
+    assert crash.result == 'failure'
+    assert 'exited unexpectedly' in crash._handle.error
+
+    build = sleep_build(tmpdir, 'after', duration=0.0)
+    assert builder.execute_build(build, timeout=10.0)
+    assert build.wait(timeout=10.0)
+    assert build.result == 'success'
+    builder.shutdown()
+
+
+def test_processes_started_ahead_of_builds(tmpdir):
+    builder = SleepBuilder(builders=2)
+    builder.start()
+    assert len(builder._processes) == 2
+    assert all(process.is_alive() for process in builder._processes)
+    builder.shutdown()
+    assert builder._processes == []
+
+
+def test_processes_recycled_after_max_builds(tmpdir):
+    builder = SleepBuilder(builders=1, max_builds_per_process=2)
+    pids = []
+    for i in range(4):
+        build = sleep_build(tmpdir, str(i), duration=0.0)
+        assert builder.execute_build(build)
+        assert build.wait(timeout=10.0)
+        assert build.result == 'success'
+        pids.append(tmpdir.join(str(i)).read())
+    assert pids[0] == pids[1]
+    assert pids[1] != pids[2]
+    assert pids[2] == pids[3]
+    builder.shutdown()
+
+
+def test_processes_cool_down_when_stopped(tmpdir):
+    path = tmpdir.join('cool_down')
+    builder = CoolDownBuilder(str(path), builders=1)
+    build = sleep_build(tmpdir, 'first', duration=0.0)
+    assert builder.execute_build(build)
+    assert build.wait(timeout=10.0)
+    builder.shutdown()
+    assert path.read().split() == [tmpdir.join('first').read()]
+
+
+def test_processes_recycled_after_memory_growth(tmpdir):
+    pytest.importorskip('psutil')
+    builder = SleepBuilder(builders=1, max_memory_growth=-1)
+    pids = []
+    for i in range(2):
+        build = sleep_build(tmpdir, str(i), duration=0.0)
+        assert builder.execute_build(build)
+        assert build.wait(timeout=10.0)
+        pids.append(tmpdir.join(str(i)).read())
+    assert pids[0] != pids[1]
+    builder.shutdown()
+
+
+@pytest.mark.parametrize('kwargs', [{'builders': 0}, {'max_queued': -1},
+                                    {'max_builds_per_process': 0}])
+def test_builder_bad_arguments(kwargs):
+    with pytest.raises(ValueError):
+        SleepBuilder(**kwargs)
@@ -0,0 +1,417 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import uuid
+import pytest
+from artisanci import GitBuild, LocalBuild, MercurialBuild, Worker
+from artisanci import ArtisanException, ArtisanYml
+from artisanci.caches import (ArtisanYmlCache, GitMirrorCache, MercurialCache,
+                              SnapshotCache, VirtualenvCache)
+from artisanci.caches import snapshot_cache
+
+
+def _has_executable(name):
+    try:
+        subprocess.check_call([name, '--version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return True
+    except Exception:
+        return False
+
+
+requires_git = pytest.mark.skipif(not _has_executable('git'), reason='Requires git.')
+requires_hg = pytest.mark.skipif(not _has_executable('hg'), reason='Requires hg.')
+
+
+@pytest.fixture
+def tmp():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def make_virtualenv(path):
+    os.makedirs(os.path.join(path, 'bin'))
+    os.makedirs(os.path.join(path, 'lib', 'site-packages'))
+    with open(os.path.join(path, 'bin', 'pip'), 'w') as f:
+        f.write('#!%s/bin/python\nimport pip\n' % path)
+    with open(os.path.join(path, 'lib', 'site-packages', 'package.py'), 'w') as f:
+        f.write('x = 1\n')
+    with open(os.path.join(path, 'lib', 'site-packages', 'easy-install.pth'), 'w') as f:
+        f.write('./package.egg\n')
+
+
+def project_worker(path, requirements):
+    os.makedirs(path)
+    with open(os.path.join(path, 'requirements.txt'), 'w') as f:
+        f.write(requirements)
+    worker = Worker()
+    worker.chdir(path)
+    return worker
+
+
+def test_virtualenv_cache_key(tmp):
+    cache = VirtualenvCache(root=os.path.join(tmp, 'cache'))
+    worker_a = project_worker(os.path.join(tmp, 'a'), 'six\n')
+    worker_b = project_worker(os.path.join(tmp, 'b'), 'six\n')
+    worker_c = project_worker(os.path.join(tmp, 'c'), 'requests\n')
+
+    assert cache.key(worker_a) == cache.key(worker_b)
+    assert cache.key(worker_a) != cache.key(worker_c)
+    assert cache.key(worker_a) != cache.key(worker_a, {'A': '1'})
+
+
+def test_virtualenv_cache_store_and_checkout(tmp):
+    cache = VirtualenvCache(root=os.path.join(tmp, 'cache'))
+    worker = project_worker(os.path.join(tmp, 'project'), 'six\n')
+    key = cache.key(worker)
+    venv = os.path.join(tmp, uuid.uuid4().hex)
+    clone = os.path.join(tmp, uuid.uuid4().hex)
+    make_virtualenv(venv)
+
+    assert not cache.checkout(worker, key, clone)
+    assert cache.store(worker, key, venv)
+    assert not cache.store(worker, key, venv)
+    shutil.rmtree(venv)
+    assert cache.checkout(worker, key, clone)
+
+    with open(os.path.join(clone, 'bin', 'pip')) as f:
+        assert f.read() == '#!%s/bin/python\nimport pip\n' % clone
+    cached = os.path.join(cache.entry_path(key), 'venv', 'lib', 'site-packages', 'package.py')
+    assert os.path.samefile(os.path.join(clone, 'lib', 'site-packages', 'package.py'), cached)
+
+    # Files that are edited in place are copied so builds can't change the cache.
+    with open(os.path.join(clone, 'lib', 'site-packages', 'easy-install.pth'), 'a') as f:
+        f.write('./other.egg\n')
+    with open(os.path.join(os.path.dirname(cached), 'easy-install.pth')) as f:
+        assert f.read() == './package.egg\n'
+
+
+def test_virtualenv_cache_evicts_least_recently_used(tmp):
+    cache = VirtualenvCache(root=os.path.join(tmp, 'cache'), max_size=100)
+    worker = Worker()
+    venv = os.path.join(tmp, 'venv')
+    make_virtualenv(venv)
+
+    assert cache.store(worker, 'first', venv)
+    assert cache.store(worker, 'second', venv)
+    assert not cache.has_entry('first')
+    assert cache.has_entry('second')
+
+
+def git(*args):
+    subprocess.check_call(['git', '-c', 'user.name=Artisan', '-c', 'user.email=ci@artisan.ci'] +
+                          list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def git_output(*args):
+    return subprocess.check_output(['git'] + list(args)).decode('utf-8').strip()
+
+
+def commit_file(work, name):
+    with open(os.path.join(work, name), 'w') as f:
+        f.write(name)
+    git('-C', work, 'add', name)
+    git('-C', work, 'commit', '-m', name)
+    git('-C', work, 'push', '-q', 'origin', 'HEAD:master')
+    return git_output('-C', work, 'rev-parse', 'HEAD')
+
+
+@pytest.fixture
+def git_remote(tmp):
+    remote = os.path.join(tmp, 'remote.git')
+    work = os.path.join(tmp, 'work')
+    git('init', '-q', '--bare', remote)
+    git('init', '-q', work)
+    git('-C', work, 'remote', 'add', 'origin', remote)
+    return remote, work
+
+
+def fetch_git_build(cache, remote, commit=None):
+    build = GitBuild('script.py', 5, repo=remote, branch='master', commit=commit)
+    build.git_cache = cache
+    worker = Worker()
+    worker.build = build
+    build.fetch_project(worker)
+    return build, worker
+
+
+@requires_git
+def test_git_mirror_cache_fetches_incrementally(tmp, git_remote):
+    remote, work = git_remote
+    cache = GitMirrorCache(root=os.path.join(tmp, 'cache'))
+    first = commit_file(work, 'a.txt')
+
+    build, worker = fetch_git_build(cache, remote)
+    assert build.commit == first
+    assert cache.has_entry(cache.key(remote))
+    assert git_output('-C', worker.cwd, 'remote', 'get-url', 'origin') == remote
+    build.cleanup_project(worker)
+
+    second = commit_file(work, 'b.txt')
+    build, worker = fetch_git_build(cache, remote)
+    assert build.commit == second
+    assert os.path.isfile(os.path.join(worker.cwd, 'b.txt'))
+    build.cleanup_project(worker)
+
+
+@requires_git
+def test_git_mirror_cache_skips_fetch_for_known_commit(tmp, git_remote):
+    remote, work = git_remote
+    cache = GitMirrorCache(root=os.path.join(tmp, 'cache'))
+    first = commit_file(work, 'a.txt')
+    fetch_git_build(cache, remote)[0].cleanup_project(Worker())
+
+    # The remote disappearing doesn't matter if the commit is cached.
+    shutil.rmtree(remote)
+    build, worker = fetch_git_build(cache, remote, commit=first)
+    assert git_output('-C', worker.cwd, 'rev-parse', 'HEAD') == first
+    build.cleanup_project(worker)
+
+
+def hg(*args):
+    subprocess.check_call(['hg', '--config', 'ui.username=Artisan <ci@artisan.ci>'] + list(args),
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def hg_commit_file(remote, name):
+    with open(os.path.join(remote, name), 'w') as f:
+        f.write(name)
+    hg('-R', remote, 'commit', '-A', '-m', name)
+    return subprocess.check_output(['hg', '-R', remote, 'log', '-r', 'tip',
+                                    '-T', '{node}']).decode('utf-8')
+
+
+def fetch_mercurial_build(cache, remote, revision=None):
+    build = MercurialBuild('script.py', 5, repo=remote, branch='default', revision=revision)
+    build.mercurial_cache = cache
+    worker = Worker()
+    worker.build = build
+    build.fetch_project(worker)
+    return build, worker
+
+
+@requires_hg
+def test_mercurial_cache_pulls_incrementally(tmp):
+    remote = os.path.join(tmp, 'remote')
+    hg('init', remote)
+    cache = MercurialCache(root=os.path.join(tmp, 'cache'))
+    first = hg_commit_file(remote, 'a.txt')
+
+    build, worker = fetch_mercurial_build(cache, remote)
+    assert build.revision == first
+    assert cache.has_entry(cache.key(remote))
+    build.cleanup_project(worker)
+
+    second = hg_commit_file(remote, 'b.txt')
+    build, worker = fetch_mercurial_build(cache, remote)
+    assert build.revision == second
+    assert os.path.isfile(os.path.join(worker.cwd, 'b.txt'))
+    build.cleanup_project(worker)
+
+    shutil.rmtree(remote)
+    build, worker = fetch_mercurial_build(cache, remote, revision=first)
+    assert not os.path.isfile(os.path.join(worker.cwd, 'b.txt'))
+    build.cleanup_project(worker)
+
+
+@requires_hg
+def test_mercurial_cache_resolves_cached_revision_once(tmp, monkeypatch):
+    remote = os.path.join(tmp, 'remote')
+    hg('init', remote)
+    cache = MercurialCache(root=os.path.join(tmp, 'cache'))
+    first = hg_commit_file(remote, 'a.txt')
+    build, worker = fetch_mercurial_build(cache, remote)
+    build.cleanup_project(worker)
+
+    commands = []
+    execute = Worker.execute
+
+    def record(self, command, *args, **kwargs):
+        commands.append(command.split()[:2])
+        return execute(self, command, *args, **kwargs)
+
+    monkeypatch.setattr(Worker, 'execute', record)
+    build, worker = fetch_mercurial_build(cache, remote, revision=first)
+    assert build.revision == first
+    assert [command for command in commands if command != ['hg', '--version']] == [['hg', 'log'],
+                                                                                   ['hg', 'clone']]
+    build.cleanup_project(worker)
+
+
+@requires_hg
+def test_mercurial_build_revision_is_node_without_cache(tmp):
+    remote = os.path.join(tmp, 'remote')
+    hg('init', remote)
+    first = hg_commit_file(remote, 'a.txt')
+    build, worker = fetch_mercurial_build(None, remote)
+    assert build.revision == first
+    build.cleanup_project(worker)
+
+
+def write_file(path, data):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+def fetch_local_build(cache, project):
+    build = LocalBuild('script.py', 5, path=project)
+    build.snapshot_cache = cache
+    worker = Worker()
+    worker.build = build
+    build.fetch_project(worker)
+    return build, worker
+
+
+@pytest.fixture
+def reflink(monkeypatch):
+    # Snapshots are only kept where reflinks work. Without them
+    # files are copied out of the snapshot, which behaves the same.
+    monkeypatch.setattr(snapshot_cache, '_can_reflink', lambda source, destination: True)
+
+
+def test_snapshot_cache_copies_only_changed_files(tmp, reflink):
+    project = os.path.join(tmp, 'project')
+    write_file(os.path.join(project, 'a.txt'), 'a')
+    write_file(os.path.join(project, 'src', 'b.txt'), 'b')
+    write_file(os.path.join(project, 'node_modules', 'c.js'), 'c')
+    write_file(os.path.join(project, '.git', 'HEAD'), 'ref')
+    write_file(os.path.join(project, '.artisanignore'), '# Comment\nnode_modules/\n*.pyc\n')
+    write_file(os.path.join(project, 'src', 'd.pyc'), 'd')
+    cache = SnapshotCache(root=os.path.join(tmp, 'cache'))
+    worker = Worker()
+
+    destination = os.path.join(tmp, 'first')
+    os.makedirs(destination)
+    assert cache.checkout(worker, project, destination, ['.git', 'node_modules', '*.pyc']) == 3
+    assert sorted(os.listdir(destination)) == ['.artisanignore', 'a.txt', 'src']
+    assert os.listdir(os.path.join(destination, 'src')) == ['b.txt']
+
+    write_file(os.path.join(project, 'a.txt'), 'changed')
+    os.remove(os.path.join(project, 'src', 'b.txt'))
+    build, worker = fetch_local_build(cache, project)
+    assert sorted(os.listdir(worker.cwd)) == ['.artisanignore', 'a.txt', 'src']
+    assert os.listdir(os.path.join(worker.cwd, 'src')) == []
+    with open(os.path.join(worker.cwd, 'a.txt')) as f:
+        assert f.read() == 'changed'
+
+    # The first checkout still sees the file it started with.
+    with open(os.path.join(destination, 'a.txt')) as f:
+        assert f.read() == 'a'
+    build.cleanup_project(worker)
+
+
+def test_snapshot_cache_repairs_files_modified_by_builds(tmp, reflink):
+    project = os.path.join(tmp, 'project')
+    write_file(os.path.join(project, 'a.txt'), 'a')
+    cache = SnapshotCache(root=os.path.join(tmp, 'cache'))
+
+    build, worker = fetch_local_build(cache, project)
+    snapshot = os.path.join(cache.entry_path(cache.key(project)), 'tree', 'a.txt')
+    assert not os.path.samefile(os.path.join(worker.cwd, 'a.txt'), snapshot)
+    with open(os.path.join(worker.cwd, 'a.txt'), 'a') as f:
+        f.write('modified by the build')
+    with open(snapshot) as f:
+        assert f.read() == 'a'
+    build.cleanup_project(worker)
+
+    build, worker = fetch_local_build(cache, project)
+    with open(os.path.join(worker.cwd, 'a.txt')) as f:
+        assert f.read() == 'a'
+    build.cleanup_project(worker)
+
+
+def test_snapshot_cache_copies_project_without_reflinks(tmp, monkeypatch):
+    monkeypatch.setattr(snapshot_cache, '_can_reflink', lambda source, destination: False)
+    project = os.path.join(tmp, 'project')
+    write_file(os.path.join(project, 'a.txt'), 'a')
+    write_file(os.path.join(project, 'src', 'b.txt'), 'b')
+    write_file(os.path.join(project, 'src', 'c.pyc'), 'c')
+    os.symlink('a.txt', os.path.join(project, 'link.txt'))
+    cache = SnapshotCache(root=os.path.join(tmp, 'cache'))
+
+    destination = os.path.join(tmp, 'build')
+    os.makedirs(destination)
+    assert cache.checkout(Worker(), project, destination, ['*.pyc']) == 3
+    assert sorted(os.listdir(destination)) == ['a.txt', 'link.txt', 'src']
+    assert os.listdir(os.path.join(destination, 'src')) == ['b.txt']
+    assert os.readlink(os.path.join(destination, 'link.txt')) == 'a.txt'
+    assert not cache.has_entry(cache.key(project))
+
+
+def test_can_reflink_checks_filesystem(tmp):
+    source = os.path.join(tmp, 'source')
+    destination = os.path.join(tmp, 'destination')
+    os.makedirs(source)
+    os.makedirs(destination)
+    assert snapshot_cache._can_reflink(source, destination) in (True, False)
+    assert os.listdir(source) == []
+    assert os.listdir(destination) == []
+
+
+@pytest.mark.parametrize('use_cache', [True, False])
+def test_local_build_skips_only_top_level_repositories(tmp, use_cache):
+    project = os.path.join(tmp, 'project')
+    write_file(os.path.join(project, '.git', 'HEAD'), 'ref')
+    write_file(os.path.join(project, 'vendor', '.git'), 'gitdir: ../.git/modules/vendor')
+    write_file(os.path.join(project, 'vendor', 'a.txt'), 'a')
+    cache = SnapshotCache(root=os.path.join(tmp, 'cache')) if use_cache else None
+
+    build, worker = fetch_local_build(cache, project)
+    assert os.listdir(worker.cwd) == ['vendor']
+    assert sorted(os.listdir(os.path.join(worker.cwd, 'vendor'))) == ['.git', 'a.txt']
+    build.cleanup_project(worker)
+
+
+ARTISAN_YML = """
+builds:
+  - script: test
+    duration: 5
+    requires:
+      matrix:
+        python: [cpython==2.7, cpython==3.6]
+"""
+
+
+def test_artisan_yml_cache_skips_parsing(tmp, monkeypatch):
+    cache = ArtisanYmlCache(root=tmp)
+    first = ArtisanYml.from_string(ARTISAN_YML, cache=cache)
+
+    def fail(_):
+        raise AssertionError('Parsed a cached file.')
+    monkeypatch.setattr(ArtisanYml, '_parse', staticmethod(fail))
+    second = ArtisanYml.from_string(ARTISAN_YML, cache=cache)
+    assert second is not first
+    assert [job.requires for job in second.jobs] == [job.requires for job in first.jobs]
+    with pytest.raises(AssertionError):
+        ArtisanYml.from_string(ARTISAN_YML + '\n', cache=cache)
+
+
+def test_artisan_yml_cache_evicts_from_memory(tmp):
+    cache = ArtisanYmlCache(root=tmp, max_entries=1)
+    ArtisanYml.from_string(ARTISAN_YML, cache=cache)
+    ArtisanYml.from_string(ARTISAN_YML + '\n', cache=cache)
+    assert cache.get(cache.key(ARTISAN_YML)) is None
+    assert cache.get(cache.key(ARTISAN_YML + '\n')) is not None
+
+
+def test_artisan_yml_cache_on_disk(tmp):
+    cache = ArtisanYmlCache(root=tmp, on_disk=True)
+    ArtisanYml.from_string(ARTISAN_YML, cache=cache)
+    key = cache.key(ARTISAN_YML)
+    assert cache.has_entry(key)
+
+    other = ArtisanYmlCache(root=tmp, on_disk=True)
+    project = other.get(key)
+    assert len(project.jobs) == 2
+
+
+def test_artisan_yml_cache_does_not_cache_errors(tmp):
+    cache = ArtisanYmlCache(root=tmp)
+    for _ in range(2):
+        with pytest.raises(ArtisanException):
+            ArtisanYml.from_string('builds: []', cache=cache)
+    assert cache.get(cache.key('builds: []')) is None
+
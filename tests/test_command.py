@@ -0,0 +1,203 @@
+import os
+import sys
+import time
+import pytest
+from artisanci import ArtisanException, Worker
+from artisanci.compat import PY35
+from artisanci.watchable import Watchable
+from artisanci.workers import command as command_module
+
+if PY35:
+    import asyncio
+
+requires_asyncio = pytest.mark.skipif(not PY35, reason='Requires Python 3.5 or later.')
+
+
+class _Recorder(object):
+    def __init__(self):
+        self.events = []
+
+    def on_command_output(self, _, data):
+        self.events.append(('output', data))
+
+    def on_command_error(self, _, data):
+        self.events.append(('error', data))
+
+
+def python_command(code):
+    return [sys.executable, '-c', code]
+
+
+@pytest.fixture(params=['selector', 'threaded'])
+def worker(request, monkeypatch):
+    if request.param == 'threaded':
+        monkeypatch.setattr(command_module, 'selectors', None)
+    return Worker()
+
+
+def test_execute_captures_stdout_and_stderr(worker):
+    command = worker.execute(python_command('import sys; '
+                                            'sys.stdout.write("out"); '
+                                            'sys.stderr.write("err")'))
+    assert command.exit_status == 0
+    assert command.stdout.getvalue() == b'out'
+    assert command.stderr.getvalue() == b'err'
+
+
+def test_execute_merge_stderr(worker):
+    command = worker.execute(python_command('import sys; sys.stderr.write("err")'),
+                             merge_stderr=True)
+    assert command.stdout.getvalue() == b'err'
+    assert command.stderr.getvalue() == b''
+
+
+def test_execute_large_output(worker):
+    command = worker.execute(python_command('import sys; sys.stdout.write("x" * 1000000)'))
+    assert len(command.stdout) == 1000000
+    assert command.stdout.getvalue() == b'x' * 1000000
+
+
+def test_execute_output_spills_to_file(worker):
+    worker.max_output_memory = 1024
+    command = worker.execute(python_command('import sys; sys.stdout.write("x" * 100000)'))
+    assert command.stdout.spilled
+    assert command.stdout.getvalue() == b'x' * 100000
+
+
+def test_execute_non_zero_exit_raises(worker):
+    with pytest.raises(ArtisanException):
+        worker.execute(python_command('import sys; sys.exit(3)'))
+
+
+def test_execute_timeout_raises(worker):
+    with pytest.raises(ArtisanException):
+        worker.execute(python_command('import time; time.sleep(5)'), timeout=0.2)
+
+
+def test_execute_notifies_watchers(worker):
+    build = Watchable()
+    recorder = _Recorder()
+    build.add_watcher(recorder)
+    worker.build = build
+    worker.execute(python_command('import sys; '
+                                  'sys.stdout.write("out"); '
+                                  'sys.stdout.flush(); '
+                                  'sys.stderr.write("err")'))
+    assert b''.join(data for event, data in recorder.events if event == 'output') == b'out'
+    assert b''.join(data for event, data in recorder.events if event == 'error') == b'err'
+
+
+@requires_asyncio
+def test_execute_async_concurrently():
+    worker = Worker()
+    build = Watchable()
+    recorder = _Recorder()
+    build.add_watcher(recorder)
+    worker.build = build
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    first, second = loop.run_until_complete(asyncio.gather(
+        worker.execute_async(python_command('import sys; sys.stdout.write("a")')),
+        worker.execute_async(python_command('import sys; sys.stderr.write("b")'))))
+    loop.close()
+
+    assert first.exit_status == 0
+    assert first.stdout.getvalue() == b'a'
+    assert second.stderr.getvalue() == b'b'
+    assert ('output', b'a') in recorder.events
+    assert ('error', b'b') in recorder.events
+
+
+@requires_asyncio
+@pytest.mark.parametrize('code, kwargs', [('import sys; sys.exit(1)', {}),
+                                          ('import time; time.sleep(5)', {'timeout': 0.2})])
+def test_execute_async_raises(code, kwargs):
+    worker = Worker()
+    loop = asyncio.new_event_loop()
+    with pytest.raises(ArtisanException):
+        loop.run_until_complete(worker.execute_async(python_command(code), **kwargs))
+    loop.close()
+
+
+@requires_asyncio
+def test_execute_async_timeout_kills_process(tmpdir):
+    worker = Worker()
+    path = tmpdir.join('pid')
+    code = ('import os, time; open(%r, "w").write(str(os.getpid())); '
+            'time.sleep(30)' % str(path))
+    loop = asyncio.new_event_loop()
+    start = time.time()
+    with pytest.raises(ArtisanException):
+        loop.run_until_complete(worker.execute_async(python_command(code), timeout=1.0))
+    loop.close()
+    assert time.time() - start < 10.0
+
+    pid = int(path.read())
+    with pytest.raises(OSError):
+        os.kill(pid, 0)
+
+
+def test_execute_many_prefixes_output():
+    worker = Worker()
+    build = Watchable()
+    recorder = _Recorder()
+    build.add_watcher(recorder)
+    worker.build = build
+
+    commands = worker.execute_many([python_command('print("a\\nb")'),
+                                    python_command('print("c")')], max_parallel=2)
+    assert [command.stdout.getvalue().replace(b'\r', b'') for command in commands] == [b'a\nb\n',
+                                                                                     b'c\n']
+    assert all(command.duration >= 0.0 for command in commands)
+    output = b''.join(data for event, data in recorder.events if event == 'output')
+    lines = output.replace(b'\r', b'').splitlines()
+    assert sorted(lines) == [b'[1] a', b'[1] b', b'[2] c']
+
+
+def test_execute_many_runs_concurrently():
+    worker = Worker()
+    commands = worker.execute_many([python_command('import time; time.sleep(0.5)')] * 4,
+                                   max_parallel=4)
+    assert len(commands) == 4
+    assert max(command._end_time for command in commands) - \
+        min(command._start_time for command in commands) < 1.5
+
+
+def test_execute_many_failure_returns_results():
+    worker = Worker()
+    commands = worker.execute_many([python_command('import sys; sys.exit(1)'),
+                                    python_command('pass')])
+    assert [command.exit_status for command in commands] == [1, 0]
+
+
+def test_execute_many_spawn_failure():
+    worker = Worker()
+    commands = worker.execute_many([['artisanci-command-that-does-not-exist'],
+                                    python_command('pass')])
+    assert isinstance(commands[0], Exception)
+    assert commands[1].exit_status == 0
+
+    with pytest.raises(ArtisanException) as error:
+        worker.execute_many([['artisanci-command-that-does-not-exist']], fail_fast=True)
+    assert isinstance(error.value.results[0], Exception)
+
+
+def test_execute_many_empty():
+    assert Worker().execute_many([]) == []
+
+
+def test_execute_many_fail_fast_kills_running():
+    worker = Worker()
+    start = time.time()
+    with pytest.raises(ArtisanException) as error:
+        worker.execute_many([python_command('import time; time.sleep(0.5); raise SystemExit(1)'),
+                             python_command('import time; time.sleep(30)')], fail_fast=True)
+    assert time.time() - start < 10.0
+    assert [command.exit_status for command in error.value.results] != [0, 0]
+
+
+@pytest.mark.parametrize('max_parallel', [0, -1, 1.5])
+def test_execute_many_bad_max_parallel(max_parallel):
+    with pytest.raises(ValueError):
+        Worker().execute_many(['echo'], max_parallel=max_parallel)
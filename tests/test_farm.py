@@ -0,0 +1,194 @@
+import threading
+import time
+import pytest
+from artisanci import ArtisanException, BaseBuilder, Farm, LocalBuild
+from artisanci.farm import JobQueue
+from artisanci.policy import BasePolicy
+
+
+class QuickBuilder(BaseBuilder):
+    def __init__(self, builders=1):
+        super(QuickBuilder, self).__init__(python='python', builders=builders)
+
+    def _build_target(self, build):
+        if build.script == 'error':
+            raise ValueError('Build failed.')
+        build._set_status('success')
+
+
+class SwitchPolicy(BasePolicy):
+    def __init__(self):
+        self.allow = False
+
+    def allow_build_request(self, request=None):
+        return self.allow
+
+
+def quick_build(name='tests.py', **requires):
+    build = LocalBuild(name, 5)
+    build.requires = requires
+    return build
+
+
+def wait_for_done(farm, count, timeout=10.0):
+    deadline = time.time() + timeout
+    while farm.queue.counts()['done'] < count and time.time() < deadline:
+        farm.step()
+        time.sleep(0.01)
+    return farm.queue.counts()['done'] == count
+
+
+def test_farm_runs_builds(tmpdir):
+    farm = Farm(str(tmpdir.join('farm.db')))
+    builder = QuickBuilder(builders=2)
+    farm.add_builder(builder, {'platform': 'linux'})
+    job_ids = [farm.submit(quick_build(str(i), platform='linux')) for i in range(3)]
+    error_id = farm.submit(quick_build('error'))
+    assert wait_for_done(farm, 4)
+    for job_id in job_ids:
+        assert farm.queue.state(job_id) == ('done', 'success')
+    assert farm.queue.state(error_id) == ('done', 'failure')
+    builder.shutdown()
+    farm.close()
+
+
+def test_farm_fails_builds_with_bad_labels(tmpdir):
+    farm = Farm(str(tmpdir.join('farm.db')))
+    with pytest.raises(ArtisanException):
+        farm.submit(quick_build('x', platform=True))
+    assert farm.queue.counts()['queued'] == 0
+
+    # Builds that were queued without being checked fail instead of stopping the farm.
+    job_id = farm.queue.put(quick_build('x', platform=True))
+    assert farm.step() == 0
+    assert farm.queue.state(job_id) == ('done', 'failure')
+    assert farm.step() == 0
+    farm.close()
+
+
+def test_farm_keeps_queue_between_restarts(tmpdir):
+    path = str(tmpdir.join('farm.db'))
+    farm = Farm(path)
+    job_id = farm.submit(quick_build())
+    assert farm.step() == 0
+    farm.close()
+
+    farm = Farm(path)
+    builder = QuickBuilder()
+    farm.add_builder(builder)
+    assert wait_for_done(farm, 1)
+    assert farm.queue.state(job_id) == ('done', 'success')
+    builder.shutdown()
+    farm.close()
+
+
+def test_farm_recovers_running_builds(tmpdir):
+    path = str(tmpdir.join('farm.db'))
+    queue = JobQueue(path)
+    running = queue.put(quick_build('running'))
+    done = queue.put(quick_build('done'))
+    queue.start(running)
+    queue.start(done)
+    queue.finish(done, 'success')
+    queue.close()
+
+    farm = Farm(path)
+    builder = QuickBuilder()
+    farm.add_builder(builder)
+    assert wait_for_done(farm, 2)
+    assert farm.queue.counts() == {'queued': 0, 'running': 0, 'done': 2}
+    assert farm.queue.state(running) == ('done', 'success')
+    builder.shutdown()
+    farm.close()
+
+
+def test_queue_recover_max_attempts(tmpdir):
+    queue = JobQueue(str(tmpdir.join('farm.db')))
+    job_id = queue.put(quick_build())
+    for _ in range(3):
+        queue.start(job_id)
+        assert queue.recover(max_attempts=4) == 1
+    queue.start(job_id)
+    assert queue.recover(max_attempts=4) == 0
+    assert queue.state(job_id) == ('done', 'failure')
+    queue.close()
+
+
+def test_queue_put_with_key(tmpdir):
+    queue = JobQueue(str(tmpdir.join('farm.db')))
+    first = queue.put(quick_build(), key='build-1')
+    assert queue.put(quick_build(), key='build-1') == first
+    assert queue.put(quick_build(), key='build-2') != first
+    assert queue.counts()['queued'] == 2
+    assert queue.get(first).script == 'tests.py'
+    queue.close()
+
+
+def test_farm_waits_for_policy(tmpdir):
+    policy = SwitchPolicy()
+    farm = Farm(str(tmpdir.join('farm.db')), policy=policy)
+    builder = QuickBuilder()
+    farm.add_builder(builder)
+    job_id = farm.submit(quick_build())
+    assert farm.step() == 0
+    assert farm.queue.state(job_id) == ('queued', None)
+
+    policy.allow = True
+    assert wait_for_done(farm, 1)
+    builder.shutdown()
+    farm.close()
+
+
+def test_farm_run_forever(tmpdir):
+    farm = Farm(str(tmpdir.join('farm.db')), poll_interval=0.1)
+    builder = QuickBuilder()
+    farm.add_builder(builder)
+    job_id = farm.submit(quick_build())
+
+    def stop_when_done():
+        deadline = time.time() + 10.0
+        while farm.queue.state(job_id)[0] != 'done' and time.time() < deadline:
+            time.sleep(0.01)
+        farm.stop()
+
+    thread = threading.Thread(target=stop_when_done)
+    thread.start()
+    farm.run_forever()
+    thread.join()
+    assert farm.queue.state(job_id) == ('done', 'success')
+    farm.close()
+
+
+def test_farm_checks_policy_before_dispatch(tmpdir):
+    policy = SwitchPolicy()
+    policy.allow = True
+    farm = Farm(str(tmpdir.join('farm.db')), policy=policy)
+    builder = QuickBuilder()
+    farm.add_builder(builder)
+    first = farm.submit(quick_build('first'))
+    second = farm.submit(quick_build('second'))
+    assert farm.step() == 1
+
+    policy.allow = False
+    deadline = time.time() + 10.0
+    while farm.queue.state(first)[0] != 'done' and time.time() < deadline:
+        time.sleep(0.01)
+    assert farm.step() == 0
+    assert farm.queue.state(second) == ('queued', None)
+
+    policy.allow = True
+    assert wait_for_done(farm, 2)
+    builder.shutdown()
+    farm.close()
+
+
+def test_queue_requeue_does_not_count_attempts(tmpdir):
+    queue = JobQueue(str(tmpdir.join('farm.db')))
+    job_id = queue.put(quick_build())
+    for _ in range(3):
+        queue.start(job_id)
+        queue.requeue(job_id)
+    queue.start(job_id)
+    assert queue.recover(max_attempts=2) == 1
+    assert queue.state(job_id) == ('queued', None)
+    queue.close()
@@ -0,0 +1,91 @@
+import gzip
+import os
+import pytest
+from artisanci import ArtisanException, LocalBuild
+from artisanci.reporters import LogFile, LogReporter, LogWriter
+
+
+def test_log_writer_blocks_and_ranged_reads(tmpdir):
+    path = str(tmpdir.join('build.log'))
+    data = os.urandom(1000) + b'abc' * 1000
+    writer = LogWriter(path, block_size=256)
+    for i in range(0, len(data), 100):
+        writer.write(data[i:i + 100])
+    writer.close()
+
+    log = LogFile(path)
+    assert log.size == len(data)
+    assert len(log._records) == (len(data) + 255) // 256
+    assert log.read() == data
+    assert log.read(250, 10) == data[250:260]
+    assert log.read(500, 1000) == data[500:1500]
+    assert log.read(len(data) + 10) == b''
+    assert log.tail(300) == data[-300:]
+
+    # The blocks together are a valid gzip file.
+    with gzip.open(path, 'rb') as f:
+        assert f.read() == data
+
+
+def test_log_file_follows_writer(tmpdir):
+    path = str(tmpdir.join('build.log'))
+    writer = LogWriter(path, block_size=1024)
+    log = LogFile(path)
+    writer.write(b'hello ')
+    assert log.size == 0
+    writer.flush()
+    assert log.read() == b'hello '
+    writer.write(b'world')
+    writer.flush()
+    assert log.read(6) == b'world'
+    writer.close()
+
+
+def test_log_writer_continues_existing_log(tmpdir):
+    path = str(tmpdir.join('build.log'))
+    writer = LogWriter(path)
+    writer.write(b'first\n')
+    writer.close()
+    # Garbage after the last indexed block is discarded.
+    with open(path, 'ab') as f:
+        f.write(b'partial block')
+
+    writer = LogWriter(path)
+    writer.write(b'second\n')
+    writer.close()
+    assert LogFile(path).read() == b'first\nsecond\n'
+
+
+def test_log_writer_compression_mismatch(tmpdir):
+    path = str(tmpdir.join('build.log'))
+    LogWriter(path).close()
+    with pytest.raises(ArtisanException):
+        LogWriter(path, compression='zstd')
+
+
+def test_log_writer_zstd(tmpdir):
+    pytest.importorskip('zstandard')
+    path = str(tmpdir.join('build.log'))
+    writer = LogWriter(path, compression='zstd', block_size=16)
+    writer.write(b'0123456789' * 10)
+    writer.close()
+    assert LogFile(path).read(15, 20) == (b'0123456789' * 10)[15:35]
+
+
+def test_log_reporter_writes_build_log(tmpdir):
+    reporter = LogReporter(str(tmpdir), flush_interval=60.0)
+    build = LocalBuild('script', 1, path='.')
+    build.build_id = 'build-1'
+    build.add_watcher(reporter)
+
+    build.notify_watchers('command', 'echo hi')
+    build.notify_watchers('command_output', b'hi\n')
+    build.notify_watchers('command_error', b'oops\n')
+    log = LogFile(str(tmpdir.join('build-1.log')))
+    assert log.size == 0
+    build.notify_watchers('status_change', 'success')
+    assert log.read() == b'$ echo hi\nhi\noops\n'
+    build.notify_watchers('command_output', b'cleanup\n')
+    build.notify_watchers('complete', 'success')
+    assert log.tail(8) == b'cleanup\n'
+    assert reporter._writers == {}
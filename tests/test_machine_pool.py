@@ -0,0 +1,355 @@
+import threading
+import time
+import pytest
+from artisanci import ArtisanException
+from artisanci.builders.virtualbox_builder import MachinePool, _FifoLock
+from virtualbox.library import MachineState
+
+
+class FakeProgress(object):
+    def wait_for_completion(self, timeout):
+        pass
+
+
+class FakeConsole(object):
+    def __init__(self, machine):
+        self.machine = machine
+
+    def power_down(self):
+        self.machine.running = False
+        return FakeProgress()
+
+
+class FakeSession(object):
+    def __init__(self, machine=None):
+        self.machine = machine
+        self.console = None if machine is None else FakeConsole(machine)
+
+    def unlock_machine(self):
+        if self.machine is not None:
+            self.machine.locked = False
+
+
+class FakeSnapshot(object):
+    def __init__(self, name, machine):
+        self.name = name
+        self.machine = machine
+
+
+class FakeMachine(object):
+    def __init__(self, vbox, name, boot_time=0.0):
+        self.vbox = vbox
+        self.name = name
+        self.boot_time = boot_time
+        self.snapshots = {}
+        self.current_snapshot = None
+        self.current_state_modified = False
+        self.linked_to = None
+        self.locked = False
+        self.running = False
+        self.lock_count = 0
+        self.restores = []
+        self.snapshot_folder = ''
+
+    @property
+    def state(self):
+        return MachineState.running if self.running else MachineState.powered_off
+
+    def lock_machine(self, session, lock_type):
+        if self.locked:
+            raise RuntimeError('Machine is locked.')
+        self.locked = True
+        self.lock_count += 1
+        session.machine = self
+
+    def find_snapshot(self, name):
+        return self.snapshots[name]
+
+    def take_snapshot(self, name, description, pause):
+        assert self.locked
+        self.snapshots[name] = FakeSnapshot(name, self)
+        self.current_snapshot = self.snapshots[name]
+        self.current_state_modified = False
+        return FakeProgress(), name
+
+    def restore_snapshot(self, snapshot):
+        assert self.locked and not self.running
+        self.restores.append(snapshot.name)
+        return FakeProgress()
+
+    def clone(self, snapshot_name_or_id=None, name=None):
+        assert snapshot_name_or_id is not None
+        clone = self.vbox.add_machine(name, boot_time=self.boot_time)
+        clone.linked_to = snapshot_name_or_id
+        return clone
+
+    def launch_vm_process(self, type_p):
+        time.sleep(self.boot_time)
+        self.running = True
+        return FakeProgress()
+
+    def create_session(self):
+        return FakeSession(self)
+
+    def unregister(self, mode):
+        del self.vbox.machines[self.name]
+        return []
+
+    def delete_config(self, mediums):
+        return FakeProgress()
+
+
+class FakeVirtualBox(object):
+    def __init__(self):
+        self.machines = {}
+        self.find_count = 0
+        self._lock = threading.Lock()
+
+    def add_machine(self, name, boot_time=0.0):
+        machine = FakeMachine(self, name, boot_time=boot_time)
+        with self._lock:
+            self.machines[name] = machine
+        return machine
+
+    def find_machine(self, name):
+        self.find_count += 1
+        return self.machines[name]
+
+    def clones(self):
+        return [machine for name, machine in self.machines.items() if name != 'base']
+
+
+def make_pool(size, boot_time=0.0, **kwargs):
+    vbox = FakeVirtualBox()
+    vbox.add_machine('base', boot_time=boot_time)
+    return vbox, MachinePool('base', size=size, vbox=vbox,
+                             session_factory=FakeSession, **kwargs)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_pool_fills_in_background():
+    vbox, pool = make_pool(size=3)
+    pool.start()
+    wait_for(lambda: len(pool._idle) == 3)
+    assert len(vbox.clones()) == 3
+    assert all(clone.running for clone in vbox.clones())
+    pool.close()
+    assert vbox.clones() == []
+
+
+def test_acquire_hands_out_booted_clone_and_replenishes():
+    vbox, pool = make_pool(size=2, boot_time=0.5)
+    pool.start()
+    wait_for(lambda: len(pool._idle) == 2)
+
+    start_time = time.time()
+    session = pool.acquire()
+    assert time.time() - start_time < 0.3
+    assert session.machine.running
+
+    wait_for(lambda: len(pool._idle) == 2)
+    assert len(vbox.clones()) == 3
+    pool.release(session)
+    assert session.machine.name not in vbox.machines
+    pool.close()
+
+
+def test_acquire_without_pool_creates_clone():
+    vbox, pool = make_pool(size=0)
+    session = pool.acquire()
+    assert session.machine.running
+    assert len(vbox.clones()) == 1
+    pool.release(session)
+    assert vbox.clones() == []
+
+
+def test_base_machine_locked_only_for_snapshot():
+    vbox, pool = make_pool(size=2)
+    base = vbox.find_machine('base')
+    pool.start()
+    sessions = [pool.acquire() for _ in range(4)]
+    assert base.lock_count == 1
+    assert not base.locked
+    assert 'artisanci-base' in base.snapshots
+    for session in sessions:
+        pool.release(session)
+    pool.close()
+
+
+def test_snapshot_taken_again_when_base_machine_changes():
+    vbox, pool = make_pool(size=0)
+    base = vbox.find_machine('base')
+    session = pool.acquire()
+    first = base.current_snapshot
+    assert session.machine.linked_to is first
+    pool.release(session)
+
+    base.current_state_modified = True
+    session = pool.acquire()
+    assert base.lock_count == 2
+    assert base.current_snapshot is not first
+    assert session.machine.linked_to is base.current_snapshot
+    pool.release(session)
+
+
+def test_clones_linked_to_current_snapshot():
+    vbox, pool = make_pool(size=0)
+    base = vbox.find_machine('base')
+    base.current_snapshot = FakeSnapshot('updated', base)
+    session = pool.acquire()
+    assert session.machine.linked_to is base.current_snapshot
+    assert base.lock_count == 0
+    pool.release(session)
+
+
+def test_failing_clones_back_off_and_raise_from_acquire():
+    vbox, pool = make_pool(size=2)
+    base = vbox.find_machine('base')
+    attempts = []
+
+    def clone(snapshot_name_or_id=None, name=None):
+        attempts.append(name)
+        raise RuntimeError('Clone failed.')
+
+    base.clone = clone
+    pool.start()
+    wait_for(lambda: pool._failures)
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+    time.sleep(0.3)
+    assert len(attempts) <= 4
+    pool.close()
+
+    # The pool is filled again once clones can be created.
+    del base.clone
+    pool.start()
+    session = pool.acquire()
+    assert pool._failures == 0
+    wait_for(lambda: len(pool._idle) == 2)
+    pool.release(session)
+    pool.close()
+    assert vbox.clones() == []
+
+
+def test_acquire_timeout_waiting_for_boot():
+    vbox, pool = make_pool(size=1, boot_time=1.0)
+    pool.start()
+    with pytest.raises(ArtisanException):
+        pool.acquire(timeout=0.1)
+    pool.close()
+
+
+def test_recycle_restores_clone_until_max_reuse():
+    vbox, pool = make_pool(size=1, recycle=True, max_reuse=3)
+    pool.start()
+    wait_for(lambda: len(pool._idle) == 1)
+
+    session = pool.acquire()
+    clone = session.machine
+    assert 'artisanci-clean' in clone.snapshots
+    for i in range(2):
+        pool.release(session)
+        wait_for(lambda: len(pool._idle) == 1 and not pool._pending)
+        session = pool.acquire()
+        assert session.machine is clone
+        assert session.machine.running
+        assert len(vbox.clones()) == 1
+        assert clone.restores == ['artisanci-clean'] * (i + 1)
+
+    pool.release(session)
+    assert clone.name not in vbox.machines
+    pool.close()
+    assert vbox.clones() == []
+
+
+def test_close_keeps_leased_clones_counted():
+    vbox, pool = make_pool(size=2, recycle=True)
+    pool.start()
+    wait_for(lambda: len(pool._idle) == 2)
+    session = pool.acquire()
+    wait_for(lambda: not pool._pending)
+    pool.close()
+    assert pool._leased == 1
+    assert vbox.clones() == [session.machine]
+
+    pool.release(session)
+    assert pool._leased == 0
+    assert pool._uses == {}
+    assert vbox.clones() == []
+
+
+def test_recycle_destroys_unhealthy_clone():
+    vbox, pool = make_pool(size=0, recycle=True, health_check=lambda session: False)
+    session = pool.acquire()
+    clone = session.machine
+    pool.release(session)
+    wait_for(lambda: not pool._pending)
+    assert clone.name not in vbox.machines
+    assert clone.restores == ['artisanci-clean']
+    assert len(pool._idle) == 0
+
+
+def test_fifo_lock_hands_lock_out_in_order():
+    lock = _FifoLock()
+    assert lock.acquire()
+    order = []
+
+    def waiter(i):
+        assert lock.acquire()
+        order.append(i)
+        lock.release()
+
+    threads = []
+    for i in range(5):
+        thread = threading.Thread(target=waiter, args=(i,))
+        thread.start()
+        threads.append(thread)
+        wait_for(lambda: len(lock._waiters) == i + 1)
+    lock.release()
+    for thread in threads:
+        thread.join()
+    assert order == [0, 1, 2, 3, 4]
+
+
+def test_fifo_lock_timeout():
+    lock = _FifoLock()
+    assert lock.acquire()
+    assert not lock.acquire(timeout=0.05)
+    assert len(lock._waiters) == 0
+    lock.release()
+    assert lock.acquire(timeout=0.0)
+    lock.release()
+
+
+def test_lock_retries_while_locked_by_another_process():
+    vbox, pool = make_pool(size=0)
+    base = vbox.find_machine('base')
+    base.locked = True
+    threading.Timer(0.1, lambda: setattr(base, 'locked', False)).start()
+    start_time = time.time()
+    with pool._lock() as session:
+        assert session.machine is base
+    assert time.time() - start_time < 0.9
+    assert not base.locked
+
+
+def test_lock_timeout():
+    vbox, pool = make_pool(size=0)
+    vbox.find_machine('base').locked = True
+    with pytest.raises(ValueError):
+        with pool._lock(timeout_ms=100):
+            pass
+
+
+def test_machine_lookups_cached():
+    vbox, pool = make_pool(size=0)
+    for _ in range(3):
+        pool.release(pool.acquire())
+    # Once for the base machine and once for each clone.
+    assert vbox.find_count == 4
@@ -0,0 +1,43 @@
+import os
+import pytest
+from artisanci.workers import OutputBuffer
+
+
+@pytest.mark.parametrize('max_memory', [None, 4])
+def test_write_and_getvalue(max_memory):
+    buffer = OutputBuffer(max_memory)
+    for chunk in [b'abc', b'def', b'', b'ghi']:
+        buffer.write(chunk)
+    assert len(buffer) == 9
+    assert buffer.getvalue() == b'abcdefghi'
+    assert buffer.spilled == (max_memory is not None)
+
+
+@pytest.mark.parametrize('max_memory', [None, 4])
+def test_read_and_seek(max_memory):
+    buffer = OutputBuffer(max_memory)
+    buffer.write(b'abcdef')
+    assert buffer.read(2) == b'ab'
+    assert buffer.tell() == 2
+    buffer.write(b'ghi')
+    assert buffer.read() == b'cdefghi'
+    assert buffer.read() == b''
+    buffer.seek(-3, os.SEEK_END)
+    assert buffer.read(100) == b'ghi'
+    buffer.seek(0)
+    assert buffer.read(3) == b'abc'
+
+
+def test_seek_negative_raises():
+    buffer = OutputBuffer()
+    with pytest.raises(ValueError):
+        buffer.seek(-1)
+
+
+def test_close_releases_output():
+    with OutputBuffer(1) as buffer:
+        buffer.write(b'abc')
+        assert buffer.spilled
+    assert not buffer.spilled
+    assert len(buffer) == 0
+    assert buffer.getvalue() == b''
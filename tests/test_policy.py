@@ -0,0 +1,120 @@
+import calendar
+import datetime
+import pytest
+from artisanci.policy import BasePolicy, Schedule, TimePolicy
+
+
+class Request(object):
+    def __init__(self, duration):
+        self.duration = duration
+
+
+def utc(*args):
+    return calendar.timegm(datetime.datetime(*args).timetuple())
+
+
+def work_hours(**kwargs):
+    return TimePolicy(start_time=datetime.time(hour=9),
+                      end_time=datetime.time(hour=17), **kwargs)
+
+
+def test_all_day_policy():
+    policy = TimePolicy(all_day=True)
+    assert policy.allow_build_request(Request(10))
+    assert not policy.allow_build_request(Request(60))
+    assert policy.next_transition() is None
+
+
+@pytest.mark.parametrize('now,duration,allowed', [
+    (utc(2017, 6, 1, 8, 59), 5, False),
+    (utc(2017, 6, 1, 9, 0), 5, True),
+    (utc(2017, 6, 1, 16, 52), 5, True),
+    (utc(2017, 6, 1, 16, 53), 5, False),
+    (utc(2017, 6, 1, 16, 0), 30, True),
+    (utc(2017, 6, 1, 16, 30), 30, False),
+    (utc(2017, 6, 1, 23, 0), 5, False)
+])
+def test_time_policy(now, duration, allowed):
+    assert work_hours().allow_build_request(Request(duration), now=now) is allowed
+
+
+def test_time_policy_max_duration():
+    policy = work_hours(max_duration=10)
+    assert not policy.allow_build_request(Request(11), now=utc(2017, 6, 1, 12))
+
+
+def test_time_policy_timezone():
+    policy = work_hours(timezone='US/Central')
+    # 9:00 to 17:00 CDT is 14:00 to 22:00 UTC.
+    assert not policy.allow_build_request(Request(5), now=utc(2017, 6, 1, 13, 59))
+    assert policy.allow_build_request(Request(5), now=utc(2017, 6, 1, 14, 0))
+    assert policy.allow_build_request(Request(5), now=utc(2017, 6, 1, 21, 50))
+    # In the winter it's CST which is an hour later.
+    assert not policy.allow_build_request(Request(5), now=utc(2017, 12, 1, 14, 30))
+    assert policy.allow_build_request(Request(5), now=utc(2017, 12, 1, 15, 0))
+
+
+def test_time_policy_crosses_utc_midnight():
+    policy = TimePolicy(timezone='Asia/Tokyo',
+                        start_time=datetime.time(hour=8),
+                        end_time=datetime.time(hour=10))
+    # 8:00 to 10:00 JST is 23:00 to 1:00 UTC.
+    assert policy.allow_build_request(Request(5), now=utc(2017, 6, 1, 23, 30))
+    assert policy.allow_build_request(Request(5), now=utc(2017, 6, 2, 0, 30))
+    assert not policy.allow_build_request(Request(5), now=utc(2017, 6, 2, 1, 0))
+
+
+def test_next_transition():
+    policy = work_hours()
+    assert policy.next_transition(utc(2017, 6, 1, 8)) == utc(2017, 6, 1, 9)
+    assert policy.next_transition(utc(2017, 6, 1, 12)) == utc(2017, 6, 1, 17)
+    assert policy.next_transition(utc(2017, 6, 1, 18)) == utc(2017, 6, 2, 9)
+
+
+def test_time_policy_windows_are_cached():
+    policy = work_hours()
+    assert policy.windows(17318) is policy.windows(17318)
+
+
+@pytest.mark.parametrize('kwargs', [
+    {},
+    {'start_time': datetime.time(hour=9)},
+    {'all_day': True, 'start_time': datetime.time(hour=9), 'end_time': datetime.time(hour=10)},
+    {'start_time': datetime.time(hour=10), 'end_time': datetime.time(hour=9)},
+    {'all_day': True, 'max_duration': 2}
+])
+def test_time_policy_invalid(kwargs):
+    with pytest.raises(ValueError):
+        TimePolicy(**kwargs)
+
+
+class KeyPolicy(BasePolicy):
+    def allow_build_request(self, request=None):
+        return request is not None and getattr(request, 'key', None) == 'secret'
+
+
+def test_schedule():
+    morning = TimePolicy(start_time=datetime.time(hour=6),
+                         end_time=datetime.time(hour=12))
+    day = work_hours(max_duration=10)
+    key = KeyPolicy()
+    schedule = Schedule([morning, day, key])
+
+    assert schedule.allowed_policies(Request(5), now=utc(2017, 6, 1, 7)) == [morning]
+    assert schedule.allowed_policies(Request(5), now=utc(2017, 6, 1, 10)) == [morning, day]
+    assert schedule.allowed_policies(Request(20), now=utc(2017, 6, 1, 10)) == [morning]
+    assert schedule.allowed_policies(Request(5), now=utc(2017, 6, 1, 11, 55)) == [day]
+    assert not schedule.allow_build_request(Request(5), now=utc(2017, 6, 1, 20))
+
+    request = Request(5)
+    request.key = 'secret'
+    assert schedule.allowed_policies(request, now=utc(2017, 6, 1, 20)) == [key]
+
+
+def test_schedule_add_policy():
+    schedule = Schedule()
+    assert not schedule.allow_build_request(Request(5), now=utc(2017, 6, 1, 12))
+    schedule.add_policy(work_hours())
+    assert schedule.allow_build_request(Request(5), now=utc(2017, 6, 1, 12))
+    with pytest.raises(TypeError):
+        schedule.add_policy(object())
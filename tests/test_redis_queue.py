@@ -0,0 +1,154 @@
+import time
+import pytest
+from artisanci import BaseBuilder, Farm, LocalBuild
+from artisanci.policy import BasePolicy
+from artisanci.redis_queue import RedisJobQueue
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+class QuickBuilder(BaseBuilder):
+    def __init__(self):
+        super(QuickBuilder, self).__init__(python='python', builders=1)
+
+    def _build_target(self, build):
+        build._set_status('success')
+
+
+class SwitchPolicy(BasePolicy):
+    def __init__(self):
+        self.allow = False
+
+    def allow_build_request(self, request=None):
+        return self.allow
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeStrictRedis()
+
+
+def make_queue(client, consumer, **kwargs):
+    return RedisJobQueue(client, name='test:jobs', consumer=consumer, **kwargs)
+
+
+def test_claim_and_ack(client):
+    queue = make_queue(client, 'farm-1')
+    job_id = queue.put(LocalBuild('tests.py', 5), community=True)
+    [(claimed_id, build, community)] = queue.claim(count=10)
+    assert claimed_id == job_id
+    assert build.script == 'tests.py'
+    assert community
+    assert queue.pending() == 1
+    assert queue.result(job_id) is None
+
+    queue.ack(job_id, 'success')
+    assert queue.pending() == 0
+    assert queue.result(job_id) == 'success'
+
+
+def test_builds_are_only_claimed_once(client):
+    first = make_queue(client, 'farm-1')
+    second = make_queue(client, 'farm-2')
+    for i in range(4):
+        first.put(LocalBuild(str(i), 5))
+    claimed = first.claim(count=3) + second.claim(count=3)
+    assert sorted(build.script for _, build, _ in claimed) == ['0', '1', '2', '3']
+    assert second.claim() == []
+
+
+def test_lost_builds_are_reclaimed(client):
+    first = make_queue(client, 'farm-1', visibility_timeout=0.1)
+    second = make_queue(client, 'farm-2', visibility_timeout=0.1)
+    job_id = first.put(LocalBuild('tests.py', 5))
+    assert len(first.claim()) == 1
+    assert second.claim() == []
+
+    time.sleep(0.2)
+    [(claimed_id, _, _)] = second.claim()
+    assert claimed_id == job_id
+
+
+def test_extended_builds_are_not_reclaimed(client):
+    first = make_queue(client, 'farm-1', visibility_timeout=0.2)
+    second = make_queue(client, 'farm-2', visibility_timeout=0.2)
+    job_id = first.put(LocalBuild('tests.py', 5))
+    first.claim()
+    time.sleep(0.15)
+    first.extend([job_id])
+    time.sleep(0.1)
+    assert second.claim() == []
+
+
+def test_builds_fail_after_max_attempts(client):
+    queue = make_queue(client, 'farm-1', visibility_timeout=0.1, max_attempts=1)
+    job_id = queue.put(LocalBuild('tests.py', 5))
+    queue.claim()
+    time.sleep(0.2)
+    assert queue.claim() == []
+    assert queue.result(job_id) == 'failure'
+    assert queue.pending() == 0
+
+
+def test_farm_claims_from_remote(client, tmpdir):
+    remote = make_queue(client, 'farm-1')
+    job_id = remote.put(LocalBuild('tests.py', 5))
+    farm = Farm(str(tmpdir.join('farm.db')), remote=remote)
+    builder = QuickBuilder()
+    farm.add_builder(builder)
+    deadline = time.time() + 10.0
+    while remote.result(job_id) is None and time.time() < deadline:
+        farm.step()
+        time.sleep(0.01)
+    assert remote.result(job_id) == 'success'
+    assert remote.pending() == 0
+    builder.shutdown()
+    farm.close()
+
+
+def test_release(client):
+    first = make_queue(client, 'farm-1')
+    second = make_queue(client, 'farm-2')
+    job_id = first.put(LocalBuild('tests.py', 5))
+    [(_, build, _)] = first.claim()
+    new_id = first.release(job_id, build)
+    assert new_id != job_id
+    assert first.pending() == 0
+    [(claimed_id, build, _)] = second.claim()
+    assert claimed_id == new_id
+    assert build.script == 'tests.py'
+
+
+def test_farm_only_claims_allowed_builds(client, tmpdir):
+    remote = make_queue(client, 'farm-1')
+    job_id = remote.put(LocalBuild('tests.py', 5))
+    policy = SwitchPolicy()
+    farm = Farm(str(tmpdir.join('farm.db')), remote=remote, policy=policy)
+    builder = QuickBuilder()
+    farm.add_builder(builder)
+    assert farm.step() == 0
+    assert remote.pending() == 0
+    assert farm.queue.counts()['queued'] == 0
+
+    policy.allow = True
+    deadline = time.time() + 10.0
+    while remote.result(job_id) is None and time.time() < deadline:
+        farm.step()
+        time.sleep(0.01)
+    assert remote.result(job_id) == 'success'
+    builder.shutdown()
+    farm.close()
+
+
+def test_farm_claims_only_free_slots(client, tmpdir):
+    remote = make_queue(client, 'farm-1')
+    for i in range(3):
+        remote.put(LocalBuild(str(i), 5))
+    farm = Farm(str(tmpdir.join('farm.db')), remote=remote)
+    farm.submit(LocalBuild('local', 5))
+    builder = QuickBuilder()
+    farm.add_builder(builder)
+    assert farm.step() == 1
+    assert remote.pending() == 0
+    builder.shutdown()
+    farm.close()
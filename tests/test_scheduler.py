@@ -0,0 +1,281 @@
+import pytest
+from artisanci import JobSpec, RuntimeHistory, Scheduler
+from artisanci.exceptions import ArtisanException
+
+
+class FakeBuilder(object):
+    def __init__(self, builders=1, is_secure=False):
+        self.builders = builders
+        self.is_secure = is_secure
+
+
+def job(script='tests.py', **requires):
+    return JobSpec(script, 5, requires=requires)
+
+
+def test_match_exact_labels():
+    scheduler = Scheduler()
+    linux = FakeBuilder()
+    windows = FakeBuilder()
+    scheduler.add_builder(linux, {'platform': 'linux', 'python': 'cpython==3.6'})
+    scheduler.add_builder(windows, {'platform': 'windows', 'python': 'cpython==3.6'})
+    assert scheduler.match({'platform': 'linux'}) == [linux]
+    assert set(scheduler.match({'python': 'cpython==3.6'})) == {linux, windows}
+    assert scheduler.match({'platform': 'osx'}) == []
+    assert scheduler.match({'platform': 'linux', 'virtualbox': '>=5.1'}) == []
+    assert set(scheduler.match({})) == {linux, windows}
+
+
+@pytest.mark.parametrize('requires,expected', [
+    ('cpython', ['2.7', '3.6', '3.10']),
+    ('cpython==3.6', ['3.6']),
+    ('cpython!=3.6', ['2.7', '3.10']),
+    ('cpython>=3.6', ['3.6', '3.10']),
+    ('cpython>3.6', ['3.10']),
+    ('cpython<=3.6', ['2.7', '3.6']),
+    ('cpython<3.6', ['2.7']),
+    ('pypy', [])
+])
+def test_match_versions(requires, expected):
+    scheduler = Scheduler()
+    builders = {}
+    for version in ['2.7', '3.6', '3.10']:
+        builders[version] = FakeBuilder()
+        scheduler.add_builder(builders[version], {'python': 'cpython==' + version})
+    matches = scheduler.match({'python': requires})
+    assert set(matches) == set(builders[version] for version in expected)
+
+
+def test_match_version_only_labels():
+    scheduler = Scheduler()
+    builder = FakeBuilder()
+    scheduler.add_builder(builder, {'virtualbox': '5.1.22'})
+    assert scheduler.match({'virtualbox': '>=5.1.14'}) == [builder]
+    assert scheduler.match({'virtualbox': '>=5.2'}) == []
+
+
+def test_builder_advertises_many_values():
+    scheduler = Scheduler()
+    builder = FakeBuilder()
+    scheduler.add_builder(builder, {'python': ['cpython==2.7', 'cpython==3.6']})
+    assert scheduler.match({'python': 'cpython==2.7'}) == [builder]
+    assert scheduler.match({'python': 'cpython!=2.7'}) == [builder]
+    assert scheduler.match({'python': 'cpython==3.5'}) == []
+
+
+def test_builders_must_advertise_exact_labels():
+    scheduler = Scheduler()
+    with pytest.raises(ValueError):
+        scheduler.add_builder(FakeBuilder(), {'python': 'cpython>=3.6'})
+    with pytest.raises(ArtisanException):
+        scheduler.add_builder(FakeBuilder(), {'python': 'cpython=='})
+
+
+def test_community_jobs_only_match_secure_builders():
+    scheduler = Scheduler()
+    secure = FakeBuilder(is_secure=True)
+    insecure = FakeBuilder()
+    scheduler.add_builder(secure, {'platform': 'linux'})
+    scheduler.add_builder(insecure, {'platform': 'linux'})
+    assert set(scheduler.match({'platform': 'linux'})) == {secure, insecure}
+    assert scheduler.match({'platform': 'linux'}, community=True) == [secure]
+    assert scheduler.match({}, community=True) == [secure]
+
+
+def test_schedule_fills_free_slots():
+    scheduler = Scheduler()
+    builder = FakeBuilder(builders=2)
+    scheduler.add_builder(builder, {'platform': 'linux'})
+    jobs = [job(str(i), platform='linux') for i in range(3)]
+    for spec in jobs:
+        scheduler.submit(spec)
+    assert scheduler.pending == 3
+
+    assert scheduler.schedule() == [(jobs[0], builder), (jobs[1], builder)]
+    assert scheduler.schedule() == []
+    assert scheduler.pending == 1
+
+    scheduler.complete(builder)
+    assert scheduler.schedule() == [(jobs[2], builder)]
+    assert scheduler.pending == 0
+
+
+def test_schedule_skips_blocked_jobs():
+    scheduler = Scheduler()
+    linux = FakeBuilder()
+    windows = FakeBuilder()
+    scheduler.add_builder(linux, {'platform': 'linux'})
+    scheduler.add_builder(windows, {'platform': 'windows'})
+    first = job('first', platform='linux')
+    second = job('second', platform='linux')
+    third = job('third', platform='windows')
+    for spec in [first, second, third]:
+        scheduler.submit(spec)
+    assert scheduler.schedule() == [(first, linux), (third, windows)]
+
+
+def test_schedule_packs_onto_fullest_builder():
+    scheduler = Scheduler()
+    small = FakeBuilder(builders=1)
+    large = FakeBuilder(builders=4)
+    scheduler.add_builder(small, {'platform': 'linux'})
+    scheduler.add_builder(large, {'platform': 'linux', 'virtualbox': '5.1.22'})
+    first = job('first', platform='linux')
+    second = job('second', virtualbox='>=5.1')
+    scheduler.submit(first)
+    scheduler.submit(second)
+    assert scheduler.schedule() == [(first, small), (second, large)]
+
+
+def test_unmatched_jobs_wait_for_builders():
+    scheduler = Scheduler()
+    spec = job(platform='osx')
+    scheduler.submit(spec)
+    assert scheduler.schedule() == []
+
+    builder = FakeBuilder()
+    scheduler.add_builder(builder, {'platform': 'osx'})
+    assert scheduler.schedule() == [(spec, builder)]
+
+
+def test_remove_builder():
+    scheduler = Scheduler()
+    builder = FakeBuilder()
+    scheduler.add_builder(builder, {'platform': 'linux'})
+    scheduler.remove_builder(builder)
+    assert scheduler.builders == []
+    assert scheduler.match({'platform': 'linux'}) == []
+    scheduler.submit(job(platform='linux'))
+    assert scheduler.schedule() == []
+    scheduler.complete(builder)
+
+
+def test_complete_without_jobs():
+    scheduler = Scheduler()
+    builder = FakeBuilder()
+    scheduler.add_builder(builder)
+    with pytest.raises(ValueError):
+        scheduler.complete(builder)
+
+
+def test_runtime_history_estimate():
+    history = RuntimeHistory(window=4, weight=2.0)
+    spec = job(platform='linux')
+    assert history.estimate(spec) == 5.0
+    history.record(spec, 11.0)
+    assert history.estimate(spec) == pytest.approx((2 * 5.0 + 11.0) / 3)
+    history.record(spec, 11.0)
+    assert history.estimate(spec) == pytest.approx((2 * 5.0 + 2 * 11.0) / 4)
+
+    # Runtimes are kept separately for each script and requires.
+    assert history.estimate(job(platform='windows')) == 5.0
+    assert history.estimate(job('other.py', platform='linux')) == 5.0
+
+
+def test_runtime_history_moving_average():
+    history = RuntimeHistory(window=2, weight=0.0)
+    spec = job()
+    for duration in [1.0, 1.0, 9.0, 9.0, 9.0]:
+        history.record(spec, duration)
+    assert history.estimate(spec) == 8.0
+
+
+def test_runtime_history_max_entries():
+    history = RuntimeHistory(weight=0.0, max_entries=2)
+    specs = [job(str(i)) for i in range(3)]
+    for spec in specs:
+        history.record(spec, 1.0)
+    assert history.estimate(specs[0]) == 5.0
+    assert history.estimate(specs[2]) == 1.0
+
+
+def duration_job(script, duration):
+    return JobSpec(script, duration, requires={'platform': 'linux'})
+
+
+@pytest.mark.parametrize('order,expected', [
+    ('fifo', ['medium', 'short', 'long']),
+    ('shortest', ['short', 'medium', 'long']),
+    ('longest', ['long', 'medium', 'short'])
+])
+def test_schedule_order(order, expected):
+    scheduler = Scheduler(order=order)
+    builder = FakeBuilder()
+    scheduler.add_builder(builder, {'platform': 'linux'})
+    for script, duration in [('medium', 10), ('short', 1), ('long', 30)]:
+        scheduler.submit(duration_job(script, duration))
+    scripts = []
+    for _ in range(3):
+        [(spec, _)] = scheduler.schedule()
+        scripts.append(spec.script)
+        scheduler.complete(builder)
+    assert scripts == expected
+
+
+def test_schedule_order_uses_history():
+    scheduler = Scheduler(order='shortest')
+    builder = FakeBuilder()
+    scheduler.add_builder(builder, {'platform': 'linux'})
+    slow = duration_job('slow', 1)
+    for _ in range(5):
+        scheduler.history.record(slow, 20.0)
+    scheduler.submit(slow)
+    scheduler.submit(duration_job('fast', 5))
+    [(spec, _)] = scheduler.schedule()
+    assert spec.script == 'fast'
+
+
+def test_longest_spreads_over_least_loaded_builders():
+    scheduler = Scheduler(order='longest')
+    small = FakeBuilder(builders=1)
+    large = FakeBuilder(builders=2)
+    scheduler.add_builder(small, {'platform': 'linux'})
+    scheduler.add_builder(large, {'platform': 'linux'})
+    for script, duration in [('a', 5), ('b', 20), ('c', 10)]:
+        scheduler.submit(duration_job(script, duration))
+    assignments = [(spec.script, builder) for spec, builder in scheduler.schedule()]
+    assert [script for script, _ in assignments] == ['b', 'c', 'a']
+
+    # The two longest jobs don't share a builder.
+    assert assignments[0][1] is not assignments[1][1]
+    assert assignments[2][1] is large
+
+
+def test_invalid_order():
+    with pytest.raises(ValueError):
+        Scheduler(order='random')
+
+
+def test_complete_records_runtime():
+    scheduler = Scheduler()
+    builder = FakeBuilder()
+    scheduler.add_builder(builder, {'platform': 'linux'})
+    spec = duration_job('tests', 10)
+    scheduler.submit(spec)
+    assert scheduler.schedule() == [(spec, builder)]
+    scheduler.complete(builder, spec, 4.0)
+    assert scheduler.history.estimate(spec) < 10.0
+
+
+def test_numeric_labels():
+    scheduler = Scheduler()
+    builder = FakeBuilder()
+    scheduler.add_builder(builder, {'python': 3.6})
+    spec = job(python=3.6)
+    scheduler.submit(spec)
+    assert scheduler.schedule() == [(spec, builder)]
+
+
+def test_bad_labels_raise_on_submit():
+    scheduler = Scheduler()
+    builder = FakeBuilder()
+    scheduler.add_builder(builder, {'platform': 'linux'})
+    with pytest.raises(ArtisanException):
+        scheduler.submit(job(platform=['linux']))
+    with pytest.raises(ArtisanException):
+        scheduler.submit(job(python='cpython=='))
+    assert scheduler.pending == 0
+
+    spec = job(platform='linux')
+    scheduler.submit(spec)
+    assert scheduler.schedule() == [(spec, builder)]
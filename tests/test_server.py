@@ -0,0 +1,94 @@
+import os
+import time
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('flask_sqlalchemy')
+pytest.importorskip('flask_redis')
+
+os.environ.setdefault('SECRET_KEY', 'secret')
+os.environ.setdefault('BUILDER_TOKEN', 'token')
+
+from artisanci.server import app, db  # noqa: E402
+from artisanci.server.mod_login.models import Auth  # noqa: E402
+from artisanci.server.mod_project.models import Batch, Build, Project  # noqa: E402
+
+AUTHORIZATION = {'Authorization': 'Token %s' % os.environ['BUILDER_TOKEN']}
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.fixture
+def build_url():
+    with app.app_context():
+        owner = Auth(type='gh', name='owner')
+        project = Project(type='gh', url='https://github.com/owner/project',
+                          name='project', owner=owner)
+        batch = Batch(project=project)
+        build = Build(batch=batch, script='test')
+        db.session.add_all([owner, project, batch, build])
+        db.session.commit()
+        return '/projects/gh/owner/project/%d/%d' % (batch.id, build.id)
+
+
+def test_append_and_read_output(client, build_url):
+    for data in [b'abc', b'def']:
+        response = client.post(build_url + '/output', data=data, headers=AUTHORIZATION)
+        assert response.status_code == 204
+
+    response = client.get(build_url)
+    assert response.status_code == 200
+    assert response.data == b'abcdef'
+    assert response.headers['X-Output-Size'] == '6'
+    assert response.headers['X-Build-Finished'] == 'false'
+
+    response = client.get(build_url + '?offset=-2')
+    assert response.data == b'ef'
+    assert response.headers['X-Output-Next-Offset'] == '6'
+
+
+def test_read_range(client, build_url):
+    client.post(build_url + '/output', data=b'abcdef', headers=AUTHORIZATION)
+    response = client.get(build_url, headers={'Range': 'bytes=1-3'})
+    assert response.status_code == 206
+    assert response.data == b'bcd'
+    assert response.headers['Content-Range'] == 'bytes 1-3/6'
+
+
+def test_empty_range_has_no_content(client, build_url):
+    client.post(build_url + '/output', data=b'abc', headers=AUTHORIZATION)
+    response = client.get(build_url, headers={'Range': 'bytes=3-'})
+    assert response.status_code == 204
+    assert 'Content-Range' not in response.headers
+    assert response.headers['X-Output-Next-Offset'] == '3'
+
+
+def test_append_requires_token(client, build_url):
+    response = client.post(build_url + '/output', data=b'abc',
+                           headers={'Authorization': 'Token wrong'})
+    assert response.status_code == 403
+    assert client.post(build_url + '/output', data=b'abc').status_code == 403
+    assert client.get(build_url).data == b''
+
+
+def test_finished_build(client, build_url):
+    response = client.post(build_url + '/output?finished=true', data=b'abc',
+                           headers=AUTHORIZATION)
+    assert response.status_code == 204
+
+    start = time.time()
+    response = client.get(build_url + '?offset=3&wait=10')
+    assert time.time() - start < 5.0
+    assert response.data == b''
+    assert response.headers['X-Build-Finished'] == 'true'
+
+    response = client.post(build_url + '/output', data=b'def', headers=AUTHORIZATION)
+    assert response.status_code == 409
+
+
+def test_unknown_build(client, build_url):
+    assert client.get('/projects/gh/owner/project/1/1000').status_code == 404
+    assert client.get('/projects/gh/owner/project/x/1').status_code == 404
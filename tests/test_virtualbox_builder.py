@@ -0,0 +1,89 @@
+from artisanci import LocalBuild
+from artisanci.builders.virtualbox_builder import _stream_guest_process
+from virtualbox.library import ProcessStatus
+
+
+class FakeGuestProcess(object):
+    def __init__(self, output, exit_code=0):
+        # List of (handle, data) tuples that become readable one per wait.
+        self.output = list(output)
+        self.exit_code = exit_code
+        self.buffers = {1: b'', 2: b''}
+        self.terminated = False
+
+    @property
+    def status(self):
+        if self.terminated:
+            return ProcessStatus.terminated_signal
+        if self.output:
+            return ProcessStatus.started
+        return ProcessStatus.terminated_normally
+
+    def wait_for_array(self, flags, timeout_ms):
+        if self.output:
+            handle, data = self.output.pop(0)
+            self.buffers[handle] += data
+
+    def read(self, handle, to_read, timeout_ms):
+        data = self.buffers[handle][:to_read]
+        self.buffers[handle] = self.buffers[handle][to_read:]
+        return data
+
+    def terminate(self):
+        self.terminated = True
+
+
+class OutputWatcher(object):
+    def __init__(self, cancel_after=None):
+        self.events = []
+        self.cancel_after = cancel_after
+
+    def on_command_output(self, build, data):
+        self.events.append(('output', data))
+        if self.cancel_after is not None and len(self.events) >= self.cancel_after:
+            build.cancel()
+
+    def on_command_error(self, build, data):
+        self.events.append(('error', data))
+
+
+def make_build(watcher):
+    build = LocalBuild('script', 1, path='.')
+    build.add_watcher(watcher)
+    return build
+
+
+def test_guest_output_streamed_to_watchers():
+    watcher = OutputWatcher()
+    process = FakeGuestProcess([(1, b'a\n'), (2, b'b\n'), (1, b'c\n')], exit_code=3)
+    assert _stream_guest_process(make_build(watcher), process) == 3
+    assert watcher.events == [('output', b'a\n'), ('error', b'b\n'), ('output', b'c\n')]
+
+
+def test_guest_output_large_chunks_drained():
+    watcher = OutputWatcher()
+    data = b'x' * (200 * 1024)
+    process = FakeGuestProcess([(1, data)])
+    assert _stream_guest_process(make_build(watcher), process) == 0
+    assert b''.join(data for _, data in watcher.events) == data
+    assert all(len(data) <= 64 * 1024 for _, data in watcher.events)
+
+
+def test_guest_output_cap_cancels_build():
+    watcher = OutputWatcher()
+    build = make_build(watcher)
+    process = FakeGuestProcess([(1, b'12345'), (1, b'67890'), (1, b'abc')])
+    assert _stream_guest_process(build, process, max_output=8) is None
+    assert build.cancelled
+    assert process.terminated
+    assert watcher.events[:2] == [('output', b'12345'), ('output', b'678')]
+    assert watcher.events[2][0] == 'error'
+    assert len(watcher.events) == 3
+
+
+def test_guest_process_terminated_when_cancelled():
+    watcher = OutputWatcher(cancel_after=1)
+    process = FakeGuestProcess([(1, b'a\n'), (1, b'b\n')])
+    assert _stream_guest_process(make_build(watcher), process) is None
+    assert process.terminated
+    assert watcher.events == [('output', b'a\n')]
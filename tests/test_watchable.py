@@ -0,0 +1,171 @@
+import gc
+import pickle
+import threading
+import time
+import weakref
+import pytest
+from artisanci.watchable import Watchable
+
+
+class Recorder(object):
+    def __init__(self, block=None):
+        self.events = []
+        self.block = block
+
+    def on_command_output(self, watchable, data):
+        if self.block is not None:
+            self.block.wait()
+        self.events.append(('command_output', data))
+
+    def on_status_change(self, watchable, data):
+        self.events.append(('status_change', data))
+
+
+def test_notify_watchers_synchronous():
+    watchable = Watchable()
+    recorder = Recorder()
+    watchable.add_watcher(recorder)
+    watchable.add_watcher(object())
+    watchable.notify_watchers('command_output', b'a')
+    watchable.notify_watchers('unknown', None)
+    assert recorder.events == [('command_output', b'a')]
+
+
+def test_dispatch_async_coalesces_output():
+    watchable = Watchable()
+    block = threading.Event()
+    recorder = Recorder(block=block)
+    watchable.add_watcher(recorder)
+    watchable.dispatch_async()
+
+    watchable.notify_watchers('command_output', b'a')
+    for data in [b'b', b'c', b'd']:
+        watchable.notify_watchers('command_output', data)
+    watchable.notify_watchers('status_change', 'success')
+    watchable.notify_watchers('command_output', b'e')
+    block.set()
+    assert watchable.flush_watchers(timeout=5.0)
+
+    output = [data for event, data in recorder.events if event == 'command_output']
+    assert b''.join(output) == b'abcde'
+    assert len(output) < 5
+    assert recorder.events.index(('status_change', 'success')) == len(recorder.events) - 2
+
+
+def test_dispatch_async_drop_policy():
+    watchable = Watchable()
+    block = threading.Event()
+    recorder = Recorder(block=block)
+    watchable.add_watcher(recorder)
+    watchable.dispatch_async(max_queued=2, policy='drop')
+
+    for i in range(10):
+        watchable.notify_watchers('command_output', b'x')
+    assert watchable.dropped_events > 0
+    # Other events wait for space in the queue instead of being dropped.
+    threading.Timer(0.1, block.set).start()
+    watchable.notify_watchers('status_change', 'success')
+    assert watchable.flush_watchers(timeout=5.0)
+    assert ('status_change', 'success') in recorder.events
+
+
+def test_flush_watchers_timeout():
+    watchable = Watchable()
+    block = threading.Event()
+    watchable.add_watcher(Recorder(block=block))
+    watchable.dispatch_async()
+    watchable.notify_watchers('command_output', b'x')
+    assert not watchable.flush_watchers(timeout=0.05)
+    block.set()
+    assert watchable.flush_watchers(timeout=5.0)
+
+
+def test_dispatch_async_survives_pickle():
+    watchable = Watchable()
+    watchable.dispatch_async(max_queued=8)
+    watchable.notify_watchers('command_output', b'x')
+    watchable.flush_watchers()
+    copy = pickle.loads(pickle.dumps(watchable))
+    recorder = Recorder()
+    copy.add_watcher(recorder)
+    copy.notify_watchers('command_output', b'y')
+    assert copy.flush_watchers(timeout=5.0)
+    assert recorder.events == [('command_output', b'y')]
+
+
+@pytest.mark.parametrize('kwargs', [{'policy': 'ignore'}, {'max_queued': 0}])
+def test_dispatch_async_bad_arguments(kwargs):
+    with pytest.raises(ValueError):
+        Watchable().dispatch_async(**kwargs)
+
+
+class Proxy(object):
+    def __init__(self, target):
+        self.target = target
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+
+def test_notify_watchers_instance_handlers():
+    watchable = Watchable()
+    events = []
+    watcher = Recorder()
+    watcher.on_command_output = lambda _, data: events.append(data)
+    proxy = Proxy(Recorder())
+    watchable.add_watcher(Recorder())
+    watchable.add_watcher(watcher)
+    watchable.add_watcher(proxy)
+    watchable.notify_watchers('command_output', b'a')
+    assert events == [b'a']
+    assert watcher.events == []
+    assert proxy.target.events == [('command_output', b'a')]
+
+
+def test_dispatch_async_logs_watcher_errors(caplog):
+    class Failing(object):
+        def on_status_change(self, watchable, data):
+            raise ValueError('Watcher failed.')
+
+    watchable = Watchable()
+    watchable.add_watcher(Failing())
+    watchable.dispatch_async()
+    watchable.notify_watchers('status_change', 'success')
+    assert watchable.flush_watchers(timeout=5.0)
+    assert 'Watcher failed.' in caplog.text
+
+
+def test_close_watchers_stops_thread():
+    watchable = Watchable()
+    recorder = Recorder()
+    watchable.add_watcher(recorder)
+    watchable.dispatch_async()
+    watchable.notify_watchers('command_output', b'a')
+    assert watchable.close_watchers(timeout=5.0)
+    assert recorder.events == [('command_output', b'a')]
+    assert watchable._dispatcher is None
+
+    # Sending more events starts the thread again.
+    watchable.notify_watchers('command_output', b'b')
+    assert watchable.close_watchers(timeout=5.0)
+    assert recorder.events == [('command_output', b'a'), ('command_output', b'b')]
+
+
+def test_dispatcher_threads_stop_when_watchables_are_collected():
+    threads = threading.active_count()
+    references = []
+    for _ in range(20):
+        watchable = Watchable()
+        watchable.add_watcher(Recorder())
+        watchable.dispatch_async()
+        watchable.notify_watchers('command_output', b'a')
+        assert watchable.flush_watchers(timeout=5.0)
+        references.append(weakref.ref(watchable))
+    del watchable
+    gc.collect()
+    assert all(reference() is None for reference in references)
+
+    deadline = time.time() + 5.0
+    while threading.active_count() > threads and time.time() < deadline:
+        time.sleep(0.05)
+    assert threading.active_count() <= threads
@@ -2,7 +2,7 @@ import os
 import tempfile
 import random
 import pytest
-from artisanci import ArtisanException
+from artisanci import ArtisanException, JobSpec, LocalBuild
 from artisanci.yml import ArtisanYml
 from artisanci.yml.requires_parser import parse_requires
 from artisanci.yml.env_parser import parse_env
@@ -322,6 +322,19 @@ def test_matrix_with_multi_omit():
         assert element in requires
 
 
+@pytest.mark.parametrize('matrix, expected', [
+    ({'x': [True, False], 'omit': [{'x': 1}]}, [{'x': False}]),
+    ({'python': [3, 3.7], 'omit': [{'python': 3.0}]}, [{'python': 3.7}])
+])
+def test_matrix_omit_matches_equal_values(matrix, expected):
+    assert parse_requires({'matrix': matrix}) == expected
+
+
+def test_omit_matches_equal_values_outside_matrix():
+    requires = {'include': [{'x': True}, {'x': 2}], 'omit': [{'x': 1}]}
+    assert parse_requires(requires) == [{'x': 2}]
+
+
 def test_matrix_omit_key_not_in_matrix():
     requires = {'matrix': {'a': ['1', '2'],
                            'b': ['1', '2'],
@@ -401,6 +414,72 @@ def test_omit_at_global_level():
     assert requires == [{'a': '2', 'b': '3'}]
 
 
+def test_matrix_jobs_share_labels_and_environment():
+    yml = ArtisanYml.from_string("""
+    builds:
+      - script: script1
+        duration: 5
+        env:
+          A: '1'
+        requires:
+          os: linux
+          matrix:
+            python: ['cpython==2.7', 'cpython==3.6']
+      - script: script1
+        duration: 5
+        requires:
+          os: linux
+          python: 'cpython==2.7'
+    """, cache=False)
+    assert all(isinstance(job, JobSpec) for job in yml.jobs)
+    assert yml.jobs[0].environment is yml.jobs[1].environment
+    assert yml.jobs[0].requires is yml.jobs[2].requires
+    assert yml.jobs[2].environment == {}
+
+
+def test_job_spec_is_immutable():
+    job = JobSpec('script', 5, requires={'a': '1'})
+    with pytest.raises(AttributeError):
+        job.script = 'other'
+    with pytest.raises(TypeError):
+        job.requires['a'] = '2'
+
+
+def test_job_spec_creates_build():
+    job = JobSpec('script', 5, requires={'a': '1'}, environment={'B': '2'})
+    build = job.create_build(LocalBuild, path='.')
+    assert isinstance(build, LocalBuild)
+    assert build.script == 'script'
+    assert build.requires == {'a': '1'}
+    build.environment['C'] = '3'
+    assert job.environment == {'B': '2'}
+
+
+def test_duplicate_groups_removed():
+    requires = {'include': [{'a': '1'}, {'a': '1'}],
+                'matrix': {'a': ['1', '2']}}
+    assert parse_requires(requires) == [{'a': '1'}, {'a': '2'}]
+
+
+def test_expanded_requires_are_copies():
+    requires = {'matrix': {'a': ['1', '2']}}
+    groups = parse_requires(requires)
+    groups[0]['b'] = '3'
+    assert parse_requires(requires) == [{'a': '1'}, {'a': '2'}]
+
+
+def test_large_matrix_with_omit():
+    requires = {'matrix': {'a': [str(i) for i in range(10)],
+                           'b': [str(i) for i in range(10)],
+                           'c': [str(i) for i in range(10)],
+                           'd': [str(i) for i in range(10)],
+                           'omit': [{'a': '0'}, {'b': '1', 'c': '2'}]}}
+    requires = parse_requires(requires)
+    assert len(requires) == 9 * 10 * 10 * 10 - 9 * 10
+    assert not any(group['a'] == '0' for group in requires)
+    assert not any(group['b'] == '1' and group['c'] == '2' for group in requires)
+
+
 @pytest.mark.parametrize('requires', [(1,), 1, 's', []])
 def test_wrong_types_requires(requires):
     with pytest.raises(ArtisanException):
@@ -460,3 +539,26 @@ def test_completely_wrong_type(env):
 
 def test_convert_yaml_types_to_strings():
     assert parse_env({'true': True, 'false': False, 'int': 1}) == {'true': 'true', 'false': 'false', 'int': '1'}
+
+
+def test_expand_requires_keeps_value_types():
+    assert parse_requires({'secure': 1}) == [{'secure': 1}]
+    groups = parse_requires({'secure': True})
+    assert groups == [{'secure': True}]
+    assert groups[0]['secure'] is True
+
+    groups = parse_requires({'include': [{'a': 1}, {'a': True}, {'a': 1.0}]})
+    assert [type(group['a']) for group in groups] == [int, bool, float]
+
+
+def test_job_spec_keeps_value_types():
+    first = JobSpec('script', 5, environment={'COUNT': 1})
+    second = JobSpec('script', 5, environment={'COUNT': True})
+    assert first.environment['COUNT'] is not True
+    assert second.environment['COUNT'] is True
+
+
+def test_job_spec_freezes_nested_values():
+    job = JobSpec('script', 5, environment={'A': [1, {'b': [2]}]})
+    assert job.environment['A'] == (1, {'b': (2,)})
+    assert hash(job) == hash(JobSpec('script', 5, environment={'A': [1, {'b': [2]}]}))